@@ -0,0 +1,206 @@
+"""
+Carga rápida de checkpoints de un solo archivo (.safetensors / .ckpt)
+La primera carga convierte el archivo al formato diffusers y lo guarda en una
+caché indexada por el hash del contenido; las siguientes cargas leen
+directamente esa carpeta convertida.
+
+Los hashes de archivo se persisten por (ruta, tamaño, mtime) en
+FILE_HASH_INDEX_PATH, así que un proceso nuevo no vuelve a leer varios GB
+para calcular el hash de un checkpoint que no ha cambiado.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+CONVERTED_DIR = Path(os.getenv("CONVERTED_MODELS_DIR", str(BASE_DIR / "cache" / "converted")))
+FILE_HASH_INDEX_PATH = Path(os.getenv("FILE_HASH_INDEX_PATH", str(BASE_DIR / "cache" / "file_hashes.json")))
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Componentes de un pipeline que pueden pasarse ya cargados
+COMPONENT_NAMES = ("unet", "text_encoder", "vae", "tokenizer", "scheduler")
+
+# ruta -> {"size", "mtime_ns", "hash"}; se carga de FILE_HASH_INDEX_PATH la primera vez
+_hash_memo: Optional[dict] = None
+_hash_lock = threading.Lock()
+
+
+def _read_hash_index() -> dict:
+    try:
+        with open(FILE_HASH_INDEX_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hash_index(path_key: str, record: dict):
+    """Añade un hash al índice en disco (mezclando lo que hayan escrito otros procesos)"""
+    try:
+        data = _read_hash_index()
+        data[path_key] = record
+        FILE_HASH_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w",
+            encoding="utf-8",
+            dir=FILE_HASH_INDEX_PATH.parent,
+            prefix=f"{FILE_HASH_INDEX_PATH.name}.",
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            json.dump(data, f, indent=2)
+        os.replace(f.name, FILE_HASH_INDEX_PATH)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el índice de hashes: {e}")
+
+
+def file_content_hash(path: Path) -> str:
+    """
+    SHA-256 del contenido de un archivo.
+
+    Se memoriza por (ruta, tamaño, mtime) en memoria y en FILE_HASH_INDEX_PATH
+    para no releer varios GB en cada carga ni en cada arranque.
+    """
+    global _hash_memo
+    path = Path(path)
+    stat = path.stat()
+    path_key = str(path.resolve())
+    with _hash_lock:
+        if _hash_memo is None:
+            _hash_memo = _read_hash_index()
+        record = _hash_memo.get(path_key)
+        if record and record.get("size") == stat.st_size and record.get("mtime_ns") == stat.st_mtime_ns:
+            return record["hash"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()
+
+    record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": content_hash}
+    with _hash_lock:
+        _hash_memo[path_key] = record
+        _save_hash_index(path_key, record)
+    return content_hash
+
+
+class LoadTimings:
+    """Tiempos de carga en frío (conversión) y en caliente por modelo"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timings: dict = {}
+
+    def record(self, model_key: str, kind: str, seconds: float):
+        with self._lock:
+            timing = self._timings.setdefault(model_key, {})
+            timing[f"{kind}_seconds"] = round(seconds, 2)
+            timing["last"] = kind
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {key: dict(value) for key, value in self._timings.items()}
+
+
+load_timings = LoadTimings()
+
+
+def converted_path(checkpoint_path: Path, content_hash: Optional[str] = None) -> Path:
+    """
+    Carpeta diffusers correspondiente a un checkpoint de un solo archivo.
+    Siempre se guarda en float32: cada carga la pasa después a su dtype.
+    """
+    return CONVERTED_DIR / f"{content_hash or file_content_hash(checkpoint_path)}-fp32"
+
+
+def load_single_file_pipeline(
+    pipeline_class,
+    checkpoint_path: str,
+    model_key: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    **kwargs,
+):
+    """
+    Carga un checkpoint de un solo archivo usando la caché de conversiones.
+
+    La conversión se hace y se guarda en float32 (en safetensors), sea cual
+    sea el torch_dtype pedido, así que la misma carpeta sirve a procesos de
+    CPU y de GPU.
+
+    Args:
+        pipeline_class: Clase de pipeline (p. ej. StableDiffusionPipeline)
+        checkpoint_path: Ruta al .safetensors o .ckpt
+        model_key: Clave del modelo para registrar los tiempos
+        content_hash: Hash del archivo si ya se conoce (p. ej. el del registro de modelos)
+        **kwargs: Argumentos extra para from_single_file / from_pretrained,
+            incluidos componentes ya cargados (p. ej. unet=...)
+
+    Returns:
+        Pipeline cargado
+    """
+    checkpoint_path = Path(checkpoint_path)
+    model_key = model_key or checkpoint_path.stem
+    target = converted_path(checkpoint_path, content_hash)
+
+    start = time.perf_counter()
+    if (target / "model_index.json").exists():
+        logger.info(f"Cargando checkpoint convertido desde caché: {target}")
+        pipe = pipeline_class.from_pretrained(
+            str(target), local_files_only=True, safety_checker=None, **kwargs
+        )
+        load_timings.record(model_key, "warm", time.perf_counter() - start)
+        return pipe
+
+    # La conversión siempre se hace con los componentes originales, para que
+    # la caché no dependa de qué componentes se sustituyan después
+    overrides = {name: kwargs.pop(name) for name in COMPONENT_NAMES if name in kwargs}
+    torch_dtype = kwargs.pop("torch_dtype", None)
+
+    logger.info(f"Convirtiendo checkpoint a formato diffusers: {checkpoint_path}")
+    pipe = pipeline_class.from_single_file(
+        str(checkpoint_path),
+        use_safetensors=checkpoint_path.suffix == ".safetensors",
+        load_safety_checker=False,
+        **kwargs,
+    )
+
+    # Guardar en una carpeta temporal y renombrar, para no dejar
+    # conversiones a medias en la caché si el proceso se interrumpe.
+    # Nombre único: dos procesos pueden convertir el mismo checkpoint a la vez
+    tmp_target = target.with_name(f"{target.name}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        CONVERTED_DIR.mkdir(parents=True, exist_ok=True)
+        pipe.save_pretrained(str(tmp_target), safe_serialization=True)
+        if (target / "model_index.json").exists():
+            # Otro proceso terminó antes la misma conversión
+            shutil.rmtree(tmp_target)
+        else:
+            if target.exists():
+                shutil.rmtree(target)
+            tmp_target.rename(target)
+            logger.info(f"Checkpoint convertido guardado en: {target}")
+    except Exception as e:
+        logger.warning(f"No se pudo guardar la conversión en caché: {e}")
+        shutil.rmtree(tmp_target, ignore_errors=True)
+
+    if torch_dtype is not None:
+        pipe = pipe.to(torch_dtype)
+
+    for name, module in overrides.items():
+        setattr(pipe, name, module)
+
+    load_timings.record(model_key, "cold", time.perf_counter() - start)
+    return pipe
@@ -0,0 +1,99 @@
+"""
+Modo opcional torch.compile para UNet y decoder del VAE
+Se activa con TORCH_COMPILE=1. Los artefactos compilados se guardan en disco
+(caché de Inductor) para que un reinicio no vuelva a compilar.
+"""
+
+import os
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Callable, List, Tuple
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+
+COMPILE_ENABLED = os.getenv("TORCH_COMPILE", "0") == "1"
+COMPILE_MODE = os.getenv("TORCH_COMPILE_MODE", "default")
+COMPILE_CACHE_DIR = Path(os.getenv("TORCH_COMPILE_CACHE_DIR", str(BASE_DIR / "cache" / "torch_compile")))
+
+
+def get_warmup_sizes() -> List[Tuple[int, int]]:
+    """Resoluciones a compilar al cargar, de COMPILE_WARMUP_SIZES (p. ej. "512x512,768x512")"""
+    sizes = []
+    for item in os.getenv("COMPILE_WARMUP_SIZES", "512x512").split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        try:
+            width, height = item.split("x")
+            sizes.append((int(width), int(height)))
+        except ValueError:
+            logger.warning(f"Resolución de calentamiento inválida: {item}")
+    return sizes
+
+
+def configure_compile_cache():
+    """
+    Activa la caché persistente de Inductor en COMPILE_CACHE_DIR.
+    Debe llamarse antes de la primera compilación.
+    """
+    COMPILE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(COMPILE_CACHE_DIR))
+    os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except Exception as e:
+        logger.warning(f"Caché de grafos de Inductor no disponible: {e}")
+
+
+def compile_vae(vae, mode: str = COMPILE_MODE):
+    """Compila solo el decoder del VAE (el encoder se usa poco)"""
+    if not hasattr(vae.decoder, "_orig_mod"):
+        vae.decoder = torch.compile(vae.decoder, mode=mode, dynamic=False)
+    return vae
+
+
+def compile_pipeline(pipe, mode: str = COMPILE_MODE):
+    """
+    Envuelve con torch.compile la UNet y el decoder del VAE de un pipeline.
+    Debe llamarse antes de crear los pipelines derivados (img2img, inpaint)
+    para que compartan los módulos compilados.
+    """
+    configure_compile_cache()
+    logger.info(f"Compilando UNet y VAE (mode={mode})")
+    if not hasattr(pipe.unet, "_orig_mod"):
+        pipe.unet = torch.compile(pipe.unet, mode=mode, dynamic=False)
+    compile_vae(pipe.vae, mode)
+    return pipe
+
+
+def warmup_compiled(
+    pipe,
+    device: str,
+    sizes: List[Tuple[int, int]] = None,
+    steps: int = 2,
+    autocast_fn: Callable = nullcontext,
+):
+    """
+    Ejecuta una inferencia corta por resolución para disparar la compilación
+    (o cargarla desde la caché en disco) antes de servir peticiones.
+    autocast_fn debe ser el mismo contexto que se usa al generar, para no
+    compilar un grafo distinto al que se ejecutará.
+    """
+    if sizes is None:
+        sizes = get_warmup_sizes()
+    for width, height in sizes:
+        logger.info(f"Calentando modelo compilado a {width}x{height}")
+        with torch.no_grad(), autocast_fn():
+            pipe(
+                prompt="warmup",
+                num_inference_steps=steps,
+                width=width,
+                height=height,
+                generator=torch.Generator(device=device).manual_seed(0),
+            )
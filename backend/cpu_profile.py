@@ -0,0 +1,141 @@
+"""
+Perfil de rendimiento para inferencia en CPU
+Agrupa los ajustes de hilos, formato de memoria y autocast bfloat16. El
+perfil se elige por despliegue con CPU_PROFILE y cada ajuste puede
+sobrescribirse con su propia variable de entorno. La atención SDPA no es un
+ajuste: con torch 2.x diffusers ya la usa por defecto.
+"""
+
+import os
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Optional
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Perfiles predefinidos: "default" reproduce el comportamiento anterior
+CPU_PROFILES = {
+    "default": {
+        "threads": None,
+        "interop_threads": None,
+        "channels_last": False,
+        "bf16": "off",
+    },
+    "throughput": {
+        "threads": os.cpu_count(),
+        "interop_threads": 1,
+        "channels_last": True,
+        "bf16": "auto",
+    },
+    "shared-host": {
+        "threads": max(1, (os.cpu_count() or 2) // 2),
+        "interop_threads": 1,
+        "channels_last": True,
+        "bf16": "auto",
+    },
+}
+
+
+def host_supports_bf16() -> bool:
+    """
+    True si la CPU tiene instrucciones bfloat16 nativas (flags avx512_bf16 o
+    amx_bf16). oneDNN también "soporta" bf16 emulándolo sobre AVX512 básico,
+    pero ahí el autocast es más lento que float32, así que no basta con eso.
+    """
+    try:
+        cpuinfo = Path("/proc/cpuinfo").read_text()
+    except OSError:
+        return False
+    flags = set()
+    for line in cpuinfo.splitlines():
+        if line.startswith("flags"):
+            flags.update(line.partition(":")[2].split())
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+class CPUProfile:
+    """Ajustes de inferencia en CPU de un despliegue"""
+
+    def __init__(
+        self,
+        name: str = "default",
+        threads: Optional[int] = None,
+        interop_threads: Optional[int] = None,
+        channels_last: bool = False,
+        bf16: str = "off",
+    ):
+        self.name = name
+        self.threads = threads
+        self.interop_threads = interop_threads
+        self.channels_last = channels_last
+        # bf16: "on", "off" o "auto" (solo si el host lo soporta)
+        self.bf16 = bf16 == "on" or (bf16 == "auto" and host_supports_bf16())
+
+    @classmethod
+    def from_env(cls) -> "CPUProfile":
+        """Construye el perfil desde CPU_PROFILE y las variables CPU_* individuales"""
+        name = os.getenv("CPU_PROFILE", "default")
+        if name not in CPU_PROFILES:
+            logger.warning(f"Perfil de CPU desconocido: {name}, usando default")
+            name = "default"
+        base = CPU_PROFILES[name]
+        return cls(
+            name=name,
+            threads=_env_int("CPU_THREADS", base["threads"]),
+            interop_threads=_env_int("CPU_INTEROP_THREADS", base["interop_threads"]),
+            channels_last=_env_bool("CPU_CHANNELS_LAST", base["channels_last"]),
+            bf16=os.getenv("CPU_BF16", base["bf16"]).lower(),
+        )
+
+    def apply_threads(self):
+        """Fija los hilos intra-op e inter-op. Llamar antes de cualquier inferencia"""
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        if self.interop_threads:
+            try:
+                torch.set_num_interop_threads(self.interop_threads)
+            except RuntimeError as e:
+                # Solo se puede fijar antes de que arranque el trabajo paralelo
+                logger.warning(f"No se pudieron fijar los hilos inter-op: {e}")
+
+    def apply_to_vae(self, vae):
+        if self.channels_last:
+            vae.to(memory_format=torch.channels_last)
+        return vae
+
+    def apply_to_pipeline(self, pipe):
+        """Aplica formato channels_last a la UNet y el VAE"""
+        if self.channels_last:
+            pipe.unet.to(memory_format=torch.channels_last)
+        self.apply_to_vae(pipe.vae)
+        return pipe
+
+    def autocast(self):
+        """Contexto de autocast bfloat16 en CPU, o uno vacío si no aplica"""
+        if self.bf16:
+            return torch.autocast("cpu", dtype=torch.bfloat16)
+        return nullcontext()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "threads": self.threads or torch.get_num_threads(),
+            "interop_threads": self.interop_threads or torch.get_num_interop_threads(),
+            "channels_last": self.channels_last,
+            "bf16": self.bf16,
+        }
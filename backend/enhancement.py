@@ -114,19 +114,27 @@ class NegativeEmbedding:
     }
     
     @staticmethod
-    def load_embedding(pipe, embedding_name: str):
-        """Carga un embedding negativo"""
+    def token_for(embedding_name: str) -> str:
+        """Token con el que se usa un embedding en los prompts"""
+        return f"<{embedding_name}>"
+    
+    @staticmethod
+    def load_embedding(pipe, embedding_path: str, token: str) -> bool:
+        """
+        Carga un embedding (textual inversion) en el tokenizer y el text encoder
+        del pipeline. Los pipelines derivados que comparten componentes lo ven también.
+        
+        Returns:
+            True si se cargó
+        """
         try:
-            logger.info(f"Cargando embedding: {embedding_name}")
-            
-            if embedding_name in NegativeEmbedding.EMBEDDING_PATHS:
-                path = NegativeEmbedding.EMBEDDING_PATHS[embedding_name]
-                # Implementar carga de embedding
-                logger.info(f"Embedding cargado: {embedding_name}")
-            else:
-                logger.warning(f"Embedding no encontrado: {embedding_name}")
+            logger.info(f"Cargando embedding {token} desde: {embedding_path}")
+            pipe.load_textual_inversion(embedding_path, token=token)
+            logger.info(f"Embedding cargado: {token}")
+            return True
         except Exception as e:
             logger.error(f"Error cargando embedding: {e}")
+            return False
 
 
 class Image2ImageProcessor:
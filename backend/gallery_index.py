@@ -0,0 +1,352 @@
+"""
+Índice SQLite de la galería
+Cada imagen generada se registra al guardarse (metadatos, modelo, LoRAs,
+tamaño y fecha) en una base SQLite junto a las imágenes, con búsqueda de
+texto completo (FTS5) sobre los prompts. La galería se sirve paginada por
+cursor sin recorrer la carpeta ni abrir los JSON. La caché de resultados
+(backend.result_cache) busca aquí las imágenes por su cache_key, así que ve
+también las que guardan otros procesos.
+
+Reconstruir el índice a partir de los PNG + JSON existentes:
+
+    python -m backend.gallery_index rebuild
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tamaño de página por defecto y máximo de /api/gallery
+GALLERY_PAGE_SIZE = int(os.getenv("GALLERY_PAGE_SIZE", "100"))
+GALLERY_MAX_PAGE_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    filename TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    model TEXT,
+    vae TEXT,
+    sampler TEXT,
+    width INTEGER,
+    height INTEGER,
+    seed INTEGER,
+    cache_key TEXT,
+    prompt TEXT NOT NULL DEFAULT '',
+    negative_prompt TEXT NOT NULL DEFAULT '',
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_created ON images (created_at, filename);
+CREATE INDEX IF NOT EXISTS images_model ON images (model, created_at);
+CREATE INDEX IF NOT EXISTS images_size ON images (width, height, created_at);
+
+CREATE TABLE IF NOT EXISTS image_loras (
+    lora TEXT NOT NULL,
+    filename TEXT NOT NULL REFERENCES images (filename) ON DELETE CASCADE,
+    PRIMARY KEY (lora, filename)
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+    prompt, negative_prompt, content='images', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS images_ai AFTER INSERT ON images BEGIN
+    INSERT INTO images_fts (rowid, prompt, negative_prompt) VALUES (new.rowid, new.prompt, new.negative_prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS images_ad AFTER DELETE ON images BEGIN
+    INSERT INTO images_fts (images_fts, rowid, prompt, negative_prompt)
+    VALUES ('delete', old.rowid, old.prompt, old.negative_prompt);
+END;
+"""
+
+
+def _created_at(metadata: dict, fallback: float) -> float:
+    """Fecha de una imagen desde el timestamp de sus metadatos (%Y%m%d_%H%M%S)"""
+    try:
+        return datetime.strptime(metadata["timestamp"], "%Y%m%d_%H%M%S").timestamp()
+    except (KeyError, TypeError, ValueError):
+        return fallback
+
+
+def _loras(metadata: dict) -> List[str]:
+    """Rutas de LoRA de unos metadatos, con el formato nuevo (loras) o el antiguo (lora)"""
+    loras = [lora[0] for lora in metadata.get("loras") or [] if lora]
+    if not loras and metadata.get("lora"):
+        loras = [metadata["lora"]]
+    return loras
+
+
+def _match_query(text: str) -> str:
+    """Texto libre a consulta FTS5: cada palabra entre comillas y como prefijo, todas obligatorias"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def _parse_date(value: str) -> float:
+    """Fecha ISO (YYYY-MM-DD o con hora) o segundos epoch"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _date_to_bound(value: str) -> Tuple[str, float]:
+    """
+    Límite superior de date_to como (operador, timestamp). Una fecha sin hora
+    (YYYY-MM-DD) incluye todo ese día: el límite es el inicio del siguiente, exclusivo.
+    """
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        return "<=", _parse_date(value)
+    next_day = datetime.combine(day + timedelta(days=1), datetime.min.time())
+    return "<", next_day.timestamp()
+
+
+def encode_cursor(created_at: float, filename: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([created_at, filename]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[float, str]:
+    created_at, filename = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return float(created_at), str(filename)
+
+
+class GalleryIndex:
+    """
+    Índice de las imágenes generadas en `directory`.
+
+    Args:
+        directory: Carpeta de generaciones (PNG + JSON)
+        db_path: Base de datos (GALLERY_DB_PATH, por defecto gallery.sqlite3 en la carpeta)
+    """
+
+    def __init__(self, directory: Path, db_path: Optional[Path] = None):
+        self.directory = Path(directory)
+        if db_path is None:
+            db_path = Path(os.getenv("GALLERY_DB_PATH", str(self.directory / "gallery.sqlite3")))
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        # Solo un hilo rellena la base recién creada; el resto espera a que termine
+        self._backfill_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Base recién creada: se rellena desde los archivos en la primera consulta
+        self._needs_backfill = False
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._needs_backfill = not self.db_path.exists()
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL: el servidor y el gateway pueden escribir en la misma base
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(images)")}
+            if "cache_key" not in columns:
+                # Bases creadas antes de la columna: se rellena desde los metadatos
+                with conn:
+                    conn.execute("ALTER TABLE images ADD COLUMN cache_key TEXT")
+                    conn.execute("UPDATE images SET cache_key = json_extract(metadata, '$.cache_key')")
+            conn.execute("CREATE INDEX IF NOT EXISTS images_cache_key ON images (cache_key)")
+            self._conn = conn
+        return self._conn
+
+    def _insert(self, conn: sqlite3.Connection, metadata: dict, created_at: float):
+        filename = metadata["filename"]
+        conn.execute("DELETE FROM images WHERE filename = ?", (filename,))
+        conn.execute(
+            """
+            INSERT INTO images (filename, created_at, model, vae, sampler, width, height, seed,
+                                cache_key, prompt, negative_prompt, metadata)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                filename,
+                created_at,
+                metadata.get("model"),
+                metadata.get("vae"),
+                metadata.get("sampler"),
+                metadata.get("width"),
+                metadata.get("height"),
+                metadata.get("seed"),
+                metadata.get("cache_key"),
+                metadata.get("prompt") or "",
+                metadata.get("negative_prompt") or "",
+                json.dumps(metadata, ensure_ascii=False),
+            ),
+        )
+        conn.executemany(
+            "INSERT OR IGNORE INTO image_loras (lora, filename) VALUES (?, ?)",
+            [(lora, filename) for lora in _loras(metadata)],
+        )
+
+    def add(self, metadata: dict):
+        """Registra una imagen recién guardada (metadatos con filename)"""
+        try:
+            with self._lock:
+                conn = self._connection()
+                with conn:
+                    self._insert(conn, metadata, _created_at(metadata, time.time()))
+        except sqlite3.Error as e:
+            # La imagen ya está en disco: un rebuild la recupera
+            logger.warning(f"No se pudo indexar {metadata.get('filename')}: {e}")
+
+    def rebuild(self) -> int:
+        """Vacía el índice y lo rellena con los generated_*.png de la carpeta y sus JSON"""
+        rows = []
+        for png_file in self.directory.glob("generated_*.png"):
+            metadata = {}
+            json_file = png_file.with_suffix(".json")
+            if json_file.exists():
+                try:
+                    with open(json_file, "r", encoding="utf-8") as f:
+                        metadata = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Metadatos ilegibles en {json_file}: {e}")
+            metadata["filename"] = png_file.name
+            rows.append((metadata, _created_at(metadata, png_file.stat().st_mtime)))
+
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM images")
+                for metadata, created_at in rows:
+                    self._insert(conn, metadata, created_at)
+            self._needs_backfill = False
+        logger.info(f"Índice de galería reconstruido: {len(rows)} imágenes")
+        return len(rows)
+
+    def ensure_backfilled(self):
+        """Abre la base y, si es nueva, la rellena desde los archivos (una sola vez)"""
+        with self._backfill_lock:
+            with self._lock:
+                self._connection()
+                needs_backfill = self._needs_backfill
+            if needs_backfill:
+                self.rebuild()
+
+    def find_cache_keys(self, keys: List[str]) -> Dict[str, dict]:
+        """Imagen más reciente de cada cache_key indexada: {cache_key: {"filename", "seed"}}"""
+        if not keys:
+            return {}
+        self.ensure_backfilled()
+        placeholders = ", ".join("?" for _ in keys)
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT cache_key, filename, seed FROM images WHERE cache_key IN ({placeholders})"
+                " ORDER BY created_at, filename",
+                list(keys),
+            ).fetchall()
+        return {row["cache_key"]: {"filename": row["filename"], "seed": row["seed"]} for row in rows}
+
+    def page(
+        self,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        order: str = "newest",
+        q: Optional[str] = None,
+        model: Optional[str] = None,
+        lora: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> dict:
+        """
+        Una página de la galería. `order` es "newest" u "oldest"; `cursor` es
+        el next_cursor de la página anterior con los mismos filtros.
+        """
+        if order not in ("newest", "oldest"):
+            raise ValueError("order debe ser 'newest' u 'oldest'")
+        limit = max(1, min(limit or GALLERY_PAGE_SIZE, GALLERY_MAX_PAGE_SIZE))
+        self.ensure_backfilled()
+
+        where, params = [], []
+        if q and q.strip():
+            where.append("images.rowid IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+            params.append(_match_query(q))
+        if model:
+            where.append("images.model = ?")
+            params.append(model)
+        if lora:
+            where.append("EXISTS (SELECT 1 FROM image_loras WHERE image_loras.filename = images.filename AND lora = ?)")
+            params.append(lora)
+        if date_from:
+            where.append("images.created_at >= ?")
+            params.append(_parse_date(date_from))
+        if date_to:
+            operator, bound = _date_to_bound(date_to)
+            where.append(f"images.created_at {operator} ?")
+            params.append(bound)
+        if width:
+            where.append("images.width = ?")
+            params.append(width)
+        if height:
+            where.append("images.height = ?")
+            params.append(height)
+
+        filters = list(where), list(params)
+        direction, comparison = ("DESC", "<") if order == "newest" else ("ASC", ">")
+        if cursor:
+            where.append(f"(images.created_at, images.filename) {comparison} (?, ?)")
+            params.extend(decode_cursor(cursor))
+
+        sql = "SELECT filename, created_at, metadata FROM images"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY created_at {direction}, filename {direction} LIMIT ?"
+
+        count_sql = "SELECT COUNT(*) FROM images"
+        if filters[0]:
+            count_sql += " WHERE " + " AND ".join(filters[0])
+
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(sql, params + [limit + 1]).fetchall()
+            total = conn.execute(count_sql, filters[1]).fetchone()[0]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        images = [
+            {
+                "filename": row["filename"],
+                "url": f"http://localhost:8000/api/image/{row['filename']}",
+                "timestamp": row["created_at"],
+                "metadata": json.loads(row["metadata"]),
+            }
+            for row in rows
+        ]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["filename"]) if has_more else None
+        return {"total": total, "images": images, "next_cursor": next_cursor}
+
+    def latest_metadata(self) -> Optional[dict]:
+        """Metadatos de la imagen más reciente"""
+        self.ensure_backfilled()
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT metadata FROM images ORDER BY created_at DESC, filename DESC LIMIT 1"
+            ).fetchone()
+        return json.loads(row["metadata"]) if row else None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from backend.generation_store import gallery_index
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Índice SQLite de la galería")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: reindexa los PNG + JSON existentes")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        count = gallery_index.rebuild()
+        print(f"[INFO] {count} imágenes indexadas en {gallery_index.db_path}")
@@ -0,0 +1,201 @@
+"""
+Gateway HTTP ligero
+Sirve la API de generación y de trabajos sin importar torch ni diffusers:
+los trabajos se ejecutan en procesos de inferencia separados
+(INFERENCE_PROCESSES), así que el gateway arranca al instante y un fallo en
+la inferencia no tumba el servidor.
+
+Arranque:  python -m uvicorn backend.gateway:app --host 0.0.0.0 --port 8000
+
+El gateway es el único proceso que refresca y escribe el registro de
+modelos; los workers recargan el índice cuando cambia, así que las opciones
+de modelo fijadas aquí les llegan sin reiniciarlos.
+
+La gestión de modelos, Civitai, galería, etc. sigue en backend.main, que
+también puede servirse solo como hasta ahora.
+"""
+
+import threading
+from typing import List, Optional
+
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse
+import logging
+
+from backend.generation_store import GENERATIONS_DIR, gallery_index, result_cache
+from backend.ipc import materialize_result
+from backend.job_api import create_jobs_router
+from backend.jobs import Job, JobQueue
+from backend.model_config import (
+    ensure_registry_loaded,
+    get_model_engine,
+    get_model_precision,
+    known_model_hash,
+    model_registry,
+    set_model_options,
+)
+from backend.result_cache import generation_variant
+from backend.schemas import ModelOptionsRequest, batch_key_fields, request_loras
+from backend.worker_pool import WorkerPool
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = FastAPI(title="AI Image Generator Gateway")
+
+# CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+worker_pool = WorkerPool()
+
+
+def _job_request(job: Job):
+    return job.payload if job.kind == "generate" else job.payload[0]
+
+
+def worker_key(request) -> tuple:
+    """(modelo, vae, loras) de una petición: lo que un worker deja cargado al ejecutarla"""
+    return request.model, request.vae, tuple(request_loras(request))
+
+
+def run_job(job: Job) -> dict:
+    """Envía un trabajo a un worker y guarda las imágenes que devuelve"""
+    request = _job_request(job)
+    result = worker_pool.run(
+        job.kind,
+        job.payload,
+        key=worker_key(request),
+        on_progress=lambda slot, event, previews: job.publish_progress(event, previews),
+        should_cancel=lambda: job.cancel_requested,
+    )
+    return materialize_result(result)
+
+
+def run_job_batch(jobs: List[Job]) -> List[dict]:
+    """Envía un lote de trabajos txt2img compatibles a un mismo worker"""
+    first = jobs[0].payload
+    result = worker_pool.run(
+        "generate_batch",
+        [job.payload for job in jobs],
+        key=worker_key(first),
+        on_progress=lambda slot, event, previews: jobs[slot].publish_progress(event, previews),
+        should_cancel=lambda: all(job.cancel_requested for job in jobs),
+    )
+    if isinstance(result, dict):
+        # Error común a todo el lote (p. ej. el worker murió)
+        return [result for _ in jobs]
+    return [materialize_result(item) for item in result]
+
+
+def job_batch_key(job: Job) -> Optional[tuple]:
+    """Misma regla que backend.main: solo txt2img de una imagen"""
+    if job.kind != "generate" or job.payload.num_images > 1:
+        return None
+    return batch_key_fields(job.payload)
+
+
+def job_affinity(job: Job) -> int:
+    request = _job_request(job)
+    return worker_pool.affinity(worker_key(request))
+
+
+def result_variant(model_key: str) -> Optional[dict]:
+    """
+    Variante con la que los workers generarían un modelo, para buscar en la
+    caché de resultados. None (sin caché) hasta que un worker anuncia su
+    dispositivo o mientras el registro no tenga el hash del modelo.
+    """
+    settings = worker_pool.inference_settings()
+    if settings is None:
+        return None
+    device = settings["device"]
+    return generation_variant(
+        get_model_engine(model_key, device),
+        get_model_precision(model_key, device),
+        known_model_hash(model_key),
+        settings["bf16"],
+    )
+
+
+job_queue = JobQueue(
+    runner=run_job,
+    num_workers=worker_pool.num_workers,
+    batch_runner=run_job_batch,
+    batch_key=job_batch_key,
+    affinity=job_affinity,
+)
+
+app.include_router(create_jobs_router(job_queue, variant_for=result_variant))
+
+
+@app.on_event("startup")
+def start_workers():
+    """Lanza los procesos de inferencia; el gateway ya sirve peticiones mientras cargan"""
+    # El índice debe existir antes de que los workers lo lean
+    ensure_registry_loaded()
+    model_registry.start_background_refresh()
+    # Índice de galería y caché de resultados listo antes de la primera petición
+    threading.Thread(target=gallery_index.ensure_backfilled, name="gallery-backfill", daemon=True).start()
+    worker_pool.start()
+    job_queue.start()
+
+
+@app.on_event("shutdown")
+def stop_workers():
+    worker_pool.stop()
+
+
+@app.get("/health")
+async def health_check():
+    workers = worker_pool.stats()
+    return {
+        # degraded: algún worker se dio por fallido tras WORKER_MAX_RESTARTS relanzamientos
+        "status": "degraded" if workers["failed"] else "ok",
+        "message": "Gateway is running",
+        "ready": worker_pool.ready,
+        "workers": workers,
+        "jobs": job_queue.stats(),
+        "result_cache": result_cache.stats(),
+        "model_registry": model_registry.stats(),
+    }
+
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: el gateway responde, aunque los workers sigan cargando"""
+    return {"status": "ok"}
+
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: al menos un worker de inferencia ha terminado la precarga"""
+    return JSONResponse(worker_pool.stats(), status_code=200 if worker_pool.ready else 503)
+
+
+@app.post("/api/models/{model_key}/options")
+async def update_model_options(model_key: str, request: ModelOptionsRequest):
+    """Cambia las opciones de un modelo (motor, precisión); los workers las aplican al recargar el registro"""
+    return set_model_options(model_key, request.engine, request.precision)
+
+
+@app.get("/api/image/{filename}")
+async def get_image(filename: str):
+    """Descarga una imagen generada"""
+    image_path = GENERATIONS_DIR / filename
+    if not image_path.exists():
+        return {"success": False, "error": "Imagen no encontrada"}
+    return FileResponse(image_path, media_type="image/png")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,89 @@
+"""
+Almacenamiento de las imágenes generadas
+Guarda cada PNG junto a su JSON de metadatos en la carpeta de generaciones,
+y las imágenes subidas para Image2Image por hash de su contenido.
+Sin dependencias de torch: lo usan tanto backend.main como el gateway.
+"""
+
+import hashlib
+import json
+import re
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+import logging
+
+from backend.gallery_index import GalleryIndex
+from backend.result_cache import ResultCache
+
+logger = logging.getLogger(__name__)
+
+# Crear directorio de generaciones
+GENERATIONS_DIR = Path("./generated_images")
+GENERATIONS_DIR.mkdir(exist_ok=True)
+
+# Imágenes de origen subidas, guardadas por el sha256 de su contenido
+UPLOADS_DIR = GENERATIONS_DIR / "uploads"
+UPLOADS_DIR.mkdir(exist_ok=True)
+
+_UPLOAD_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Índice SQLite de la galería (metadatos + búsqueda en prompts)
+gallery_index = GalleryIndex(GENERATIONS_DIR)
+
+# Resultados deterministas ya generados en GENERATIONS_DIR, buscados en el índice de la galería
+result_cache = ResultCache(gallery_index, GENERATIONS_DIR)
+
+
+def store_image(image, prefix: str, seed: Optional[int] = None, metadata: Optional[dict] = None) -> dict:
+    """
+    Guarda una imagen PIL como `{prefix}_{timestamp}_{id}.png` y, si se dan
+    metadatos, un JSON con el mismo nombre. Devuelve url, nombre y seed.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"{prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
+    image_path = GENERATIONS_DIR / filename
+    image.save(image_path)
+    logger.info(f"Imagen guardada en: {image_path}")
+
+    if metadata is not None:
+        metadata = {"filename": filename, "timestamp": timestamp, **metadata}
+        metadata_path = image_path.with_suffix(".json")
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        logger.info(f"Metadatos guardados en: {metadata_path}")
+        gallery_index.add(metadata)
+
+    return {
+        "image_url": f"http://localhost:8000/api/image/{filename}",
+        "filename": filename,
+        "seed": seed,
+    }
+
+
+def upload_hash(data: bytes) -> str:
+    """Hash de contenido de una imagen subida"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def store_upload(data: bytes) -> str:
+    """Guarda una imagen subida (una sola vez por contenido) y devuelve su hash"""
+    image_hash = upload_hash(data)
+    path = UPLOADS_DIR / image_hash
+    if not path.exists():
+        tmp_path = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        logger.info(f"Imagen de origen guardada: {image_hash}")
+    return image_hash
+
+
+def load_upload(image_hash: str) -> Optional[bytes]:
+    """Bytes de una imagen subida antes, o None si el hash no existe"""
+    if not _UPLOAD_HASH_RE.match(image_hash or ""):
+        return None
+    path = UPLOADS_DIR / image_hash
+    if not path.exists():
+        return None
+    return path.read_bytes()
@@ -0,0 +1,80 @@
+"""
+Proceso de inferencia
+Cada worker importa el backend completo (torch + diffusers), precarga los
+modelos y ejecuta los trabajos que le envía el gateway por su cola. El
+progreso y los resultados vuelven por una cola común; las imágenes viajan
+por memoria compartida (backend.ipc).
+"""
+
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _configure_threads(num_workers: int):
+    """Reparte los hilos de CPU entre los workers salvo que CPU_THREADS ya esté fijado"""
+    if num_workers > 1 and "CPU_THREADS" not in os.environ:
+        os.environ["CPU_THREADS"] = str(max(1, (os.cpu_count() or 1) // num_workers))
+
+
+def worker_main(index: int, num_workers: int, task_queue, result_queue, cancel_flags):
+    """
+    Bucle principal de un worker.
+
+    Mensajes recibidos: (task_id, kind, payload) o None para terminar.
+    Mensajes enviados: ("ready", index, pid, startup, settings), ("progress", task_id,
+    slot, event, previews) y ("result", task_id, result).
+    cancel_flags[index] == task_id pide cortar la tarea en curso.
+    """
+    logging.basicConfig(level=logging.INFO)
+    _configure_threads(num_workers)
+    # El gateway refresca y escribe el registro; los workers solo lo recargan
+    os.environ["MODEL_REGISTRY_READ_ONLY"] = "1"
+
+    # Importación pesada: solo ocurre en los procesos de inferencia
+    from backend import main as engine
+    from backend.ipc import store_in_shared_memory
+    from backend.startup import get_preload_models, run_preload
+
+    engine.model_registry.start_background_reload()
+    run_preload(
+        engine.startup_state,
+        get_preload_models(engine.get_available_models()),
+        load_fn=lambda model_key: engine.load_model(model_key, "default"),
+        warmup_fn=engine.warmup_model,
+    )
+    result_queue.put(("ready", index, os.getpid(), engine.startup_state.to_dict(), engine.inference_settings()))
+    logger.info(f"Worker de inferencia {index} listo (pid {os.getpid()})")
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, kind, payload = task
+
+        def should_cancel() -> bool:
+            return cancel_flags[index] == task_id
+
+        def listener(slot: int):
+            return lambda event, previews: result_queue.put(("progress", task_id, slot, event, previews))
+
+        try:
+            if kind == "generate":
+                result = engine.run_generate(payload, listener(0), should_cancel, store_in_shared_memory)
+            elif kind == "generate_batch":
+                result = engine.run_generate_batch(
+                    payload,
+                    [listener(slot) for slot in range(len(payload))],
+                    should_cancel,
+                    store_in_shared_memory,
+                )
+            elif kind == "image2image":
+                request, image_data = payload
+                result = engine.run_image2image(request, image_data, listener(0), should_cancel, store_in_shared_memory)
+            else:
+                result = {"success": False, "error": f"Tipo de trabajo desconocido: {kind}"}
+        except Exception as e:
+            logger.error(f"Error en el worker {index}: {e}")
+            result = {"success": False, "error": str(e)}
+        result_queue.put(("result", task_id, result))
@@ -0,0 +1,94 @@
+"""
+Intercambio de imágenes entre procesos por memoria compartida
+Los workers de inferencia escriben los píxeles decodificados en un bloque
+de memoria compartida y solo envían su descriptor (nombre, forma, dtype)
+por la cola; el gateway lo copia, libera el bloque y guarda el PNG.
+"""
+
+from multiprocessing import shared_memory
+from typing import Optional
+import logging
+
+import numpy as np
+from PIL import Image
+
+from backend.generation_store import store_image
+
+logger = logging.getLogger(__name__)
+
+
+def image_to_shared_memory(image: Image.Image) -> dict:
+    """Copia una imagen a un bloque nuevo de memoria compartida y devuelve su descriptor"""
+    array = np.asarray(image.convert("RGB"))
+    shm = shared_memory.SharedMemory(create=True, size=array.nbytes)
+    try:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+        return {"name": shm.name, "shape": list(array.shape), "dtype": str(array.dtype)}
+    finally:
+        # El bloque sigue existiendo hasta que el receptor hace unlink()
+        shm.close()
+
+
+def image_from_shared_memory(descriptor: dict) -> Image.Image:
+    """Reconstruye la imagen de un descriptor y libera el bloque de memoria compartida"""
+    shm = shared_memory.SharedMemory(name=descriptor["name"])
+    try:
+        array = np.ndarray(tuple(descriptor["shape"]), dtype=descriptor["dtype"], buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return Image.fromarray(array)
+
+
+def release_shared_memory(descriptor: dict):
+    """Libera un bloque que ya no se va a leer (p. ej. trabajo cancelado)"""
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor["name"])
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def store_in_shared_memory(image, prefix: str, seed: Optional[int] = None, metadata: Optional[dict] = None) -> dict:
+    """
+    Misma firma que generation_store.store_image, para los workers: en lugar
+    de guardar el PNG deja la imagen en memoria compartida.
+    """
+    return {
+        "shm": image_to_shared_memory(image),
+        "prefix": prefix,
+        "seed": seed,
+        "metadata": metadata,
+    }
+
+
+def materialize_result(result: dict, save: bool = True) -> dict:
+    """
+    Sustituye en un resultado de worker las imágenes en memoria compartida por
+    los PNG guardados. Con save=False solo libera los bloques.
+    """
+    images = result.get("images")
+    if not images:
+        return result
+
+    stored = []
+    for image in images:
+        if "shm" not in image:
+            stored.append(image)
+            continue
+        if not save:
+            release_shared_memory(image["shm"])
+            continue
+        stored.append(store_image(
+            image_from_shared_memory(image["shm"]),
+            image["prefix"],
+            image["seed"],
+            image["metadata"],
+        ))
+
+    result = {**result, "images": stored}
+    if stored:
+        result["image_url"] = stored[0]["image_url"]
+        result["filename"] = stored[0]["filename"]
+    return result
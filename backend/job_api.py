@@ -0,0 +1,256 @@
+"""
+Endpoints de generación y de la cola de trabajos
+Son los mismos para el servidor completo (los trabajos se ejecutan en hilos
+del propio proceso) y para el gateway (los trabajos se envían a procesos de
+inferencia): solo cambia el runner de la JobQueue que se recibe.
+"""
+
+import asyncio
+import json
+import os
+from typing import Optional
+import logging
+
+from fastapi import APIRouter, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import ValidationError
+
+from backend.generation_store import load_upload, result_cache, store_upload
+from backend.jobs import Job, JobQueue, QueueFullError
+from backend.result_cache import VariantProvider, request_cache_keys
+from backend.schemas import GenerateRequest, Image2ImageRequest, generation_response, validate_generate_request
+
+logger = logging.getLogger(__name__)
+
+# Intervalo con el que los streams SSE consultan el progreso de un trabajo
+JOB_EVENTS_POLL_SECONDS = float(os.getenv("JOB_EVENTS_POLL_MS", "100")) / 1000
+
+# Intervalo con el que las peticiones síncronas comprueban si el cliente sigue conectado
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+def create_jobs_router(job_queue: JobQueue, variant_for: Optional[VariantProvider] = None) -> APIRouter:
+    """
+    Router con /api/generate, /api/image2image y /api/jobs/* sobre `job_queue`.
+    `variant_for` da la variante de un modelo para la caché de resultados
+    (sin ella, o si devuelve None, no se sirve nada desde caché).
+    """
+    router = APIRouter()
+
+    async def await_job(job: Job, http_request: Request) -> dict:
+        """Espera el resultado de un trabajo; si el cliente se desconecta, lo cancela"""
+        future = asyncio.wrap_future(job.future)
+        while True:
+            done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return future.result()
+            if await http_request.is_disconnected():
+                logger.info(f"Cliente desconectado, cancelando trabajo {job.id}")
+                job_queue.cancel(job.id)
+                return {"success": False, "error": "Cliente desconectado", "cancelled": True}
+
+    async def cached_generation(request: GenerateRequest) -> Optional[dict]:
+        """
+        Resultado ya generado para una petición determinista (seed fija), sin
+        tocar el pipeline. La búsqueda (SQLite + archivos) va en un hilo.
+        """
+        if variant_for is None:
+            return None
+        keys = request_cache_keys(request, variant_for(request.model))
+        images = await asyncio.to_thread(result_cache.lookup, keys)
+        if images is None:
+            return None
+        logger.info(f"Resultado servido desde caché: {images[0]['filename']}")
+        return generation_response(request, images, cached=True)
+
+    async def image2image_payload(request_json: str, image_file: Optional[UploadFile]):
+        """
+        (request, bytes) para un trabajo img2img. La petición llega como JSON
+        en el campo de formulario `request` (el cuerpo es multipart por el
+        archivo). Con archivo, se guarda por hash para poder reutilizarlo;
+        con image_hash, los bytes solo se leen en el worker si no tiene ya
+        esa imagen en caché.
+        """
+        try:
+            request = Image2ImageRequest.model_validate_json(request_json)
+        except ValidationError as e:
+            return None, f"Petición inválida: {e}"
+        if image_file is not None:
+            image_data = await image_file.read()
+            request.image_hash = store_upload(image_data)
+            return (request, image_data), None
+        if not request.image_hash:
+            return None, "Falta la imagen: envía image_file o image_hash."
+        if load_upload(request.image_hash) is None:
+            return None, f"Imagen de origen no encontrada: {request.image_hash}"
+        return (request, None), None
+
+    def submit_job(kind: str, payload) -> JSONResponse:
+        try:
+            job = job_queue.submit(kind, payload)
+        except QueueFullError as e:
+            return JSONResponse({"success": False, "error": str(e)}, status_code=429)
+        return JSONResponse(
+            {"success": True, "job_id": job.id, "status": job.status, "position": job_queue.position(job)},
+            status_code=202,
+        )
+
+    @router.post("/api/generate")
+    async def generate_image(request: GenerateRequest, http_request: Request):
+        """
+        Genera una imagen y espera el resultado.
+        Envoltorio sobre la cola de trabajos: el event loop no se bloquea.
+        Si el cliente se desconecta, el trabajo se cancela.
+        """
+        error = validate_generate_request(request)
+        if error:
+            return {"success": False, "error": error}
+
+        cached = await cached_generation(request)
+        if cached is not None:
+            return cached
+
+        try:
+            job = job_queue.submit("generate", request)
+        except QueueFullError as e:
+            return {"success": False, "error": str(e)}
+        return await await_job(job, http_request)
+
+    @router.post("/api/image2image")
+    async def image_to_image(
+        http_request: Request,
+        request: str = Form(...),
+        image_file: Optional[UploadFile] = File(None),
+    ):
+        """
+        Transforma una imagen y espera el resultado. `request` es el
+        Image2ImageRequest en JSON; la imagen va en image_file o por image_hash.
+        Envoltorio sobre la cola de trabajos: el event loop no se bloquea.
+        Si el cliente se desconecta, el trabajo se cancela.
+        """
+        payload, error = await image2image_payload(request, image_file)
+        if error:
+            return {"success": False, "error": error}
+        try:
+            job = job_queue.submit("image2image", payload)
+        except QueueFullError as e:
+            return {"success": False, "error": str(e)}
+        return await await_job(job, http_request)
+
+    @router.post("/api/jobs/generate")
+    async def submit_generate_job(request: GenerateRequest):
+        """Encola una generación y devuelve el id del trabajo al instante"""
+        error = validate_generate_request(request)
+        if error:
+            return {"success": False, "error": error}
+
+        cached = await cached_generation(request)
+        if cached is not None:
+            job = job_queue.add_completed("generate", request, cached)
+            return {"success": True, "job_id": job.id, "status": job.status, "position": None, "result": cached}
+        return submit_job("generate", request)
+
+    @router.post("/api/jobs/image2image")
+    async def submit_image2image_job(request: str = Form(...), image_file: Optional[UploadFile] = File(None)):
+        """Encola una transformación Image2Image (`request` en JSON, como en /api/image2image) y devuelve el id del trabajo"""
+        payload, error = await image2image_payload(request, image_file)
+        if error:
+            return {"success": False, "error": error}
+        return submit_job("image2image", payload)
+
+    @router.post("/api/uploads")
+    async def upload_source_image(image_file: UploadFile = File(...)):
+        """
+        Sube una imagen de origen y devuelve su hash. Las peticiones
+        img2img pueden usar image_hash en lugar de volver a enviarla.
+        """
+        image_data = await image_file.read()
+        if not image_data:
+            return {"success": False, "error": "Archivo vacío"}
+        return {"success": True, "image_hash": store_upload(image_data), "size": len(image_data)}
+
+    @router.get("/api/jobs")
+    async def jobs_stats():
+        """Estado de la cola de trabajos"""
+        return job_queue.stats()
+
+    @router.get("/api/jobs/{job_id}")
+    async def get_job(job_id: str, wait: float = 0):
+        """
+        Estado y resultado de un trabajo.
+        Con wait > 0 espera hasta ese número de segundos (máx. 300) a que termine.
+        """
+        job = job_queue.get(job_id)
+        if job is None:
+            return JSONResponse({"success": False, "error": "Trabajo no encontrado"}, status_code=404)
+
+        if wait > 0 and not job.done:
+            try:
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job.future)), timeout=min(wait, 300))
+            except asyncio.TimeoutError:
+                pass
+
+        return {"success": True, "position": job_queue.position(job), **job.to_dict()}
+
+    @router.post("/api/jobs/{job_id}/cancel")
+    async def cancel_job(job_id: str):
+        """
+        Cancela un trabajo. Si está en espera sale de la cola al momento; si
+        está generando se corta en el siguiente step y libera el hilo de inferencia.
+        """
+        job = job_queue.cancel(job_id)
+        if job is None:
+            return JSONResponse({"success": False, "error": "Trabajo no encontrado"}, status_code=404)
+        return {"success": True, "cancel_requested": job.cancel_requested, **job.to_dict()}
+
+    @router.get("/api/jobs/{job_id}/events")
+    async def stream_job_events(job_id: str, http_request: Request, cancel_on_disconnect: bool = False):
+        """
+        Progreso de un trabajo como Server-Sent Events.
+        Eventos: "queued" (posición), "progress" (step, elapsed, eta y, cada
+        PREVIEW_EVERY_STEPS, "previews" en JPEG base64) y "done" (resultado final).
+        Con cancel_on_disconnect=true, cerrar el stream cancela el trabajo.
+        """
+        job = job_queue.get(job_id)
+        if job is None:
+            return JSONResponse({"success": False, "error": "Trabajo no encontrado"}, status_code=404)
+
+        def sse(event: str, data: dict) -> str:
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+        async def events():
+            last_seq = 0
+            last_preview_step = None
+            last_position = None
+            while True:
+                if job.done:
+                    yield sse("done", job.to_dict())
+                    return
+
+                if cancel_on_disconnect and await http_request.is_disconnected():
+                    logger.info(f"Stream cerrado, cancelando trabajo {job.id}")
+                    job_queue.cancel(job.id)
+                    return
+
+                position = job_queue.position(job)
+                if position is not None and position != last_position:
+                    last_position = position
+                    yield sse("queued", {"position": position})
+
+                if job.progress_seq != last_seq:
+                    last_seq = job.progress_seq
+                    data = dict(job.progress or {})
+                    if job.preview_step is not None and job.preview_step != last_preview_step:
+                        last_preview_step = job.preview_step
+                        data["previews"] = job.previews
+                    yield sse("progress", data)
+
+                await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+
+        return StreamingResponse(
+            events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    return router
@@ -0,0 +1,365 @@
+"""
+Cola de trabajos de generación
+Las peticiones se encolan y devuelven un id al instante; hilos de inferencia
+dedicados vacían la cola, de modo que el event loop de FastAPI nunca queda
+bloqueado por una generación.
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ("queued", "running", "completed", "failed", "cancelled")
+
+
+class QueueFullError(Exception):
+    """La cola de trabajos ha alcanzado su tamaño máximo"""
+
+
+class Job:
+    """Un trabajo de generación y su resultado"""
+
+    def __init__(self, kind: str, payload: Any):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.status = "queued"
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # Se resuelve siempre con el dict de resultado (también en error)
+        self.future: Future = Future()
+        # Último progreso publicado por el callback de steps; progress_seq
+        # permite a los streams detectar cambios sin guardar cada evento
+        self.progress: Optional[dict] = None
+        self.progress_seq = 0
+        self.previews: Optional[List[str]] = None
+        self.preview_step: Optional[int] = None
+        # Lo comprueba el callback de steps para cortar la generación
+        self.cancel_event = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.future.done()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def publish_progress(self, event: dict, previews: Optional[List[str]] = None):
+        """Publica el progreso de un step (llamado desde el hilo de inferencia)"""
+        if previews:
+            self.previews = previews
+            self.preview_step = event.get("step")
+        self.progress = event
+        self.progress_seq += 1
+
+    def finish(self, status: str, result: dict):
+        self.status = status
+        self.result = result
+        if status != "completed":
+            self.error = result.get("error")
+        self.finished_at = time.time()
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queue_seconds": round((self.started_at or time.time()) - self.created_at, 3),
+        }
+        if self.started_at is not None:
+            data["run_seconds"] = round((self.finished_at or time.time()) - self.started_at, 3)
+        if self.progress is not None:
+            data["progress"] = self.progress
+        if self.error is not None:
+            data["error"] = self.error
+        if self.result is not None:
+            data["result"] = self.result
+        return data
+
+
+class JobQueue:
+    """
+    Cola acotada de trabajos servida por hilos de inferencia.
+
+    Si se indica batch_runner, los trabajos compatibles (misma batch_key) que
+    lleguen dentro de una ventana corta se agrupan y se ejecutan juntos.
+
+    Si se indica affinity, los trabajos que pueden ejecutarse con el modelo ya
+    cargado pasan delante, salvo que el más antiguo lleve esperando más de
+    max_wait: entonces se respeta el orden de llegada.
+
+    Args:
+        runner: Función que ejecuta un trabajo y devuelve su dict de resultado
+        num_workers: Hilos de inferencia (INFERENCE_WORKERS, por defecto 1)
+        max_pending: Trabajos en espera admitidos (JOB_QUEUE_SIZE)
+        history: Trabajos terminados que se conservan para consulta (JOB_HISTORY)
+        batch_runner: Función que ejecuta una lista de trabajos y devuelve un dict por trabajo
+        batch_key: Clave de compatibilidad de un trabajo, o None si no se agrupa
+        batch_window: Segundos que se retiene un trabajo esperando compañeros (BATCH_WINDOW_MS)
+        max_batch: Tamaño máximo de lote (MAX_BATCH_SIZE)
+        affinity: Puntuación de un trabajo (mayor = menos cambios de modelo/VAE/LoRA para ejecutarlo ya)
+        max_wait: Segundos máximos que un trabajo puede ser adelantado (AFFINITY_MAX_WAIT_SECONDS)
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[Job], dict],
+        num_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        history: Optional[int] = None,
+        batch_runner: Optional[Callable[[List[Job]], List[dict]]] = None,
+        batch_key: Optional[Callable[[Job], Optional[Hashable]]] = None,
+        batch_window: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        affinity: Optional[Callable[[Job], int]] = None,
+        max_wait: Optional[float] = None,
+    ):
+        self.runner = runner
+        self.num_workers = num_workers or int(os.getenv("INFERENCE_WORKERS", "1"))
+        self.max_pending = max_pending or int(os.getenv("JOB_QUEUE_SIZE", "32"))
+        self.history = history or int(os.getenv("JOB_HISTORY", "200"))
+        self.batch_runner = batch_runner
+        self.batch_key = batch_key
+        if batch_window is None:
+            batch_window = float(os.getenv("BATCH_WINDOW_MS", "50")) / 1000
+        self.batch_window = batch_window
+        self.max_batch = max_batch or int(os.getenv("MAX_BATCH_SIZE", "4"))
+        self.affinity = affinity
+        if max_wait is None:
+            max_wait = float(os.getenv("AFFINITY_MAX_WAIT_SECONDS", "30"))
+        self.max_wait = max_wait
+        self._pending: List[Job] = []
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.cached = 0
+        self.batches = 0
+        self.batched_jobs = 0
+        self.swaps_avoided = 0
+        self.fairness_promotions = 0
+
+    # ---------- API pública ----------
+
+    def submit(self, kind: str, payload: Any) -> Job:
+        """Encola un trabajo. Lanza QueueFullError si la cola está llena"""
+        job = Job(kind, payload)
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                raise QueueFullError(f"Cola llena ({self.max_pending} trabajos en espera)")
+            self._pending.append(job)
+            self._jobs[job.id] = job
+            self._prune_history()
+            # notify_all: un hilo puede estar esperando compañeros de lote
+            self._cond.notify_all()
+        return job
+
+    def add_completed(self, kind: str, payload: Any, result: dict) -> Job:
+        """Registra un trabajo ya resuelto sin pasar por la cola (p. ej. un acierto de caché)"""
+        job = Job(kind, payload)
+        job.started_at = job.created_at
+        job.finish("completed", result)
+        with self._cond:
+            self._jobs[job.id] = job
+            self.cached += 1
+            self._prune_history()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> Optional[int]:
+        """Posición en la cola (0 = siguiente) o None si ya no está esperando"""
+        with self._cond:
+            try:
+                return self._pending.index(job)
+            except ValueError:
+                return None
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancela un trabajo. Si está en espera se retira de la cola al momento;
+        si está en ejecución se marca y el callback de steps lo corta en el
+        siguiente step. Devuelve None si el trabajo no existe.
+        """
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return job
+            job.cancel_event.set()
+            if job not in self._pending:
+                return job
+            self._pending.remove(job)
+            self.cancelled += 1
+        job.finish("cancelled", {"success": False, "error": "Trabajo cancelado", "cancelled": True})
+        return job
+
+    def start(self):
+        """Arranca los hilos de inferencia (idempotente)"""
+        if self._workers:
+            return
+        for index in range(self.num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"inference-{index}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.num_workers,
+                "pending": len(self._pending),
+                "running": self._running,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "cached": self.cached,
+                "batching": {
+                    "enabled": self._batching_enabled,
+                    "window_ms": round(self.batch_window * 1000, 1),
+                    "max_batch": self.max_batch,
+                    "batches": self.batches,
+                    "batched_jobs": self.batched_jobs,
+                    "avg_batch_size": round(self.batched_jobs / self.batches, 2) if self.batches else 0.0,
+                },
+                "affinity": {
+                    "enabled": self.affinity is not None,
+                    "max_wait_seconds": self.max_wait,
+                    "swaps_avoided": self.swaps_avoided,
+                    "fairness_promotions": self.fairness_promotions,
+                },
+            }
+
+    # ---------- Hilos de inferencia ----------
+
+    def _score(self, job: Job) -> int:
+        try:
+            return self.affinity(job)
+        except Exception as e:
+            logger.warning(f"Error calculando la afinidad del trabajo {job.id}: {e}")
+            return 0
+
+    def _next_job(self) -> Job:
+        """
+        Saca el siguiente trabajo. Sin affinity, en orden de llegada; con
+        affinity, el de mayor puntuación (el más antiguo en caso de empate),
+        salvo que el primero de la cola haya superado max_wait.
+        Llamar con el lock tomado.
+        """
+        head = self._pending[0]
+        if self.affinity is None or len(self._pending) == 1:
+            return self._pending.pop(0)
+
+        scores = [self._score(job) for job in self._pending]
+        best = max(range(len(scores)), key=lambda index: (scores[index], -index))
+        if best == 0:
+            return self._pending.pop(0)
+
+        if time.time() - head.created_at >= self.max_wait:
+            # Cota de equidad: el trabajo más antiguo ya no puede ser adelantado
+            self.fairness_promotions += 1
+            return self._pending.pop(0)
+
+        self.swaps_avoided += 1
+        return self._pending.pop(best)
+
+    @property
+    def _batching_enabled(self) -> bool:
+        return self.batch_runner is not None and self.batch_key is not None and self.max_batch > 1
+
+    def _collect_batch(self, job: Job) -> List[Job]:
+        """
+        Reúne trabajos compatibles con `job` hasta max_batch, esperando como
+        mucho hasta batch_window desde la llegada de `job`. Llamar con el lock tomado.
+        """
+        batch = [job]
+        key = self.batch_key(job) if self._batching_enabled else None
+        if key is None:
+            return batch
+
+        deadline = job.created_at + self.batch_window
+        while True:
+            for candidate in list(self._pending):
+                if len(batch) >= self.max_batch:
+                    break
+                if self.batch_key(candidate) == key:
+                    self._pending.remove(candidate)
+                    batch.append(candidate)
+            remaining = deadline - time.time()
+            if len(batch) >= self.max_batch or remaining <= 0:
+                return batch
+            self._cond.wait(remaining)
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch = self._collect_batch(self._next_job())
+                for job in batch:
+                    job.status = "running"
+                    job.started_at = time.time()
+                self._running += len(batch)
+                if len(batch) > 1:
+                    self.batches += 1
+                    self.batched_jobs += len(batch)
+            self._run(batch)
+
+    def _run(self, batch: List[Job]):
+        try:
+            if len(batch) > 1:
+                results = self.batch_runner(batch)
+            else:
+                results = [self.runner(batch[0])]
+        except Exception as e:
+            logger.error(f"Error ejecutando trabajos {[job.id for job in batch]}: {e}")
+            results = [{"success": False, "error": str(e)} for _ in batch]
+
+        for job, result in zip(batch, results):
+            if job.cancel_requested:
+                # En un lote el trabajo cancelado puede haber terminado igualmente
+                status = "cancelled"
+                result = {"success": False, "error": "Trabajo cancelado", "cancelled": True}
+            else:
+                status = "completed" if result.get("success", True) else "failed"
+            with self._cond:
+                self._running -= 1
+                if status == "completed":
+                    self.completed += 1
+                elif status == "cancelled":
+                    self.cancelled += 1
+                else:
+                    self.failed += 1
+            job.finish(status, result)
+
+    def _prune_history(self):
+        """Olvida los trabajos terminados más antiguos por encima de `history`"""
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in list(self._jobs.keys()):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].done:
+                del self._jobs[job_id]
+                excess -= 1
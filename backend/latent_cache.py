@@ -0,0 +1,131 @@
+"""
+Caché de imágenes de origen para Image2Image
+Quien barre strength o prompt sobre la misma imagen repite en cada petición
+la decodificación, el redimensionado y el encode del VAE. Aquí se guardan
+la imagen preparada (por hash del archivo y tamaño) y la distribución
+latente del VAE (además por modelo, precisión y VAE), de forma que una
+petición repetida solo muestrea los latentes con su generador.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
+import logging
+
+import torch
+from diffusers.utils.torch_utils import randn_tensor
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class SourceLatentCache:
+    """
+    Cachés LRU de imágenes preparadas y de latentes de VAE.
+
+    Args:
+        max_entries: Entradas como máximo en cada caché (IMG2IMG_CACHE_SIZE, por defecto 32)
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        if max_entries is None:
+            max_entries = int(os.getenv("IMG2IMG_CACHE_SIZE", "32"))
+        self.max_entries = max_entries
+        # (hash, ancho, alto) -> imagen PIL ya redimensionada
+        self._images: "OrderedDict[Hashable, Image.Image]" = OrderedDict()
+        # (modelo, precisión, vae, hash, ancho, alto) -> (media, desviación) de la distribución latente
+        self._latents: "OrderedDict[Hashable, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.image_hits = 0
+        self.image_misses = 0
+        self.latent_hits = 0
+        self.latent_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _put(self, entries: OrderedDict, key: Hashable, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def _get(self, entries: OrderedDict, key: Hashable):
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+            return value
+
+    def prepared_image(
+        self,
+        image_hash: str,
+        width: int,
+        height: int,
+        prepare: Callable[[], Image.Image],
+    ) -> Image.Image:
+        """Imagen ya redimensionada para el pipeline; `prepare` solo se llama si no está en caché"""
+        key = (image_hash, width, height)
+        image = self._get(self._images, key)
+        if image is not None:
+            self.image_hits += 1
+            return image
+        self.image_misses += 1
+        image = prepare()
+        self._put(self._images, key, image)
+        return image
+
+    def latents(
+        self,
+        pipe,
+        model_key: str,
+        precision: str,
+        vae_key: str,
+        image_hash: str,
+        image: Image.Image,
+        generator,
+    ) -> torch.Tensor:
+        """
+        Latentes iniciales de Image2Image, ya escalados, para pasarlos como
+        `image` al pipeline (los acepta tal cual si tienen 4 canales).
+        Se muestrean con `generator` igual que haría el pipeline, así que
+        el resultado no cambia respecto a pasar la imagen.
+        """
+        key = (model_key, precision, vae_key, image_hash, image.width, image.height)
+        cached = self._get(self._latents, key)
+        if cached is not None:
+            self.latent_hits += 1
+        else:
+            self.latent_misses += 1
+            pixels = pipe.image_processor.preprocess(image).to(device=pipe.device, dtype=pipe.vae.dtype)
+            with torch.no_grad():
+                dist = pipe.vae.encode(pixels).latent_dist
+            cached = (dist.mean, dist.std)
+            self._put(self._latents, key, cached)
+
+        mean, std = cached
+        noise = randn_tensor(mean.shape, generator=generator, device=mean.device, dtype=mean.dtype)
+        return (mean + std * noise) * pipe.vae.config.scaling_factor
+
+    def drop_model(self, model_key: str):
+        """Olvida los latentes de un modelo (p. ej. al expulsarlo de la caché de pipelines)"""
+        with self._lock:
+            for key in [key for key in self._latents if key[0] == model_key]:
+                del self._latents[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "images": len(self._images),
+                "latents": len(self._latents),
+                "max_entries": self.max_entries,
+                "image_hits": self.image_hits,
+                "image_misses": self.image_misses,
+                "latent_hits": self.latent_hits,
+                "latent_misses": self.latent_misses,
+            }
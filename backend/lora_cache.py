@@ -0,0 +1,279 @@
+"""
+Caché de adaptadores LoRA residentes
+Cada modelo cargado mantiene varios LoRAs inyectados como adaptadores con
+nombre (backend peft de diffusers). Una petición solo activa los suyos con
+set_adapters y sus escalas: cambiar entre LoRAs ya cargados no vuelve a
+leer el archivo ni a modificar la UNet. Los menos usados se borran al
+superar LORA_CACHE_SIZE adaptadores o LORA_CACHE_MAX_MB por modelo.
+
+Las combinaciones frecuentes (LORA_FUSE_AFTER usos) se fusionan en los
+pesos del modelo: las capas LoRA quedan desactivadas y cada step cuesta lo
+mismo que sin LoRA. Los pesos fusionados de cada combinación se guardan en
+CPU (LORA_FUSED_CACHE_SIZE por modelo) para restaurarlos con una copia, sin
+volver a calcular la fusión ni cargar los archivos.
+"""
+
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+LoRACombo = Tuple[Tuple[str, float], ...]
+
+
+def adapter_name(lora_path: str) -> str:
+    """Nombre de adaptador estable para un archivo o repo de LoRA (sin puntos: lo exige peft)"""
+    return "lora_" + hashlib.sha1(lora_path.encode("utf-8")).hexdigest()[:12]
+
+
+def adapter_bytes(pipe, name: str) -> int:
+    """Memoria que ocupan los pesos de un adaptador en la UNet y el text encoder"""
+    total = 0
+    for module in (getattr(pipe, "unet", None), getattr(pipe, "text_encoder", None)):
+        if module is None:
+            continue
+        for param_name, param in module.named_parameters():
+            if f".{name}." in param_name:
+                total += param.numel() * param.element_size()
+    return total
+
+
+def _lora_layers(pipe) -> Dict[str, torch.nn.Module]:
+    """Capas envueltas por peft en la UNet y el text encoder, por nombre"""
+    layers = {}
+    for prefix in ("unet", "text_encoder"):
+        module = getattr(pipe, prefix, None)
+        if module is None:
+            continue
+        for name, layer in module.named_modules():
+            if hasattr(layer, "get_delta_weight") and hasattr(layer, "base_layer"):
+                layers[f"{prefix}.{name}"] = layer
+    return layers
+
+
+class LoRAFusion:
+    """
+    Estado de fusión de un modelo (vive en `entry.lora_fusion`): copia en CPU
+    de los pesos base que se tocan, pesos fusionados por combinación y la
+    combinación aplicada ahora mismo.
+    """
+
+    def __init__(self):
+        self.uses: Counter = Counter()
+        self.base: Dict[str, torch.Tensor] = {}
+        self.fused: "OrderedDict[LoRACombo, Dict[str, torch.Tensor]]" = OrderedDict()
+        self.applied: Optional[LoRACombo] = None
+        # Combinaciones cuya fusión falló: se quedan como adaptadores
+        self.unfusable = set()
+
+    def _write(self, layers: Dict[str, torch.nn.Module], weights: Dict[str, torch.Tensor]):
+        with torch.no_grad():
+            for name, weight in weights.items():
+                layers[name].base_layer.weight.copy_(weight, non_blocking=True)
+
+    def restore_base(self, pipe):
+        """Deshace la fusión aplicada copiando los pesos originales"""
+        if self.applied is None:
+            return
+        layers = _lora_layers(pipe)
+        self._write(layers, {name: self.base[name] for name in self.fused[self.applied]})
+        self.applied = None
+
+    def apply(self, pipe, combo: LoRACombo):
+        """Aplica unos pesos fusionados ya calculados"""
+        self._write(_lora_layers(pipe), self.fused[combo])
+        self.fused.move_to_end(combo)
+        self.applied = combo
+
+    def fuse(self, pipe, combo: LoRACombo, names: List[str], max_fused: int):
+        """Calcula los pesos fusionados de los adaptadores activos y los aplica"""
+        fused = {}
+        with torch.no_grad():
+            for name, layer in _lora_layers(pipe).items():
+                present = [adapter for adapter in names if adapter in layer.lora_A]
+                if not present:
+                    continue
+                weight = layer.base_layer.weight
+                if name not in self.base:
+                    self.base[name] = weight.detach().to("cpu", copy=True)
+                delta = sum(layer.get_delta_weight(adapter) for adapter in present)
+                fused[name] = (weight + delta.to(weight.dtype)).to("cpu")
+        self.fused[combo] = fused
+        while len(self.fused) > max_fused:
+            self.fused.popitem(last=False)
+        self.apply(pipe, combo)
+
+
+class LoRAAdapterCache:
+    """
+    LRU de adaptadores LoRA por modelo. El estado de cada modelo vive en
+    `entry.lora_adapters` (nombre -> bytes), así que desaparece con la entrada.
+    Las llamadas deben hacerse con `entry.lock` tomado.
+
+    Args:
+        max_adapters: Adaptadores residentes por modelo (LORA_CACHE_SIZE, por defecto 4)
+        max_bytes: Memoria máxima de adaptadores por modelo (LORA_CACHE_MAX_MB, por defecto 512)
+    """
+
+    def __init__(
+        self,
+        max_adapters: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        fuse_after: Optional[int] = None,
+        max_fused: Optional[int] = None,
+    ):
+        if max_adapters is None:
+            max_adapters = int(os.getenv("LORA_CACHE_SIZE", "4"))
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("LORA_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        if fuse_after is None:
+            fuse_after = int(os.getenv("LORA_FUSE_AFTER", "3"))
+        if max_fused is None:
+            max_fused = int(os.getenv("LORA_FUSED_CACHE_SIZE", "2"))
+        self.max_adapters = max(1, max_adapters)
+        self.max_bytes = max_bytes
+        # 0 desactiva la fusión
+        self.fuse_after = fuse_after
+        self.max_fused = max_fused
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fusions = 0
+        self.fused_hits = 0
+
+    def is_resident(self, entry, loras: List[Tuple[str, float]]) -> bool:
+        """
+        True si activar estos LoRAs no lee ningún archivo: son la combinación
+        fusionada aplicada o todos están ya inyectados como adaptadores.
+        Sin entry.lock es solo orientativo (lo usa la afinidad de la cola).
+        """
+        if entry.engine == "onnx":
+            return not loras
+        fusion: Optional[LoRAFusion] = entry.lora_fusion
+        if fusion is not None and loras and fusion.applied == tuple(loras):
+            return True
+        return all(adapter_name(lora_path) in entry.lora_adapters for lora_path, _ in loras)
+
+    def _load(self, entry, lora_path: str) -> Optional[str]:
+        """Inyecta un LoRA como adaptador, o devuelve el ya residente"""
+        name = adapter_name(lora_path)
+        adapters: OrderedDict = entry.lora_adapters
+        if name in adapters:
+            adapters.move_to_end(name)
+            with self._lock:
+                self.hits += 1
+            return name
+
+        with self._lock:
+            self.misses += 1
+        logger.info(f"Cargando LoRA desde: {lora_path}")
+        try:
+            entry.pipe.load_lora_weights(lora_path, adapter_name=name)
+        except Exception as e:
+            logger.warning(f"No se pudo cargar LoRA: {e}")
+            return None
+        adapters[name] = adapter_bytes(entry.pipe, name)
+        return name
+
+    def _evict(self, entry, keep: List[str]):
+        """Borra los adaptadores menos usados hasta cumplir los límites, sin tocar `keep`"""
+        adapters: OrderedDict = entry.lora_adapters
+        while len(adapters) > self.max_adapters or sum(adapters.values()) > self.max_bytes:
+            victim = next((name for name in adapters if name not in keep), None)
+            if victim is None:
+                break
+            del adapters[victim]
+            entry.pipe.delete_adapters(victim)
+            with self._lock:
+                self.evictions += 1
+            logger.info(f"Expulsando LoRA {victim} de {entry.model_key}")
+
+    def activate(self, entry, loras: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+        """
+        Deja activos exactamente los LoRAs pedidos, (ruta, escala), con sus
+        escalas; sin LoRAs, desactiva todos. Devuelve los que quedaron activos.
+        Una combinación ya fusionada se restaura copiando sus pesos; una que
+        llega a LORA_FUSE_AFTER usos se fusiona.
+        """
+        if entry.engine == "onnx":
+            if loras:
+                logger.warning("El motor ONNX no admite LoRA, se ignora")
+            return []
+
+        combo: LoRACombo = tuple(loras)
+        fusion: Optional[LoRAFusion] = entry.lora_fusion
+        if fusion is not None:
+            if combo and fusion.applied == combo:
+                with self._lock:
+                    self.fused_hits += 1
+                return list(combo)
+            fusion.restore_base(entry.pipe)
+            if combo in fusion.fused:
+                fusion.apply(entry.pipe, combo)
+                entry.pipe.disable_lora()
+                with self._lock:
+                    self.fused_hits += 1
+                return list(combo)
+
+        active, names, weights = [], [], []
+        for lora_path, scale in loras:
+            name = self._load(entry, lora_path)
+            if name is not None and name not in names:
+                active.append((lora_path, scale))
+                names.append(name)
+                weights.append(scale)
+        self._evict(entry, names)
+
+        if not entry.lora_adapters:
+            return active
+        if names:
+            entry.pipe.enable_lora()
+            entry.pipe.set_adapters(names, adapter_weights=weights)
+        else:
+            entry.pipe.disable_lora()
+
+        if combo and len(active) == len(combo) and self.fuse_after > 0 and self.max_fused > 0:
+            if fusion is None:
+                fusion = entry.lora_fusion = LoRAFusion()
+            fusion.uses[combo] += 1
+            if fusion.uses[combo] >= self.fuse_after and combo not in fusion.unfusable:
+                self._fuse(entry, fusion, combo, names)
+        return active
+
+    def _fuse(self, entry, fusion: LoRAFusion, combo: LoRACombo, names: List[str]):
+        logger.info(f"Fusionando LoRAs en {entry.model_key}: {[path for path, _ in combo]}")
+        try:
+            fusion.fuse(entry.pipe, combo, names, self.max_fused)
+        except Exception as e:
+            # Se sigue con los adaptadores sin fusionar (p. ej. pesos int8)
+            logger.warning(f"No se pudo fusionar LoRA: {e}")
+            fusion.fused.pop(combo, None)
+            fusion.restore_base(entry.pipe)
+            fusion.unfusable.add(combo)
+            return
+        entry.pipe.disable_lora()
+        with self._lock:
+            self.fusions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "max_adapters": self.max_adapters,
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "fuse_after": self.fuse_after,
+                "max_fused": self.max_fused,
+                "fusions": self.fusions,
+                "fused_hits": self.fused_hits,
+            }
@@ -1,8 +1,9 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse
 from pydantic import BaseModel
 import os
+import asyncio
 from pathlib import Path
 import torch
 from diffusers import (
@@ -10,21 +11,79 @@ from diffusers import (
     StableDiffusionImg2ImgPipeline,
     StableDiffusionInpaintPipeline,
     AutoencoderKL,
-    DPMSolverMultistepScheduler,
 )
-from datetime import datetime
-import uuid
 import logging
-from typing import Optional
+import threading
+import time
+from contextlib import nullcontext
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 from backend.enhancement import (
-    LoRAManager,
     ControlNetManager,
     Upscaler,
     NegativeEmbedding,
     Image2ImageProcessor,
     InpaintingProcessor,
 )
+from backend.pipeline_cache import PipelineCache, PipelineEntry, estimate_module_bytes, estimate_pipeline_bytes
+from backend.vae_cache import VAECache, swap_vae
+from backend.checkpoint_loader import load_single_file_pipeline, load_timings
+from backend.cpu_profile import CPUProfile
+from backend.compile_mode import COMPILE_ENABLED, compile_pipeline, compile_vae, warmup_compiled
+from backend.onnx_engine import (
+    export_pipeline_to_onnx,
+    is_exported,
+    load_onnx_pipelines,
+    onnx_dir_for,
+    onnx_size_bytes,
+)
+from backend.quantization import (
+    load_quantization_report,
+    load_quantized_components,
+    quantize_pipeline,
+)
+from backend import model_config
+from backend.model_config import (
+    EMBEDDINGS_DIR,
+    LORAS_DIR,
+    MODELS_DIR,
+    VAES_DIR,
+    ensure_registry_loaded,
+    get_available_models,
+    get_model_hash,
+    known_model_hash,
+    model_registry,
+    set_model_options,
+)
+from backend.jobs import Job, JobQueue
+from backend.job_api import create_jobs_router
+from backend.schemas import (
+    GenerateRequest,
+    Image2ImageRequest,
+    ModelOptionsRequest,
+    batch_key_fields,
+    generation_response,
+    request_loras,
+    request_sampler,
+)
+from backend.generation_store import (
+    GENERATIONS_DIR,
+    gallery_index,
+    load_upload,
+    result_cache,
+    store_image,
+    upload_hash,
+)
+from backend.latent_cache import SourceLatentCache
+from backend.lora_cache import LoRAAdapterCache
+from backend.textual_inversion import TextualInversionRegistry
+from backend.samplers import DEFAULT_SAMPLER, SAMPLERS, sampler_timings, scheduler_for
+from backend.result_cache import generation_variant, image_cache_key
+from backend.progress import GenerationCancelled, StepProgress
+from backend.prompt_cache import PromptEmbeddingCache, text_encoder_state
+from backend.startup import StartupState, SwitchState, get_preload_models, start_preload_thread
 from PIL import Image
+import numpy as np
 import io
 
 # Configurar logging
@@ -33,100 +92,12 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Image Generator AI Backend", version="0.2.0")
 
-# Rutas base para modelos
-BASE_DIR = Path(__file__).parent.parent
-MODELS_DIR = BASE_DIR / "models"
-VAES_DIR = BASE_DIR / "vaes"
-LORAS_DIR = BASE_DIR / "loras"
-EMBEDDINGS_DIR = BASE_DIR / "embeddings"
-CONTROLNETS_DIR = BASE_DIR / "controlnets"
-UPSCALERS_DIR = BASE_DIR / "upscalers"
-
-# Crear directorios si no existen
-for directory in [MODELS_DIR, VAES_DIR, LORAS_DIR, EMBEDDINGS_DIR, CONTROLNETS_DIR, UPSCALERS_DIR]:
-    directory.mkdir(parents=True, exist_ok=True)
-
-
-def scan_local_models(folder: Path, extensions: tuple = (".pt", ".safetensors", ".ckpt")) -> dict:
-    """Escanea una carpeta en busca de modelos locales"""
-    models = {}
-    if not folder.exists():
-        return models
-    
-    for item in folder.iterdir():
-        if item.is_dir():
-            # Buscar archivos de modelo dentro del directorio
-            for file in item.iterdir():
-                if file.suffix in extensions or (item / "model_index.json").exists():
-                    models[item.name] = {
-                        "name": item.name,
-                        "path": str(item),
-                        "type": "local",
-                        "description": f"Modelo local: {item.name}",
-                    }
-                    break
-        elif item.is_file() and item.suffix in extensions:
-            # Archivo de modelo individual
-            name = item.stem
-            models[name] = {
-                "name": name,
-                "path": str(item),
-                "type": "local_file",
-                "description": f"Modelo: {name}",
-            }
-    
-    return models
-
-
-def get_available_models() -> dict:
-    """Obtiene modelos disponibles: locales + Hugging Face"""
-    local_models = scan_local_models(MODELS_DIR)
-    
-    # Modelos por defecto de Hugging Face (si no hay locales)
-    default_models = {
-        # Modelos rápidos
-        "stable-diffusion-v1-5": {
-            "name": "Stable Diffusion v1.5",
-            "model_id": "runwayml/stable-diffusion-v1-5",
-            "type": "huggingface",
-            "description": "⚡ Rápido, equilibrado (512x512)",
-        },
-        # Modelos de mejor calidad
-        "stable-diffusion-v2-1": {
-            "name": "Stable Diffusion v2.1",
-            "model_id": "stabilityai/stable-diffusion-2-1",
-            "type": "huggingface",
-            "description": "🎨 Mejor calidad pero más lento",
-        },
-        # Modelos XL
-        "stable-diffusion-xl": {
-            "name": "Stable Diffusion XL Base 1.0",
-            "model_id": "stabilityai/stable-diffusion-xl-base-1.0",
-            "type": "huggingface",
-            "description": "🔥 Excelente calidad (1024x1024)",
-        },
-        "sdxl-turbo": {
-            "name": "SDXL Turbo",
-            "model_id": "stabilityai/sdxl-turbo",
-            "type": "huggingface",
-            "description": "⚡ SDXL rápido (4 steps)",
-        },
-        # Modelos alternativos
-        "animagine": {
-            "name": "Animagine XL 2.0",
-            "model_id": "Linaqruf/animagine-xl-2.0",
-            "type": "huggingface",
-            "description": "🎌 Anime de alta calidad",
-        },
-    }
-    
-    # Combinar: locales tienen prioridad
-    return {**default_models, **local_models}
+ensure_registry_loaded()
 
 
 def get_available_vaes() -> dict:
     """Obtiene VAEs disponibles: locales + Hugging Face"""
-    local_vaes = scan_local_models(VAES_DIR)
+    local_vaes = model_registry.get("vaes")
     
     default_vaes = {
         "default": {
@@ -160,126 +131,486 @@ def get_available_vaes() -> dict:
 
 def get_available_loras() -> dict:
     """Obtiene LoRAs disponibles locales"""
-    return scan_local_models(LORAS_DIR)
+    return model_registry.get("loras")
 
 
 def get_available_embeddings() -> dict:
     """Obtiene embeddings negativos disponibles"""
-    return scan_local_models(EMBEDDINGS_DIR, extensions=(".pt", ".safetensors", ".bin"))
+    return model_registry.get("embeddings")
 
 
 def get_available_controlnets() -> dict:
     """Obtiene ControlNets disponibles"""
-    return scan_local_models(CONTROLNETS_DIR)
+    return model_registry.get("controlnets")
 
 
 def get_available_upscalers() -> dict:
     """Obtiene upscalers disponibles"""
-    return scan_local_models(UPSCALERS_DIR, extensions=(".pth", ".pt", ".safetensors"))
+    return model_registry.get("upscalers")
 
 
-# Obtener modelos disponibles
-AVAILABLE_MODELS = get_available_models()
-AVAILABLE_VAES = get_available_vaes()
-
-# Estado global
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Estado global (DEVICE puede forzarse por variable de entorno)
+DEVICE = os.getenv("DEVICE") or ("cuda" if torch.cuda.is_available() else "cpu")
+if DEVICE == "cuda" and not torch.cuda.is_available():
+    print("[WARN] DEVICE=cuda pero CUDA no está disponible, usando cpu")
+    DEVICE = "cpu"
 print(f"[INFO] Usando device: {DEVICE}")
 
+# Perfil de CPU (hilos, channels_last, bf16), solo si no hay GPU
+cpu_profile = CPUProfile.from_env() if DEVICE == "cpu" else None
+if cpu_profile is not None:
+    cpu_profile.apply_threads()
+    print(f"[INFO] Perfil de CPU: {cpu_profile.to_dict()}")
+
+
+def inference_autocast():
+    """Autocast bfloat16 del perfil de CPU, o contexto vacío si no aplica"""
+    return cpu_profile.autocast() if cpu_profile is not None else nullcontext()
+
+
+def inference_settings() -> dict:
+    """Dispositivo y autocast de este proceso (los workers se los anuncian al gateway)"""
+    return {"device": DEVICE, "bf16": bool(cpu_profile is not None and cpu_profile.bf16)}
+
 current_model_id = None
+current_vae_id = None
+current_engine = None
 pipe = None
 img2img_pipe = None
 inpaint_pipe = None
 upscaler = Upscaler()
 current_lora = None
 
-def load_model(model_key: str, vae_key: str = "default"):
-    """Carga un modelo específico con VAE personalizado"""
-    global pipe, img2img_pipe, inpaint_pipe, current_model_id
+# Serializa cargas de modelo entre la precarga y las peticiones
+model_lock = threading.RLock()
+startup_state = StartupState()
+model_switch = SwitchState()
+
+
+def _release_pipeline(entry: PipelineEntry):
+    """Libera la memoria de un modelo expulsado de la caché"""
+    entry.pipe = None
+    entry.img2img_pipe = None
+    entry.inpaint_pipe = None
+    entry.default_vae = None
+    entry.default_scheduler = None
+    entry.schedulers.clear()
+    entry.lora_fusion = None
+    entry.embedding_tokens.clear()
+    if entry.model_key not in pipeline_cache:
+        prompt_cache.drop_model(entry.model_key)
+        source_cache.drop_model(entry.model_key)
+    if DEVICE == "cuda":
+        torch.cuda.empty_cache()
+
 
-    if model_key not in AVAILABLE_MODELS:
-        raise ValueError(f"Modelo no disponible: {model_key}")
+# Caché de pipelines: varios modelos residentes con expulsión LRU
+pipeline_cache = PipelineCache(on_evict=_release_pipeline)
 
-    if vae_key not in AVAILABLE_VAES:
-        raise ValueError(f"VAE no disponible: {vae_key}")
+# Ahorro de memoria de los modelos cargados en int8
+quantization_reports = {}
 
-    model_info = AVAILABLE_MODELS[model_key]
-    vae_info = AVAILABLE_VAES[vae_key]
 
-    print(f"[INFO] Cargando modelo: {model_info['name']}")
+def _load_vae(vae_key: str):
+    """Carga un VAE desde disco o Hugging Face"""
+    vae_info = get_available_vaes()[vae_key]
+    print(f"[INFO] Cargando VAE: {vae_info['name']}")
+    vae_source = vae_info.get("path") or vae_info.get("vae_id")
+    vae = AutoencoderKL.from_pretrained(
+        vae_source,
+        torch_dtype=torch.float16 if DEVICE == "cuda" else torch.float32,
+        local_files_only=vae_info.get("type") == "local",
+    ).to(DEVICE)
+    if cpu_profile is not None:
+        cpu_profile.apply_to_vae(vae)
+    if COMPILE_ENABLED:
+        compile_vae(vae)
+    return vae
 
-    # Descargar modelo anterior si existe
-    if pipe is not None:
-        del pipe
-        if img2img_pipe is not None:
-            del img2img_pipe
-        if inpaint_pipe is not None:
-            del inpaint_pipe
-        if DEVICE == "cuda":
-            torch.cuda.empty_cache()
 
-    # Cargar modelo principal
-    try:
-        model_source = model_info.get("path") or model_info.get("model_id")
-        pipe = StableDiffusionPipeline.from_pretrained(
-            model_source,
-            torch_dtype=torch.float16 if DEVICE == "cuda" else torch.float32,
-            safety_checker=None,
-            local_files_only=model_info.get("type") == "local",
-        )
-    except Exception as e:
-        print(f"[WARN] Error con dtype/revision, intentando con defaults: {e}")
-        model_source = model_info.get("path") or model_info.get("model_id")
-        pipe = StableDiffusionPipeline.from_pretrained(
-            model_source,
-            safety_checker=None,
-            local_files_only=model_info.get("type") == "local",
-        )
+# Caché de VAEs: se intercambian sin recargar el modelo base
+vae_cache = VAECache(loader=_load_vae, size_fn=estimate_module_bytes)
+
+# Caché de embeddings de texto: el text encoder no se repite para prompts ya vistos
+prompt_cache = PromptEmbeddingCache()
+
+# Adaptadores LoRA residentes por modelo: cambiar de LoRA no recarga el archivo
+lora_cache = LoRAAdapterCache()
+
+def _resolve_embedding(embedding_name: str) -> Optional[str]:
+    """Ruta de un embedding por su clave en el registro (sin distinguir mayúsculas) o por su alias predefinido"""
+    embeddings = {key.lower(): info for key, info in get_available_embeddings().items()}
+    info = embeddings.get(embedding_name.lower())
+    if info is None and embedding_name in NegativeEmbedding.EMBEDDING_PATHS:
+        info = embeddings.get(Path(NegativeEmbedding.EMBEDDING_PATHS[embedding_name]).name.lower())
+    return info["path"] if info else None
+
 
-    # Cargar VAE si se especifica
+# Embeddings de textual inversion cargados por modelo: se cargan una vez
+textual_inversions = TextualInversionRegistry(resolve=_resolve_embedding)
+
+# Caché de imágenes de origen de img2img: imagen preparada y latentes del VAE por hash
+source_cache = SourceLatentCache()
+
+# Tamaño al que se prepara la imagen de origen de img2img
+IMG2IMG_SIZE = (512, 512)
+
+
+def prompt_kwargs(
+    entry: PipelineEntry,
+    target_pipe,
+    prompts: List[str],
+    negative_prompts: List[str],
+    loras: Sequence[Tuple[str, float]] = (),
+) -> dict:
+    """
+    Prompts para una llamada a cualquiera de los pipelines del modelo
+    (txt2img, img2img, inpaint): embeddings desde la caché, o el texto tal
+    cual en ONNX o con la caché desactivada (PROMPT_CACHE_SIZE=0).
+    """
+    if entry.engine == "onnx" or not prompt_cache.enabled:
+        return {
+            "prompt": prompts if len(prompts) > 1 else prompts[0],
+            "negative_prompt": negative_prompts if len(negative_prompts) > 1 else negative_prompts[0],
+        }
+    return prompt_cache.pipeline_kwargs(
+        target_pipe,
+        entry.model_key,
+        text_encoder_state(entry, loras),
+        prompts,
+        negative_prompts,
+        DEVICE,
+    )
+
+
+def apply_vae(entry: PipelineEntry, vae_key: str) -> str:
+    """
+    Intercambia el VAE de un modelo cargado (txt2img, img2img e inpaint) y
+    devuelve el que queda en uso, que es el que debe figurar en los metadatos.
+    Si el VAE pedido no se puede cargar, lanza: el trabajo falla en lugar de
+    generar con el VAE anterior.
+    """
+    if entry.vae_key == vae_key:
+        return vae_key
+    if entry.engine == "onnx":
+        # Los grafos ONNX llevan el VAE del modelo exportado
+        logger.warning("El motor ONNX no admite cambiar de VAE, se usa el del modelo")
+        return entry.vae_key
+
+    vae_info = get_available_vaes()[vae_key]
     if vae_info.get("vae_id") or vae_info.get("path"):
-        print(f"[INFO] Cargando VAE: {vae_info['name']}")
         try:
-            vae_source = vae_info.get("path") or vae_info.get("vae_id")
-            vae = AutoencoderKL.from_pretrained(
-                vae_source,
-                torch_dtype=torch.float16 if DEVICE == "cuda" else torch.float32,
-                local_files_only=vae_info.get("type") == "local",
+            vae = vae_cache.get(vae_key)
+        except Exception as e:
+            raise RuntimeError(f"Error cargando VAE {vae_key}: {e}") from e
+    else:
+        vae = entry.default_vae
+
+    swap_vae(entry, vae)
+    entry.vae_key = vae_key
+    return vae_key
+
+
+def get_model_engine(model_key: str) -> str:
+    """Motor de inferencia de un modelo en este proceso (ver model_config)"""
+    return model_config.get_model_engine(model_key, DEVICE)
+
+
+def get_model_precision(model_key: str) -> str:
+    """Precisión de un modelo en este proceso (ver model_config)"""
+    return model_config.get_model_precision(model_key, DEVICE)
+
+
+def _load_torch_pipeline(model_key: str, torch_dtype, **components) -> StableDiffusionPipeline:
+    """
+    Carga los pesos de un modelo en un StableDiffusionPipeline de PyTorch.
+    Los componentes ya cargados que se pasen (p. ej. unet=...) no se leen de disco.
+    """
+    model_info = get_available_models()[model_key]
+    model_source = model_info.get("path") or model_info.get("model_id")
+    start = time.perf_counter()
+
+    if model_info.get("type") == "local_file":
+        # Checkpoint de un solo archivo: conversión cacheada por hash
+        new_pipe = load_single_file_pipeline(
+            StableDiffusionPipeline,
+            model_source,
+            model_key=model_key,
+            content_hash=known_model_hash(model_key),
+            torch_dtype=torch_dtype,
+            **components,
+        )
+    else:
+        try:
+            new_pipe = StableDiffusionPipeline.from_pretrained(
+                model_source,
+                torch_dtype=torch_dtype,
+                safety_checker=None,
+                local_files_only=model_info.get("type") == "local",
+                **components,
             )
-            pipe.vae = vae
         except Exception as e:
-            print(f"[WARN] Error cargando VAE: {e}")
+            print(f"[WARN] Error con dtype/revision, intentando con defaults: {e}")
+            new_pipe = StableDiffusionPipeline.from_pretrained(
+                model_source,
+                safety_checker=None,
+                local_files_only=model_info.get("type") == "local",
+                **components,
+            )
+        load_timings.record(model_key, "load", time.perf_counter() - start)
+    return new_pipe
+
+
+def _build_onnx_pipeline(model_key: str) -> PipelineEntry:
+    """Exporta el modelo a ONNX si hace falta y carga los pipelines de ONNX Runtime"""
+    model_hash = get_model_hash(model_key)
+    onnx_dir = onnx_dir_for(model_hash)
+
+    if not is_exported(onnx_dir):
+        print(f"[INFO] Exportando {model_key} a ONNX en {onnx_dir}")
+        export_pipeline_to_onnx(_load_torch_pipeline(model_key, torch.float32), onnx_dir)
+
+    threads = cpu_profile.threads if cpu_profile is not None else None
+    onnx_pipe, onnx_img2img_pipe = load_onnx_pipelines(onnx_dir, threads=threads)
+    entry = PipelineEntry(
+        model_key,
+        onnx_pipe,
+        img2img_pipe=onnx_img2img_pipe,
+        size_bytes=onnx_size_bytes(onnx_dir),
+    )
+    entry.engine = "onnx"
+    entry.precision = "fp32"
+    entry.model_hash = model_hash
+    return entry
+
+
+def _build_pipeline(model_key: str) -> PipelineEntry:
+    """Carga desde disco un modelo y crea los pipelines derivados"""
+    model_info = get_available_models()[model_key]
+
+    print(f"[INFO] Cargando modelo: {model_info['name']}")
+
+    if get_model_engine(model_key) == "onnx":
+        return _build_onnx_pipeline(model_key)
+
+    # Cargar modelo principal
+    torch_dtype = torch.float16 if DEVICE == "cuda" else torch.float32
+    precision = get_model_precision(model_key)
+    # Solo se calcula el hash si hace falta (int8); si no, el del registro si ya lo tiene
+    model_hash = known_model_hash(model_key)
+
+    if precision == "int8":
+        # Text encoder y UNet int8 desde caché; si no existen se cuantizan al cargar
+        model_hash = get_model_hash(model_key)
+        quantized = load_quantized_components(model_hash)
+        new_pipe = _load_torch_pipeline(model_key, torch_dtype, **quantized)
+        if quantized:
+            report = load_quantization_report(model_hash)
+        else:
+            report = quantize_pipeline(new_pipe, model_hash)
+        quantization_reports[model_key] = report
+    else:
+        new_pipe = _load_torch_pipeline(model_key, torch_dtype)
 
     # Optimizaciones para GPU
-    pipe = pipe.to(DEVICE)
+    new_pipe = new_pipe.to(DEVICE)
+    # El sampler se elige por petición (backend.samplers) sobre el scheduler propio del modelo
     if DEVICE == "cuda":
-        pipe.enable_attention_slicing()
-        pipe.scheduler = DPMSolverMultistepScheduler.from_config(
-            pipe.scheduler.config,
-            algorithm_type="dpmsolver",
-            use_karras_sigmas=True,
-        )
+        new_pipe.enable_attention_slicing()
+    elif cpu_profile is not None:
+        cpu_profile.apply_to_pipeline(new_pipe)
+
+    # torch.compile opcional (TORCH_COMPILE=1), calentando las resoluciones comunes.
+    # Las capas int8 dinámicas no se compilan.
+    if COMPILE_ENABLED and precision != "int8":
+        compile_pipeline(new_pipe)
+        warmup_compiled(new_pipe, DEVICE, autocast_fn=inference_autocast)
 
     # Crear pipelines Image2Image e Inpaint basados en este modelo
-    img2img_pipe = StableDiffusionImg2ImgPipeline(**pipe.components)
-    inpaint_pipe = StableDiffusionInpaintPipeline(**pipe.components)
-
-    current_model_id = model_key
-    print(f"[INFO] Modelo cargado exitosamente: {model_info['name']}")
-    return True
-
-# Cargar modelo inicial
-try:
-    # Usar el primer modelo disponible
-    first_model = list(AVAILABLE_MODELS.keys())[0] if AVAILABLE_MODELS else None
-    if first_model:
-        load_model(first_model, "default")
-    else:
-        print(f"[ERROR] No hay modelos disponibles")
-        pipe = None
-except Exception as e:
-    print(f"[ERROR] No se pudo cargar el modelo inicial: {e}")
-    pipe = None
+    # (comparten los mismos componentes, no duplican memoria)
+    entry = PipelineEntry(
+        model_key,
+        new_pipe,
+        img2img_pipe=StableDiffusionImg2ImgPipeline(**new_pipe.components),
+        inpaint_pipe=StableDiffusionInpaintPipeline(**new_pipe.components),
+        size_bytes=estimate_pipeline_bytes(new_pipe),
+    )
+    entry.precision = precision
+    entry.model_hash = model_hash
+    model_info = model_registry.find("models", model_key)
+    if model_info is not None:
+        entry.model_fingerprint = (model_info.get("size"), model_info.get("mtime"))
+    return entry
+
+
+# Cargas en curso por modelo: quien pide un modelo que se está cargando
+# espera a la misma carga en lugar de lanzar otra
+_loading: Dict[str, Future] = {}
+
+
+def _is_stale(model_key: str, entry: PipelineEntry) -> bool:
+    """True si cambió el motor o la precisión configurados desde que se cargó"""
+    return entry.engine != get_model_engine(model_key) or entry.precision != get_model_precision(model_key)
+
+
+def _load_into_cache(model_key: str, future: Future):
+    """
+    Construye el pipeline fuera de model_lock, así que los modelos ya
+    cargados siguen sirviendo, y lo publica en la caché de forma atómica.
+    La versión anterior del modelo, si la había, se libera cuando terminan
+    los trabajos que la estaban usando.
+    """
+    try:
+        new_entry = _build_pipeline(model_key)
+    except Exception as e:
+        logger.error(f"Error cargando modelo {model_key}: {e}")
+        with model_lock:
+            _loading.pop(model_key, None)
+        future.set_exception(e)
+        return
+
+    with model_lock:
+        old_entry = pipeline_cache.remove(model_key)
+        pipeline_cache.put(new_entry)
+        _loading.pop(model_key, None)
+    if old_entry is not None:
+        pipeline_cache.retire(old_entry)
+    print(f"[INFO] Modelo cargado exitosamente: {get_available_models()[model_key]['name']}")
+    future.set_result(new_entry)
+
+
+def get_pipeline_entry(model_key: str, acquire: bool = False) -> PipelineEntry:
+    """
+    Devuelve un modelo cargado, cargándolo en la caché si hace falta.
+    Con acquire=True la entrada queda reservada hasta pipeline_cache.release(entry)
+    y no se libera aunque mientras tanto se expulse o se reemplace.
+    Si cambió el motor o la precisión, la versión cargada sigue sirviendo
+    mientras la nueva se carga en segundo plano.
+    """
+    if model_key not in get_available_models():
+        raise ValueError(f"Modelo no disponible: {model_key}")
+
+    while True:
+        with model_lock:
+            entry = pipeline_cache.get(model_key, acquire=acquire)
+            if entry is not None and not _is_stale(model_key, entry):
+                return entry
+            future = _loading.get(model_key)
+            start = future is None
+            if start:
+                future = Future()
+                _loading[model_key] = future
+
+        if entry is not None:
+            # Versión anterior: sirve hasta que la nueva esté lista
+            if start:
+                threading.Thread(
+                    target=_load_into_cache, args=(model_key, future), name=f"reload-{model_key}", daemon=True
+                ).start()
+            return entry
+
+        if start:
+            _load_into_cache(model_key, future)
+        # Propaga el error de carga; si no, vuelve a buscar la entrada recién publicada
+        future.result()
+
+
+def load_model(model_key: str, vae_key: str = "default", acquire: bool = False) -> PipelineEntry:
+    """
+    Activa un modelo con VAE personalizado, reutilizándolo si ya está en caché.
+    Con acquire=True el llamador debe hacer pipeline_cache.release(entry) al terminar.
+    """
+    global pipe, img2img_pipe, inpaint_pipe, current_model_id, current_vae_id, current_engine
+
+    if vae_key not in get_available_vaes():
+        raise ValueError(f"VAE no disponible: {vae_key}")
+
+    entry = get_pipeline_entry(model_key, acquire=acquire)
+    try:
+        with entry.lock:
+            apply_vae(entry, vae_key)
+    except Exception:
+        if acquire:
+            pipeline_cache.release(entry)
+        raise
+
+    with model_lock:
+        pipe = entry.pipe
+        img2img_pipe = entry.img2img_pipe
+        inpaint_pipe = entry.inpaint_pipe
+        current_model_id = model_key
+        current_vae_id = entry.vae_key
+        current_engine = entry.engine
+    return entry
+
+
+def switch_model(model_key: str, vae_key: str = "default"):
+    """
+    Cambio de modelo explícito: se ejecuta en un hilo de fondo mientras el
+    modelo actual sigue atendiendo peticiones; current_model cambia solo
+    cuando el nuevo está listo.
+    """
+    model_switch.set(
+        status="loading",
+        from_model=current_model_id,
+        to_model=model_key,
+        vae=vae_key,
+        error=None,
+        started_at=time.time(),
+        finished_at=None,
+    )
+    try:
+        load_model(model_key, vae_key)
+        model_switch.set(status="ready", finished_at=time.time())
+    except Exception as e:
+        # Se registra en model_switch: lo consultan /health y /api/load-model
+        logger.error(f"Error cambiando a {model_key}: {e}")
+        model_switch.set(status="failed", error=str(e), finished_at=time.time())
+
+
+def make_generator(seed: int, engine: Optional[str] = None):
+    """Generador del motor (por defecto el activo): numpy para ONNX Runtime, torch para PyTorch"""
+    if (engine or current_engine) == "onnx":
+        return np.random.RandomState(seed)
+    return torch.Generator(device=DEVICE).manual_seed(seed)
+
+
+def warmup_model(model_key: str):
+    """Inferencia corta para inicializar kernels y asignar memoria del device"""
+    steps = int(os.getenv("WARMUP_STEPS", "2"))
+    size = int(os.getenv("WARMUP_SIZE", "512"))
+    if steps <= 0:
+        return
+
+    entry = get_pipeline_entry(model_key, acquire=True)
+    try:
+        with entry.lock, torch.no_grad(), inference_autocast():
+            entry.pipe(
+                prompt="warmup",
+                num_inference_steps=steps,
+                height=size,
+                width=size,
+                generator=make_generator(0, entry.engine),
+            )
+    finally:
+        pipeline_cache.release(entry)
+
+
+@app.on_event("startup")
+def start_background_preload():
+    """Precarga los modelos en segundo plano; la API ya sirve peticiones"""
+    models = get_preload_models(get_available_models())
+    print(f"[INFO] Modelos a precargar: {models or 'ninguno'}")
+    model_registry.start_background_refresh()
+    # Índice de galería y caché de resultados listo antes de la primera petición
+    threading.Thread(target=gallery_index.ensure_backfilled, name="gallery-backfill", daemon=True).start()
+    start_preload_thread(
+        startup_state,
+        models,
+        load_fn=lambda model_key: load_model(model_key, "default"),
+        warmup_fn=warmup_model,
+    )
+    job_queue.start()
 
 # CORS
 app.add_middleware(
@@ -290,42 +621,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Crear directorio de generaciones
-GENERATIONS_DIR = Path("./generated_images")
-GENERATIONS_DIR.mkdir(exist_ok=True)
-
-
-class GenerateRequest(BaseModel):
-    prompt: str
-    negative_prompt: str = ""
-    steps: int = 20
-    guidance_scale: float = 7.5
-    seed: int = 0
-    width: int = 512
-    height: int = 512
-    model: str = "stable-diffusion-v1-5"
-    vae: str = "default"
-    use_karras: bool = True
-    lora_path: Optional[str] = None
-    lora_scale: float = 0.75
-    upscale_factor: int = 0  # 0 = no upscale, 2 o 4
-    negative_embedding: Optional[str] = None
-
-
-class Image2ImageRequest(BaseModel):
-    prompt: str
-    negative_prompt: str = ""
-    steps: int = 20
-    guidance_scale: float = 7.5
-    seed: int = 0
-    strength: float = 0.8  # 0.0-1.0, qué tanto cambiar
-    model: str = "stable-diffusion-v1-5"
-    vae: str = "default"
-    lora_path: Optional[str] = None
-    lora_scale: float = 0.75
-    # Base64 de imagen o URL
-
-
 class InpaintRequest(BaseModel):
     prompt: str
     negative_prompt: str = ""
@@ -360,147 +655,321 @@ async def health_check():
         "message": "Backend is running",
         "device": DEVICE,
         "current_model": current_model_id,
+        "current_vae": current_vae_id,
+        "ready": startup_state.ready,
+        "model_switch": model_switch.to_dict(),
+        "loading_models": sorted(_loading.keys()),
+        "pipelines_in_flight": pipeline_cache.stats()["in_flight"],
+        "pending_release": pipeline_cache.stats()["pending_release"],
+        "cpu_profile": cpu_profile.to_dict() if cpu_profile is not None else None,
+        "jobs": job_queue.stats(),
     }
 
 
-@app.post("/api/generate")
-async def generate_image(request: GenerateRequest):
-    """
-    Genera una imagen usando Stable Diffusion con opciones avanzadas.
-    Soporta: LoRA, Upscaler, Negative Embeddings
-    """
-    if pipe is None:
-        return {"success": False, "error": "Modelo no cargado. Verifica las dependencias."}
+@app.get("/api/registry")
+async def registry_stats():
+    """Estado del índice de modelos locales"""
+    return model_registry.stats()
 
-    if not request.prompt.strip():
-        return {"success": False, "error": "El prompt no puede estar vacío."}
 
-    try:
-        # Cambiar modelo si es diferente
-        if request.model != current_model_id:
-            print(f"[INFO] Cambiando modelo a {request.model}")
-            load_model(request.model, request.vae)
-
-        print(f"[INFO] Generando imagen - Prompt: {request.prompt}")
-        print(f"[INFO] Parámetros: steps={request.steps}, guidance={request.guidance_scale}, model={request.model}, vae={request.vae}")
-
-        # Cargar LoRA si se especifica
-        if request.lora_path:
-            logger.info(f"Cargando LoRA: {request.lora_path}")
-            LoRAManager.load_lora(pipe, request.lora_path, request.lora_scale)
-
-        # Cargar Negative Embedding si se especifica
-        if request.negative_embedding:
-            logger.info(f"Cargando Negative Embedding: {request.negative_embedding}")
-            NegativeEmbedding.load_embedding(pipe, request.negative_embedding)
-            # Agregar token al negative prompt
-            if request.negative_embedding not in request.negative_prompt:
-                request.negative_prompt += f", {request.negative_embedding}"
-
-        # Generar imagen
-        with torch.no_grad():
-            if request.seed == 0:
-                request.seed = int(torch.randint(0, 1000000, (1,)).item())
-
-            result = pipe(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                num_inference_steps=request.steps,
-                guidance_scale=request.guidance_scale,
-                height=request.height,
-                width=request.width,
-                generator=torch.Generator(device=DEVICE).manual_seed(request.seed),
-            )
+@app.post("/api/registry/refresh")
+async def refresh_registry():
+    """Fuerza un refresco del índice en segundo plano"""
+    model_registry.request_refresh()
+    return {"success": True, "message": "Refresco del registro solicitado"}
 
-        image = result.images[0]
-
-        # Upscalear si se solicita
-        if request.upscale_factor in [2, 4]:
-            logger.info(f"Upscaleando imagen x{request.upscale_factor}")
-            upscaled_image = upscaler.upscale(image, request.upscale_factor)
-            if upscaled_image:
-                image = upscaled_image
-
-        # Descargar LoRA para liberar memoria
-        if request.lora_path:
-            LoRAManager.unload_lora(pipe)
-
-        # Guardar imagen
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"generated_{timestamp}_{uuid.uuid4().hex[:8]}.png"
-        image_path = GENERATIONS_DIR / filename
-        image.save(image_path)
-
-        # Guardar metadatos (prompts, parámetros) en JSON
-        metadata = {
-            "filename": filename,
-            "timestamp": timestamp,
-            "prompt": request.prompt,
-            "negative_prompt": request.negative_prompt,
-            "model": request.model,
-            "vae": request.vae,
-            "lora": request.lora_path,
-            "lora_scale": request.lora_scale,
-            "negative_embedding": request.negative_embedding,
-            "steps": request.steps,
-            "guidance_scale": request.guidance_scale,
-            "seed": request.seed,
-            "width": request.width,
-            "height": request.height,
-            "upscale_factor": request.upscale_factor,
-        }
-        
-        metadata_path = image_path.with_suffix(".json")
-        import json
-        with open(metadata_path, "w") as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
 
-        image_url = f"http://localhost:8000/api/image/{filename}"
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: el proceso responde, aunque los modelos sigan cargando"""
+    return {"status": "ok"}
 
-        logger.info(f"Imagen guardada en: {image_path}")
-        logger.info(f"Metadatos guardados en: {metadata_path}")
 
-        return {
-            "success": True,
-            "image_url": image_url,
-            "filename": filename,
-            "prompt": request.prompt,
-            "seed": request.seed,
-            "parameters": {
-                "steps": request.steps,
-                "guidance_scale": request.guidance_scale,
-                "model": request.model,
-                "vae": request.vae,
-                "width": request.width,
-                "height": request.height,
-                "lora": request.lora_path,
-                "lora_scale": request.lora_scale,
-                "upscale_factor": request.upscale_factor,
-                "negative_embedding": request.negative_embedding,
-            },
-        }
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness: progreso de la precarga y tiempos de calentamiento"""
+    state = startup_state.to_dict()
+    state["device"] = DEVICE
+    state["current_model"] = current_model_id
+    return JSONResponse(state, status_code=200 if startup_state.ready else 503)
+
+
+@app.get("/api/pipeline-cache")
+async def pipeline_cache_stats():
+    """Estadísticas de la caché de modelos cargados"""
+    return {
+        **pipeline_cache.stats(),
+        "vae_cache": vae_cache.stats(),
+        "prompt_cache": prompt_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "img2img_cache": source_cache.stats(),
+        "lora_cache": lora_cache.stats(),
+        "textual_inversion": textual_inversions.stats(),
+    }
+
+
+def progress_kwargs(progress: Optional[StepProgress], engine: str) -> dict:
+    """Argumentos de callback del pipeline según el motor"""
+    if progress is None:
+        return {}
+    if engine == "onnx":
+        return {"callback": progress.legacy, "callback_steps": 1}
+    return {"callback_on_step_end": progress}
+
+
+def result_variant(model_key: str) -> Optional[dict]:
+    """Variante con la que se generaría ahora un modelo (búsquedas en la caché de resultados)"""
+    return generation_variant(
+        get_model_engine(model_key),
+        get_model_precision(model_key),
+        known_model_hash(model_key),
+        inference_settings()["bf16"],
+    )
+
+
+def entry_variant(entry: PipelineEntry) -> Optional[dict]:
+    """Variante del modelo residente que genera las imágenes (claves de lo que se guarda)"""
+    if entry.model_hash is None and entry.model_fingerprint is not None:
+        # Cargado antes de que el registro calculara el hash: se adopta si el archivo no cambió
+        model_info = model_registry.find("models", entry.model_key)
+        if (
+            model_info is not None
+            and model_info.get("hash")
+            and (model_info.get("size"), model_info.get("mtime")) == entry.model_fingerprint
+        ):
+            entry.model_hash = model_info["hash"]
+    return generation_variant(entry.engine, entry.precision, entry.model_hash, inference_settings()["bf16"])
+
+
+def generate_batch_key(request: GenerateRequest) -> Optional[tuple]:
+    """
+    Parámetros que deben coincidir para generar varias peticiones en un solo
+    lote. None si la petición no puede agruparse (motor ONNX).
+    """
+    if get_model_engine(request.model) == "onnx":
+        return None
+    return batch_key_fields(request)
+
+
+def _finish_generation(
+    request: GenerateRequest,
+    image,
+    seed: int,
+    image_index: int,
+    entry: PipelineEntry,
+    batch_size: int,
+    loras: Sequence[Tuple[str, float]],
+    vae_key: str,
+    cache_key: Optional[str] = None,
+    store: Callable = store_image,
+) -> dict:
+    """
+    Upscalea si se pide y guarda una imagen con sus metadatos JSON. `loras`
+    y `vae_key` son los que se aplicaron de verdad (un LoRA que no pudo
+    cargarse no figura; con ONNX el VAE es siempre el del modelo).
+    """
+    # Upscalear si se solicita
+    if request.upscale_factor in [2, 4]:
+        logger.info(f"Upscaleando imagen x{request.upscale_factor}")
+        upscaled_image = upscaler.upscale(image, request.upscale_factor)
+        if upscaled_image:
+            image = upscaled_image
+
+    # Metadatos (prompts, parámetros) para el JSON.
+    # `seed` es la de esta imagen: una petición de una sola imagen con esa seed la reproduce.
+    metadata = {
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "model": request.model,
+        "vae": vae_key,
+        "sampler": request_sampler(request),
+        "lora": request.lora_path if (request.lora_path, request.lora_scale) in loras else None,
+        "lora_scale": request.lora_scale,
+        "loras": [list(lora) for lora in loras],
+        "negative_embedding": request.negative_embedding,
+        "steps": request.steps,
+        "guidance_scale": request.guidance_scale,
+        "seed": seed,
+        "base_seed": request.seed,
+        "image_index": image_index,
+        "num_images": request.num_images,
+        "width": request.width,
+        "height": request.height,
+        "upscale_factor": request.upscale_factor,
+        "device": DEVICE,
+        "engine": entry.engine,
+        "precision": entry.precision,
+        "cpu_profile": cpu_profile.to_dict() if cpu_profile is not None else None,
+        "batch_size": batch_size,
+        # Hash de los parámetros, la seed de esta imagen y la variante del modelo:
+        # índice de la caché de resultados
+        "cache_key": cache_key,
+    }
+    return store(image, "generated", seed, metadata)
+
+
+ProgressListener = Callable[[dict, Optional[List[str]]], None]
+
+
+def run_generate_batch(
+    requests: List[GenerateRequest],
+    listeners: Optional[List[ProgressListener]] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+    store: Callable = store_image,
+) -> List[dict]:
+    """
+    Genera las imágenes de una o varias peticiones usando Stable Diffusion con opciones avanzadas.
+    Soporta: LoRA, Upscaler, Negative Embeddings, varias imágenes por petición
+    Las peticiones deben ser compatibles (misma generate_batch_key): todas sus
+    imágenes se generan en una sola pasada de denoising, cada una con su prompt,
+    negative prompt y seed (seed de la petición + índice de la imagen).
+    Se ejecuta en un hilo de inferencia de la cola de trabajos.
+    Si se indican listeners (uno por petición), reciben el progreso de cada
+    step y las vistas previas de sus imágenes. Si should_cancel devuelve True,
+    la generación se corta en el siguiente step. `store` guarda cada imagen
+    (por defecto en disco; los workers de inferencia la dejan en memoria compartida).
+    """
+    first = requests[0]
+    entry = None
+    try:
+        # Reservado hasta el final: un cambio de modelo no lo libera a mitad de trabajo
+        entry = load_model(first.model, first.vae, acquire=True)
+
+        for request in requests:
+            print(f"[INFO] Generando {request.num_images} imagen(es) - Prompt: {request.prompt}")
+        print(f"[INFO] Parámetros: steps={first.steps}, guidance={first.guidance_scale}, model={first.model}, vae={first.vae}, batch={len(requests)}")
+
+        # El pipeline no admite uso concurrente: un lote por modelo a la vez
+        with entry.lock:
+            vae_key = apply_vae(entry, first.vae)
+
+            # Activar los LoRAs pedidos (o ninguno) entre los residentes del modelo.
+            # Metadatos y claves de caché usan los que quedaron activos, no los pedidos
+            loras = lora_cache.activate(entry, request_loras(first))
+
+            # Seeds y claves de la caché de resultados (una por imagen, con la
+            # variante del modelo residente), antes de tocar el negative prompt
+            variant = entry_variant(entry)
+            cache_keys = {}
+            for request in requests:
+                if request.seed == 0:
+                    request.seed = int(torch.randint(0, 1000000, (1,)).item())
+                for index in range(request.num_images):
+                    cache_keys[id(request), index] = image_cache_key(request, request.seed + index, variant, loras, vae_key)
+
+            # Negative Embedding: se carga una vez por modelo y se usa por su token
+            if first.negative_embedding:
+                token = textual_inversions.ensure(entry, first.negative_embedding)
+                if token is not None:
+                    for request in requests:
+                        if token not in request.negative_prompt:
+                            request.negative_prompt += f", {token}"
+
+            # Una entrada por imagen: (petición, índice, seed)
+            items = []
+            for request in requests:
+                items.extend((request, index, request.seed + index) for index in range(request.num_images))
+
+            def dispatch_progress(event: dict, previews: Optional[List[str]]):
+                """Reparte el progreso y las vistas previas de cada imagen a su petición"""
+                for request, listener in zip(requests, listeners):
+                    own = None
+                    if previews:
+                        own = [
+                            preview for preview, (item_request, _, _) in zip(previews, items)
+                            if item_request is request
+                        ]
+                    listener(event, own)
+
+            on_progress = dispatch_progress if listeners else None
+
+            progress = None
+            if on_progress or should_cancel:
+                progress = StepProgress(
+                    first.steps * (len(items) if entry.engine == "onnx" else 1),
+                    on_progress,
+                    should_cancel=should_cancel,
+                )
+
+            # Scheduler del sampler pedido, derivado una vez por modelo
+            sampler = request_sampler(first)
+            entry.pipe.scheduler = scheduler_for(entry, sampler)
+
+            # Generar imágenes
+            start = time.perf_counter()
+            call_kwargs = dict(
+                num_inference_steps=first.steps,
+                guidance_scale=first.guidance_scale,
+                height=first.height,
+                width=first.width,
+            )
+            with torch.no_grad(), inference_autocast():
+                if entry.engine == "onnx":
+                    # El pipeline ONNX solo acepta un generador: una llamada por imagen
+                    images = [
+                        entry.pipe(
+                            prompt=request.prompt,
+                            negative_prompt=request.negative_prompt,
+                            generator=make_generator(seed, entry.engine),
+                            **call_kwargs,
+                            **progress_kwargs(progress, entry.engine),
+                        ).images[0]
+                        for request, _, seed in items
+                    ]
+                else:
+                    # Un generador por imagen: cada latente inicial sale de su propia
+                    # seed, igual que en una petición de una sola imagen
+                    generators = [make_generator(seed, entry.engine) for _, _, seed in items]
+                    images = entry.pipe(
+                        **prompt_kwargs(
+                            entry,
+                            entry.pipe,
+                            [request.prompt for request, _, _ in items],
+                            [request.negative_prompt for request, _, _ in items],
+                            loras,
+                        ),
+                        generator=generators if len(generators) > 1 else generators[0],
+                        **call_kwargs,
+                        **progress_kwargs(progress, entry.engine),
+                    ).images
+            sampler_timings.record(sampler, first.steps, len(items), time.perf_counter() - start)
+
+        saved = {id(request): [] for request in requests}
+        for (request, index, seed), image in zip(items, images):
+            saved[id(request)].append(_finish_generation(
+                request, image, seed, index, entry, len(items), loras, vae_key, cache_keys[id(request), index], store
+            ))
+        return [generation_response(request, saved[id(request)], loras=loras, vae=vae_key) for request in requests]
+    except GenerationCancelled as e:
+        logger.info(f"Generación cancelada: {e}")
+        return [{"success": False, "error": "Generación cancelada", "cancelled": True} for _ in requests]
     except Exception as e:
         logger.error(f"Error generando imagen: {e}")
         import traceback
         traceback.print_exc()
-        return {"success": False, "error": str(e)}
+        return [{"success": False, "error": str(e)} for _ in requests]
+    finally:
+        if entry is not None:
+            pipeline_cache.release(entry)
+
+
+def run_generate(
+    request: GenerateRequest,
+    listener: Optional[ProgressListener] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+    store: Callable = store_image,
+) -> dict:
+    """Genera las imágenes de una sola petición"""
+    return run_generate_batch([request], [listener] if listener else None, should_cancel, store)[0]
 
 
 @app.get("/api/last-metadata")
 async def get_last_metadata():
     """Obtiene los metadatos de la última imagen generada"""
     try:
-        # Buscar el archivo JSON más reciente
-        json_files = list(GENERATIONS_DIR.glob("generated_*.json"))
-        if not json_files:
+        metadata = await asyncio.to_thread(gallery_index.latest_metadata)
+        if metadata is None:
             return {"success": False, "error": "No hay imágenes generadas"}
-        
-        latest_json = max(json_files, key=lambda p: p.stat().st_mtime)
-        
-        import json
-        with open(latest_json, "r", encoding="utf-8") as f:
-            metadata = json.load(f)
-        
         return {"success": True, "metadata": metadata}
     except Exception as e:
         logger.error(f"Error obteniendo metadatos: {e}")
@@ -508,40 +977,39 @@ async def get_last_metadata():
 
 
 @app.get("/api/gallery")
-async def get_gallery():
-    """Retorna lista de todas las imágenes generadas con sus metadatos"""
+async def get_gallery(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    order: str = "newest",
+    q: Optional[str] = None,
+    model: Optional[str] = None,
+    lora: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+):
+    """
+    Imágenes generadas con sus metadatos, desde el índice de la galería.
+    Paginada: `next_cursor` se pasa como `cursor` para la página siguiente.
+    Filtros: q (búsqueda en prompts), model, lora, date_from/date_to
+    (ISO o epoch), width, height; order "newest" u "oldest".
+    """
     try:
-        images = []
-        
-        # Buscar todas las imágenes PNG
-        png_files = sorted(GENERATIONS_DIR.glob("generated_*.png"), reverse=True)
-        
-        for png_file in png_files:
-            json_file = png_file.with_suffix(".json")
-            
-            image_info = {
-                "filename": png_file.name,
-                "url": f"http://localhost:8000/api/image/{png_file.name}",
-                "timestamp": png_file.stat().st_mtime,
-            }
-            
-            # Cargar metadatos si existen
-            if json_file.exists():
-                import json
-                try:
-                    with open(json_file, "r", encoding="utf-8") as f:
-                        metadata = json.load(f)
-                    image_info["metadata"] = metadata
-                except:
-                    pass
-            
-            images.append(image_info)
-        
-        return {
-            "success": True,
-            "total": len(images),
-            "images": images
-        }
+        page = await asyncio.to_thread(
+            gallery_index.page,
+            limit=limit,
+            cursor=cursor,
+            order=order,
+            q=q,
+            model=model,
+            lora=lora,
+            date_from=date_from,
+            date_to=date_to,
+            width=width,
+            height=height,
+        )
+        return {"success": True, **page}
     except Exception as e:
         logger.error(f"Error en galería: {e}")
         return {"success": False, "error": str(e), "images": []}
@@ -556,12 +1024,32 @@ async def list_models():
                 "id": key,
                 "name": info["name"],
                 "description": info["description"],
+                "engine": get_model_engine(key),
+                "precision": get_model_precision(key),
             }
             for key, info in get_available_models().items()
         ]
     }
 
 
+@app.post("/api/models/{model_key}/options")
+async def update_model_options(model_key: str, request: ModelOptionsRequest):
+    """Cambia las opciones de un modelo en el registro (p. ej. el motor de inferencia)"""
+    return set_model_options(model_key, request.engine, request.precision)
+
+
+@app.get("/api/models/quantization")
+async def list_quantization_reports():
+    """Memoria ahorrada por la cuantización int8 de cada modelo cargado"""
+    return {"quantization": quantization_reports}
+
+
+@app.get("/api/models/load-times")
+async def list_model_load_times():
+    """Tiempos de carga por modelo (cold = conversión, warm = desde caché)"""
+    return {"load_times": load_timings.to_dict()}
+
+
 @app.get("/api/vaes")
 async def list_vaes():
     """Retorna lista de VAEs disponibles"""
@@ -650,33 +1138,53 @@ async def list_upscalers():
 
 
 @app.post("/api/load-model")
-async def load_model_endpoint(request: ModelChangeRequest):
-    """Carga un modelo diferente"""
-    try:
-        load_model(request.model, request.vae)
-        return {
-            "success": True,
-            "message": f"Modelo {AVAILABLE_MODELS[request.model]['name']} cargado",
-            "current_model": current_model_id,
-        }
-    except Exception as e:
-        print(f"[ERROR] Error cargando modelo: {e}")
-        return {"success": False, "error": str(e)}
+async def load_model_endpoint(request: ModelChangeRequest, wait: bool = False):
+    """
+    Cambia a un modelo diferente sin cortar el servicio: el nuevo se carga en
+    segundo plano mientras el actual sigue generando. Por defecto responde
+    al instante (202) y el progreso se consulta en /health; con wait=true
+    espera a que el cambio termine.
+    """
+    if request.model not in get_available_models():
+        return {"success": False, "error": f"Modelo no disponible: {request.model}"}
+    if request.vae not in get_available_vaes():
+        return {"success": False, "error": f"VAE no disponible: {request.vae}"}
+
+    if not wait:
+        threading.Thread(
+            target=switch_model,
+            args=(request.model, request.vae),
+            name="model-switch",
+            daemon=True,
+        ).start()
+        return JSONResponse(
+            {"success": True, "message": "Cambio de modelo iniciado", "model_switch": model_switch.to_dict()},
+            status_code=202,
+        )
+
+    # La carga se hace fuera del event loop para no congelar el resto de endpoints
+    await asyncio.to_thread(switch_model, request.model, request.vae)
+    if model_switch.status == "failed":
+        print(f"[ERROR] Error cargando modelo: {model_switch.error}")
+        return {"success": False, "error": model_switch.error}
+    return {
+        "success": True,
+        "message": f"Modelo {get_available_models()[request.model]['name']} cargado",
+        "current_model": current_model_id,
+    }
 
 
 @app.get("/api/samplers")
-async def list_samplers():
-    """Retorna lista de samplers disponibles"""
+async def list_samplers(steps: int = 20):
+    """
+    Samplers disponibles (campo `sampler` de las peticiones), tiempos medidos
+    por step e imagen y los recomendados para `steps`, del más rápido al más lento
+    """
     return {
-        "samplers": [
-            "DPM++ 2M",
-            "DPM++ 2M Karras",
-            "Euler",
-            "Euler A",
-            "Heun",
-            "LMS",
-            "LMS Karras",
-        ]
+        "samplers": list(SAMPLERS),
+        "default": DEFAULT_SAMPLER,
+        "timings": sampler_timings.to_dict(),
+        "recommended": sampler_timings.recommend(steps),
     }
 
 
@@ -727,69 +1235,184 @@ async def list_negative_embeddings():
     }
 
 
-@app.post("/api/image2image")
-async def image_to_image(request: Image2ImageRequest, image_file: UploadFile = File(...)):
+def run_image2image(
+    request: Image2ImageRequest,
+    image_data: Optional[bytes],
+    listener: Optional[ProgressListener] = None,
+    should_cancel: Optional[Callable[[], bool]] = None,
+    store: Callable = store_image,
+) -> dict:
     """
     Transforma una imagen existente manteniendo su estructura
     Soporta: cambio de estilo, Image2Image
+    Se ejecuta en un hilo de inferencia de la cola de trabajos.
+    Sin `image_data` se usa la imagen subida antes con hash `request.image_hash`.
     """
-    if img2img_pipe is None:
-        return {"success": False, "error": "Modelo no cargado."}
-
+    entry = None
     try:
-        # Leer imagen
-        image_data = await image_file.read()
-        image = Image.open(io.BytesIO(image_data)).convert("RGB")
+        image_hash = upload_hash(image_data) if image_data is not None else request.image_hash
 
-        logger.info(f"[Image2Image] Procesando imagen: {image.size}")
+        def prepare() -> Image.Image:
+            data = image_data if image_data is not None else load_upload(image_hash)
+            if data is None:
+                raise ValueError(f"Imagen de origen no encontrada: {image_hash}")
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+            logger.info(f"[Image2Image] Procesando imagen: {image.size}")
+            return Image2ImageProcessor.prepare_image(image, *IMG2IMG_SIZE)
 
-        # Cambiar modelo si es necesario
-        if request.model != current_model_id:
-            load_model(request.model, request.vae)
+        # Imagen preparada desde la caché si ya se usó este origen
+        image = source_cache.prepared_image(image_hash, *IMG2IMG_SIZE, prepare)
 
-        # Preparar imagen
-        image = Image2ImageProcessor.prepare_image(image, 512, 512)
+        entry = load_model(request.model, request.vae, acquire=True)
 
         # Generar
-        with torch.no_grad():
-            if request.seed == 0:
-                request.seed = int(torch.randint(0, 1000000, (1,)).item())
-
-            result = img2img_pipe(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                image=image,
-                strength=request.strength,
-                num_inference_steps=request.steps,
-                guidance_scale=request.guidance_scale,
-                generator=torch.Generator(device=DEVICE).manual_seed(request.seed),
-            )
-
-        output_image = result.images[0]
+        with entry.lock:
+            vae_key = apply_vae(entry, request.vae)
+            # img2img comparte UNet y text encoder con txt2img: mismos adaptadores LoRA
+            loras = lora_cache.activate(entry, request_loras(request))
+            with torch.no_grad(), inference_autocast():
+                if request.seed == 0:
+                    request.seed = int(torch.randint(0, 1000000, (1,)).item())
+                generator = make_generator(request.seed, entry.engine)
+
+                if entry.engine != "onnx" and source_cache.enabled:
+                    # Latentes del VAE desde la caché; el pipeline los acepta en lugar de la imagen
+                    init_image = source_cache.latents(
+                        entry.img2img_pipe,
+                        entry.model_key,
+                        entry.precision,
+                        entry.vae_key,
+                        image_hash,
+                        image,
+                        generator,
+                    )
+                else:
+                    init_image = image
+
+                sampler = request_sampler(request)
+                entry.img2img_pipe.scheduler = scheduler_for(entry, sampler)
+                start = time.perf_counter()
+
+                # img2img solo recorre la fracción `strength` de los steps
+                progress = None
+                if listener or should_cancel:
+                    progress = StepProgress(
+                        min(request.steps, int(request.steps * request.strength)),
+                        listener,
+                        should_cancel=should_cancel,
+                    )
+
+                result = entry.img2img_pipe(
+                    **prompt_kwargs(
+                        entry,
+                        entry.img2img_pipe,
+                        [request.prompt],
+                        [request.negative_prompt],
+                        loras,
+                    ),
+                    image=init_image,
+                    strength=request.strength,
+                    num_inference_steps=request.steps,
+                    guidance_scale=request.guidance_scale,
+                    generator=generator,
+                    **progress_kwargs(progress, entry.engine),
+                )
+                # img2img solo recorre la fracción `strength` de los steps
+                sampler_timings.record(
+                    sampler, min(request.steps, int(request.steps * request.strength)), 1, time.perf_counter() - start
+                )
 
         # Guardar
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"img2img_{timestamp}_{uuid.uuid4().hex[:8]}.png"
-        image_path = GENERATIONS_DIR / filename
-        output_image.save(image_path)
+        stored = store(result.images[0], "img2img", request.seed)
 
         return {
             "success": True,
-            "image_url": f"http://localhost:8000/api/image/{filename}",
-            "filename": filename,
+            "image_url": stored.get("image_url"),
+            "filename": stored.get("filename"),
+            "images": [stored],
+            "image_hash": image_hash,
             "prompt": request.prompt,
             "seed": request.seed,
             "parameters": {
                 "steps": request.steps,
                 "guidance_scale": request.guidance_scale,
                 "strength": request.strength,
+                "sampler": sampler,
                 "model": request.model,
-                "vae": request.vae,
+                "vae": vae_key,
             },
         }
+    except GenerationCancelled as e:
+        logger.info(f"[Image2Image] Cancelada: {e}")
+        return {"success": False, "error": "Generación cancelada", "cancelled": True}
     except Exception as e:
         logger.error(f"[Image2Image] Error: {e}")
         return {"success": False, "error": str(e)}
+    finally:
+        if entry is not None:
+            pipeline_cache.release(entry)
+
+
+# ==================== JOB QUEUE ====================
+
+def run_job(job: Job) -> dict:
+    """Ejecuta un trabajo de la cola según su tipo"""
+    if job.kind == "generate":
+        return run_generate(job.payload, job.publish_progress, lambda: job.cancel_requested)
+    if job.kind == "image2image":
+        request, image_data = job.payload
+        return run_image2image(request, image_data, job.publish_progress, lambda: job.cancel_requested)
+    raise ValueError(f"Tipo de trabajo desconocido: {job.kind}")
+
+
+def run_job_batch(jobs: List[Job]) -> List[dict]:
+    """
+    Ejecuta un lote de trabajos txt2img compatibles en una sola llamada al pipeline.
+    El lote solo se corta cuando todos sus trabajos están cancelados.
+    """
+    return run_generate_batch(
+        [job.payload for job in jobs],
+        [job.publish_progress for job in jobs],
+        lambda: all(job.cancel_requested for job in jobs),
+    )
+
+
+def job_batch_key(job: Job) -> Optional[tuple]:
+    """
+    Solo se agrupan trabajos txt2img de una imagen con los mismos parámetros
+    de lote; una petición con num_images > 1 ya es un lote por sí misma.
+    """
+    if job.kind != "generate" or job.payload.num_images > 1:
+        return None
+    return generate_batch_key(job.payload)
+
+
+def job_affinity(job: Job) -> int:
+    """
+    Coste de ejecutar un trabajo con lo que ya está cargado: 0 si hay que
+    cargar su modelo; si está en la caché, 1 más un punto por tener ya su
+    VAE y otro por tener sus LoRAs fusionados o residentes.
+    """
+    request = job.payload if job.kind == "generate" else job.payload[0]
+    entry = pipeline_cache.peek(request.model)
+    if entry is None:
+        return 0
+    score = 1
+    if entry.vae_key == request.vae:
+        score += 1
+    if lora_cache.is_resident(entry, request_loras(request)):
+        score += 1
+    return score
+
+
+job_queue = JobQueue(
+    runner=run_job,
+    batch_runner=run_job_batch,
+    batch_key=job_batch_key,
+    affinity=job_affinity,
+)
+
+app.include_router(create_jobs_router(job_queue, variant_for=result_variant))
 
 
 # ==================== CIVITAI INTEGRATION ====================
@@ -860,6 +1483,8 @@ async def download_from_civitai(request: DownloadRequest):
         )
         
         if filepath:
+            # El nuevo archivo aparece en los listados sin reiniciar
+            model_registry.request_refresh()
             return {
                 "success": True,
                 "message": f"Descargado a: {filepath}",
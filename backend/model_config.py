@@ -0,0 +1,163 @@
+"""
+Configuración compartida de modelos
+Carpetas de assets, registro persistente de modelos y opciones por modelo
+(motor y precisión), sin dependencias de torch: lo importan tanto el
+gateway como backend.main y los procesos de inferencia.
+
+El registro solo lo refresca y escribe un proceso (el gateway, o backend.main
+cuando se sirve solo); los procesos de inferencia arrancan con
+MODEL_REGISTRY_READ_ONLY=1 y recargan el índice de disco cuando cambia.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional
+
+from backend.checkpoint_loader import file_content_hash
+from backend.model_registry import ModelRegistry, folder_content_hash
+
+# Rutas base para modelos
+BASE_DIR = Path(__file__).parent.parent
+MODELS_DIR = BASE_DIR / "models"
+VAES_DIR = BASE_DIR / "vaes"
+LORAS_DIR = BASE_DIR / "loras"
+EMBEDDINGS_DIR = BASE_DIR / "embeddings"
+CONTROLNETS_DIR = BASE_DIR / "controlnets"
+UPSCALERS_DIR = BASE_DIR / "upscalers"
+
+# Crear directorios si no existen
+for directory in [MODELS_DIR, VAES_DIR, LORAS_DIR, EMBEDDINGS_DIR, CONTROLNETS_DIR, UPSCALERS_DIR]:
+    directory.mkdir(parents=True, exist_ok=True)
+
+# Motores de inferencia y precisiones de CPU por modelo
+ENGINES = ("torch", "onnx")
+DEFAULT_ENGINE = os.getenv("INFERENCE_ENGINE", "torch")
+PRECISIONS = ("fp32", "int8")
+DEFAULT_PRECISION = os.getenv("CPU_PRECISION", "fp32")
+
+# Registro persistente de assets locales (fuente única de verdad)
+model_registry = ModelRegistry(
+    {
+        "models": (MODELS_DIR, (".pt", ".safetensors", ".ckpt")),
+        "vaes": (VAES_DIR, (".pt", ".safetensors", ".ckpt")),
+        "loras": (LORAS_DIR, (".pt", ".safetensors", ".ckpt")),
+        "embeddings": (EMBEDDINGS_DIR, (".pt", ".safetensors", ".bin")),
+        "controlnets": (CONTROLNETS_DIR, (".pt", ".safetensors", ".ckpt")),
+        "upscalers": (UPSCALERS_DIR, (".pth", ".pt", ".safetensors")),
+    },
+    index_path=Path(os.getenv("MODEL_REGISTRY_PATH", str(BASE_DIR / "cache" / "registry.json"))),
+    read_only=os.getenv("MODEL_REGISTRY_READ_ONLY") == "1",
+)
+
+
+def ensure_registry_loaded():
+    """Si ya hay índice en disco se usa tal cual; si no, un recorrido rápido sin hashes"""
+    if not model_registry.load():
+        model_registry.refresh(compute_hashes=False)
+
+
+def get_available_models() -> dict:
+    """Obtiene modelos disponibles: locales + Hugging Face"""
+    local_models = model_registry.get("models")
+
+    # Modelos por defecto de Hugging Face (si no hay locales)
+    default_models = {
+        # Modelos rápidos
+        "stable-diffusion-v1-5": {
+            "name": "Stable Diffusion v1.5",
+            "model_id": "runwayml/stable-diffusion-v1-5",
+            "type": "huggingface",
+            "description": "⚡ Rápido, equilibrado (512x512)",
+        },
+        # Modelos de mejor calidad
+        "stable-diffusion-v2-1": {
+            "name": "Stable Diffusion v2.1",
+            "model_id": "stabilityai/stable-diffusion-2-1",
+            "type": "huggingface",
+            "description": "🎨 Mejor calidad pero más lento",
+        },
+        # Modelos XL
+        "stable-diffusion-xl": {
+            "name": "Stable Diffusion XL Base 1.0",
+            "model_id": "stabilityai/stable-diffusion-xl-base-1.0",
+            "type": "huggingface",
+            "description": "🔥 Excelente calidad (1024x1024)",
+        },
+        "sdxl-turbo": {
+            "name": "SDXL Turbo",
+            "model_id": "stabilityai/sdxl-turbo",
+            "type": "huggingface",
+            "description": "⚡ SDXL rápido (4 steps)",
+        },
+        # Modelos alternativos
+        "animagine": {
+            "name": "Animagine XL 2.0",
+            "model_id": "Linaqruf/animagine-xl-2.0",
+            "type": "huggingface",
+            "description": "🎌 Anime de alta calidad",
+        },
+    }
+
+    # Combinar: locales tienen prioridad
+    return {**default_models, **local_models}
+
+
+def set_model_options(model_key: str, engine: Optional[str], precision: Optional[str]) -> dict:
+    """
+    Valida y guarda las opciones de un modelo en el registro. Los procesos de
+    inferencia las ven al recargar el índice y recargan el modelo en la
+    siguiente petición que lo use.
+    """
+    if model_key not in get_available_models():
+        return {"success": False, "error": f"Modelo no disponible: {model_key}"}
+    if engine is not None and engine not in ENGINES:
+        return {"success": False, "error": f"Motor no soportado: {engine}"}
+    if precision is not None and precision not in PRECISIONS:
+        return {"success": False, "error": f"Precisión no soportada: {precision}"}
+
+    options = model_registry.set_options("models", model_key, engine=engine, precision=precision)
+    return {"success": True, "model": model_key, "options": options}
+
+
+def get_model_engine(model_key: str, device: str) -> str:
+    """Motor de inferencia de un modelo: opción del registro o INFERENCE_ENGINE"""
+    engine = model_registry.get_options("models", model_key).get("engine", DEFAULT_ENGINE)
+    if engine == "onnx" and device != "cpu":
+        # ONNX Runtime solo se usa en hosts de CPU
+        return "torch"
+    return engine
+
+
+def get_model_precision(model_key: str, device: str) -> str:
+    """Precisión de un modelo en CPU: opción del registro o CPU_PRECISION"""
+    if device != "cpu":
+        return "fp16"
+    if get_model_engine(model_key, device) == "onnx":
+        # Los grafos ONNX se exportan siempre en float32
+        return "fp32"
+    return model_registry.get_options("models", model_key).get("precision", DEFAULT_PRECISION)
+
+
+def known_model_hash(model_key: str) -> Optional[str]:
+    """
+    Hash de un modelo sin leer sus pesos: el del registro (None si aún no se
+    ha calculado) o un id estable para Hugging Face
+    """
+    entry = model_registry.find("models", model_key)
+    if entry is not None:
+        return entry.get("hash")
+    model_info = get_available_models().get(model_key)
+    if model_info is None:
+        return None
+    return "hf-" + hashlib.sha256(model_info["model_id"].encode()).hexdigest()[:16]
+
+
+def get_model_hash(model_key: str) -> str:
+    """Hash de contenido de un modelo local (del registro o calculándolo) o id estable para Hugging Face"""
+    model_hash = known_model_hash(model_key)
+    if model_hash is not None:
+        return model_hash
+    path = Path(model_registry.find("models", model_key)["path"])
+    return folder_content_hash(path) if path.is_dir() else file_content_hash(path)
+
@@ -0,0 +1,390 @@
+"""
+Registro persistente de modelos locales
+Mantiene en disco un índice de modelos, VAEs, LoRAs, embeddings, ControlNets
+y upscalers con ruta, tamaño, mtime, hash, formato y arquitectura detectada.
+El índice se refresca de forma incremental por mtime en segundo plano, así
+que los endpoints de listado no recorren el disco en cada petición.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+import logging
+
+from backend.checkpoint_loader import file_content_hash
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+
+# Tamaño máximo de cabecera safetensors que aceptamos leer (100 MB)
+MAX_SAFETENSORS_HEADER = 100 * 1024 * 1024
+
+WEIGHT_FORMATS = {
+    ".safetensors": "safetensors",
+    ".ckpt": "ckpt",
+    ".pt": "pt",
+    ".pth": "pth",
+    ".bin": "bin",
+}
+
+
+def read_safetensors_keys(path: Path) -> list:
+    """Lee solo la cabecera JSON de un .safetensors y devuelve sus claves"""
+    with open(path, "rb") as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        if header_size > MAX_SAFETENSORS_HEADER:
+            return []
+        header = json.loads(f.read(header_size))
+    return [key for key in header.keys() if key != "__metadata__"]
+
+
+def detect_file_architecture(path: Path) -> str:
+    """Detecta la arquitectura de un archivo de pesos a partir de sus claves"""
+    if path.suffix != ".safetensors":
+        return "unknown"
+    try:
+        keys = read_safetensors_keys(path)
+    except Exception as e:
+        logger.warning(f"No se pudo leer la cabecera de {path}: {e}")
+        return "unknown"
+
+    def has(fragment: str) -> bool:
+        return any(fragment in key for key in keys)
+
+    if has("lora_up") or has("lora_down") or has("lora_A") or has(".lora."):
+        return "sdxl-lora" if has("lora_te2_") or has("text_encoder_2") else "sd1-lora"
+    if has("conditioner.embedders.1"):
+        return "sdxl"
+    if has("cond_stage_model.model.transformer"):
+        return "sd2"
+    if has("cond_stage_model.transformer") or has("model.diffusion_model"):
+        return "sd1"
+    if has("control_model") or has("controlnet_cond_embedding"):
+        return "controlnet"
+    if has("emb_params") or has("string_to_param"):
+        return "textual-inversion"
+    if has("clip_g") and has("clip_l"):
+        return "sdxl-textual-inversion"
+    if has("encoder.down") and has("decoder.up"):
+        return "vae"
+    return "unknown"
+
+
+def detect_folder_architecture(folder: Path) -> str:
+    """Detecta la arquitectura de una carpeta en formato diffusers"""
+    try:
+        model_index = folder / "model_index.json"
+        if model_index.exists():
+            class_name = json.loads(model_index.read_text()).get("_class_name", "")
+            if "XL" in class_name:
+                return "sdxl"
+            unet_config = folder / "unet" / "config.json"
+            if unet_config.exists():
+                cross_dim = json.loads(unet_config.read_text()).get("cross_attention_dim")
+                return "sd2" if cross_dim == 1024 else "sd1"
+            return "unknown"
+
+        config = folder / "config.json"
+        if config.exists():
+            class_name = json.loads(config.read_text()).get("_class_name", "")
+            if class_name == "AutoencoderKL":
+                return "vae"
+            if class_name == "ControlNetModel":
+                return "controlnet"
+    except Exception as e:
+        logger.warning(f"No se pudo detectar la arquitectura de {folder}: {e}")
+    return "unknown"
+
+
+def folder_fingerprint(folder: Path) -> Tuple[int, int]:
+    """Tamaño total y mtime más reciente de todos los archivos de una carpeta"""
+    size = 0
+    mtime = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            stat = (Path(root) / name).stat()
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime_ns)
+    return size, mtime
+
+
+def folder_content_hash(folder: Path) -> str:
+    """Hash de una carpeta combinando el hash de contenido de cada archivo"""
+    digest = hashlib.sha256()
+    for file in sorted(p for p in folder.rglob("*") if p.is_file()):
+        digest.update(str(file.relative_to(folder)).encode())
+        digest.update(file_content_hash(file).encode())
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Índice en disco de los assets locales, agrupados por tipo.
+
+    Args:
+        kinds: {tipo: (carpeta, extensiones)}, p. ej. {"loras": (LORAS_DIR, (".safetensors",))}
+        index_path: Archivo JSON donde se persiste el índice
+        read_only: No escribe nunca el índice (procesos que solo lo recargan)
+    """
+
+    def __init__(self, kinds: Dict[str, Tuple[Path, tuple]], index_path: Path, read_only: bool = False):
+        self.kinds = kinds
+        self.index_path = Path(index_path)
+        self.read_only = read_only
+        self._entries: Dict[str, dict] = {kind: {} for kind in kinds}
+        # Opciones por entrada (motor, precisión...), se conservan entre refrescos
+        self._options: Dict[str, dict] = {kind: {} for kind in kinds}
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._wakeup = threading.Event()
+        self.last_refresh: Optional[float] = None
+        self.last_refresh_seconds: Optional[float] = None
+        # mtime del índice leído por última vez (para recargarlo si otro proceso lo cambia)
+        self._loaded_mtime: Optional[int] = None
+
+    # ---------- Lectura ----------
+
+    def get(self, kind: str) -> dict:
+        """Copia de las entradas de un tipo, con el mismo formato que antes tenía scan_local_models"""
+        with self._lock:
+            return dict(self._entries.get(kind, {}))
+
+    def find(self, kind: str, key: str) -> Optional[dict]:
+        with self._lock:
+            return self._entries.get(kind, {}).get(key)
+
+    def get_options(self, kind: str, key: str) -> dict:
+        with self._lock:
+            return dict(self._options.get(kind, {}).get(key, {}))
+
+    def set_options(self, kind: str, key: str, **options) -> dict:
+        """Actualiza las opciones de una entrada (None elimina la opción) y persiste el índice"""
+        with self._lock:
+            current = self._options.setdefault(kind, {}).setdefault(key, {})
+            for name, value in options.items():
+                if value is None:
+                    current.pop(name, None)
+                else:
+                    current[name] = value
+            result = dict(current)
+        self.save()
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "index_path": str(self.index_path),
+                "counts": {kind: len(entries) for kind, entries in self._entries.items()},
+                "pending_hashes": sum(
+                    1 for entries in self._entries.values()
+                    for entry in entries.values() if not entry.get("hash")
+                ),
+                "last_refresh": self.last_refresh,
+                "last_refresh_seconds": self.last_refresh_seconds,
+            }
+
+    # ---------- Persistencia ----------
+
+    def load(self) -> bool:
+        """Carga el índice desde disco. Devuelve False si no existe o es inválido"""
+        if not self.index_path.exists():
+            return False
+        try:
+            mtime = self.index_path.stat().st_mtime_ns
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != INDEX_VERSION:
+                return False
+            with self._lock:
+                for kind in self.kinds:
+                    self._entries[kind] = data.get("entries", {}).get(kind, {})
+                    self._options[kind] = data.get("options", {}).get(kind, {})
+                self.last_refresh = data.get("last_refresh")
+                self._loaded_mtime = mtime
+            return True
+        except Exception as e:
+            logger.warning(f"Índice de modelos inválido, se reconstruirá: {e}")
+            return False
+
+    def save(self):
+        """Escribe el índice de forma atómica (nada en modo solo lectura)"""
+        if self.read_only:
+            return
+        with self._lock:
+            data = {
+                "version": INDEX_VERSION,
+                "last_refresh": self.last_refresh,
+                "entries": self._entries,
+                "options": self._options,
+            }
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            # Temporal único: otro hilo o proceso puede estar guardando a la vez
+            with tempfile.NamedTemporaryFile(
+                "w",
+                encoding="utf-8",
+                dir=self.index_path.parent,
+                prefix=f"{self.index_path.name}.",
+                suffix=".tmp",
+                delete=False,
+            ) as f:
+                json.dump(data, f, indent=2, ensure_ascii=False)
+            os.replace(f.name, self.index_path)
+            self._loaded_mtime = self.index_path.stat().st_mtime_ns
+
+    # ---------- Refresco incremental ----------
+
+    def _scan_kind(self, kind: str) -> Dict[str, dict]:
+        """Recorre una carpeta reutilizando las entradas cuyo tamaño y mtime no cambiaron"""
+        folder, extensions = self.kinds[kind]
+        previous = self.get(kind)
+        entries = {}
+        if not folder.exists():
+            return entries
+
+        for item in folder.iterdir():
+            if item.name.startswith("."):
+                continue
+            if item.is_dir() and item.suffix in (".onnx", ".tmp"):
+                # Exportaciones ONNX y carpetas temporales de versiones anteriores: no son modelos
+                continue
+            try:
+                if item.is_dir():
+                    is_model = (item / "model_index.json").exists() or any(
+                        file.suffix in extensions for file in item.iterdir()
+                    )
+                    if not is_model:
+                        continue
+                    key = item.name
+                    size, mtime = folder_fingerprint(item)
+                    base = {
+                        "name": item.name,
+                        "path": str(item),
+                        "type": "local",
+                        "description": f"Modelo local: {item.name}",
+                        "format": "diffusers" if (item / "model_index.json").exists() else "folder",
+                    }
+                elif item.is_file() and item.suffix in extensions:
+                    key = item.stem
+                    stat = item.stat()
+                    size, mtime = stat.st_size, stat.st_mtime_ns
+                    base = {
+                        "name": key,
+                        "path": str(item),
+                        "type": "local_file",
+                        "description": f"Modelo: {key}",
+                        "format": WEIGHT_FORMATS.get(item.suffix, item.suffix.lstrip(".")),
+                    }
+                else:
+                    continue
+            except OSError as e:
+                logger.warning(f"No se pudo indexar {item}: {e}")
+                continue
+
+            old = previous.get(key)
+            if old and old.get("path") == base["path"] and old.get("size") == size and old.get("mtime") == mtime:
+                entries[key] = old
+                continue
+
+            if item.is_dir():
+                architecture = detect_folder_architecture(item)
+            else:
+                architecture = detect_file_architecture(item)
+            entries[key] = {
+                **base,
+                "size": size,
+                "mtime": mtime,
+                "hash": None,
+                "architecture": architecture,
+            }
+        return entries
+
+    def _fill_hashes(self):
+        """Calcula los hashes pendientes (lo más costoso, por eso va aparte)"""
+        for kind in self.kinds:
+            for key, entry in self.get(kind).items():
+                if entry.get("hash"):
+                    continue
+                path = Path(entry["path"])
+                try:
+                    content_hash = folder_content_hash(path) if path.is_dir() else file_content_hash(path)
+                except OSError as e:
+                    logger.warning(f"No se pudo calcular el hash de {path}: {e}")
+                    continue
+                with self._lock:
+                    current = self._entries[kind].get(key)
+                    if current is not None and current.get("mtime") == entry["mtime"]:
+                        self._entries[kind][key] = {**current, "hash": content_hash}
+
+    def refresh(self, compute_hashes: bool = True):
+        """
+        Refresca el índice: primero un recorrido rápido por stat y después,
+        si se pide, el cálculo de los hashes de los archivos nuevos o modificados.
+        """
+        with self._refresh_lock:
+            start = time.perf_counter()
+            for kind in self.kinds:
+                entries = self._scan_kind(kind)
+                with self._lock:
+                    self._entries[kind] = entries
+            with self._lock:
+                self.last_refresh = time.time()
+            self.save()
+
+            if compute_hashes:
+                self._fill_hashes()
+                self.save()
+            self.last_refresh_seconds = round(time.perf_counter() - start, 2)
+
+    def request_refresh(self):
+        """Pide un refresco al hilo de fondo (p. ej. tras una descarga de Civitai)"""
+        self._wakeup.set()
+
+    def start_background_refresh(self, interval: Optional[float] = None) -> threading.Thread:
+        """Lanza un hilo daemon que refresca el índice cada `interval` segundos"""
+        if interval is None:
+            interval = float(os.getenv("REGISTRY_REFRESH_SECONDS", "60"))
+
+        def _loop():
+            while True:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Error refrescando el registro de modelos: {e}")
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+        self._thread = threading.Thread(target=_loop, name="model-registry", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def start_background_reload(self, interval: Optional[float] = None) -> threading.Thread:
+        """
+        Lanza un hilo daemon que vuelve a leer el índice cuando otro proceso
+        lo reescribe (refrescos y opciones de modelo), sin recorrer el disco
+        ni escribir nada.
+        """
+        if interval is None:
+            interval = float(os.getenv("REGISTRY_RELOAD_SECONDS", "5"))
+
+        def _loop():
+            while True:
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                try:
+                    mtime = self.index_path.stat().st_mtime_ns
+                except OSError:
+                    continue
+                if mtime != self._loaded_mtime:
+                    self.load()
+
+        self._thread = threading.Thread(target=_loop, name="model-registry-reload", daemon=True)
+        self._thread.start()
+        return self._thread
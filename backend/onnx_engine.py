@@ -0,0 +1,194 @@
+"""
+Motor alternativo ONNX Runtime para CPU
+Exporta una sola vez text encoder, UNet y VAE de un modelo a ONNX, guarda los
+grafos en ONNX_CACHE_DIR (nunca dentro de MODELS_DIR, para que el registro no
+los tome por modelos ni cambie el hash del modelo) y ejecuta txt2img / img2img con ONNX Runtime y las
+optimizaciones de grafo activadas.
+"""
+
+import os
+import shutil
+import uuid
+from pathlib import Path
+from typing import Optional
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+ONNX_CACHE_DIR = Path(os.getenv("ONNX_CACHE_DIR", str(BASE_DIR / "cache" / "onnx")))
+ONNX_OPSET = int(os.getenv("ONNX_OPSET", "14"))
+
+
+
+def onnx_dir_for(model_hash: str) -> Path:
+    """
+    Carpeta donde viven los grafos ONNX de un modelo, por su hash de
+    contenido: si se reemplaza el archivo del modelo se vuelve a exportar.
+    """
+    return ONNX_CACHE_DIR / model_hash
+
+
+def is_exported(onnx_dir: Path) -> bool:
+    return (onnx_dir / "model_index.json").exists() and (onnx_dir / "unet" / "model.onnx").exists()
+
+
+def _onnx_export(model, model_args: tuple, output_path: Path, input_names, output_names, dynamic_axes):
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    torch.onnx.export(
+        model,
+        model_args,
+        f=output_path.as_posix(),
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        do_constant_folding=True,
+        opset_version=ONNX_OPSET,
+    )
+
+
+@torch.no_grad()
+def export_pipeline_to_onnx(pipe, onnx_dir: Path):
+    """
+    Exporta un StableDiffusionPipeline de PyTorch (en float32, CPU) al formato
+    que carga OnnxStableDiffusionPipeline. Se escribe en una carpeta temporal
+    y se renombra al final para no dejar exportaciones a medias.
+    """
+    import onnx
+    from diffusers import OnnxRuntimeModel, OnnxStableDiffusionPipeline
+
+    pipe = pipe.to("cpu", torch.float32)
+    # Nombre único: dos procesos pueden exportar el mismo modelo a la vez
+    tmp_dir = onnx_dir.with_name(f"{onnx_dir.name}.{uuid.uuid4().hex[:8]}.tmp")
+
+    # Text encoder
+    num_tokens = pipe.text_encoder.config.max_position_embeddings
+    text_hidden_size = pipe.text_encoder.config.hidden_size
+    text_input = pipe.tokenizer(
+        "A sample prompt",
+        padding="max_length",
+        max_length=pipe.tokenizer.model_max_length,
+        truncation=True,
+        return_tensors="pt",
+    )
+    _onnx_export(
+        pipe.text_encoder,
+        (text_input.input_ids.to(dtype=torch.int32),),
+        tmp_dir / "text_encoder" / "model.onnx",
+        input_names=["input_ids"],
+        output_names=["last_hidden_state", "pooler_output"],
+        dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}},
+    )
+
+    # UNet (supera 2 GB en float32: los pesos van como datos externos)
+    in_channels = pipe.unet.config.in_channels
+    sample_size = pipe.unet.config.sample_size
+    unet_path = tmp_dir / "unet" / "model.onnx"
+    _onnx_export(
+        pipe.unet,
+        (
+            torch.randn(2, in_channels, sample_size, sample_size),
+            torch.randn(2),
+            torch.randn(2, num_tokens, text_hidden_size),
+            False,
+        ),
+        unet_path,
+        input_names=["sample", "timestep", "encoder_hidden_states", "return_dict"],
+        output_names=["out_sample"],
+        dynamic_axes={
+            "sample": {0: "batch", 1: "channels", 2: "height", 3: "width"},
+            "timestep": {0: "batch"},
+            "encoder_hidden_states": {0: "batch", 1: "sequence"},
+        },
+    )
+    unet_model = onnx.load(unet_path.as_posix())
+    shutil.rmtree(unet_path.parent)
+    unet_path.parent.mkdir(parents=True)
+    onnx.save_model(
+        unet_model,
+        unet_path.as_posix(),
+        save_as_external_data=True,
+        all_tensors_to_one_file=True,
+        location="weights.pb",
+        convert_attribute=False,
+    )
+    del unet_model
+
+    # VAE encoder y decoder por separado
+    vae = pipe.vae
+    latent_channels = vae.config.latent_channels
+    vae_in_channels = vae.config.in_channels
+    vae_sample_size = vae.config.sample_size
+    vae.forward = lambda sample, return_dict: vae.encode(sample, return_dict)[0].sample()
+    _onnx_export(
+        vae,
+        (torch.randn(1, vae_in_channels, vae_sample_size, vae_sample_size), False),
+        tmp_dir / "vae_encoder" / "model.onnx",
+        input_names=["sample", "return_dict"],
+        output_names=["latent_sample"],
+        dynamic_axes={"sample": {0: "batch", 1: "channels", 2: "height", 3: "width"}},
+    )
+    vae.forward = vae.decode
+    _onnx_export(
+        vae,
+        (torch.randn(1, latent_channels, sample_size, sample_size), False),
+        tmp_dir / "vae_decoder" / "model.onnx",
+        input_names=["latent_sample", "return_dict"],
+        output_names=["sample"],
+        dynamic_axes={"latent_sample": {0: "batch", 1: "channels", 2: "height", 3: "width"}},
+    )
+
+    onnx_pipeline = OnnxStableDiffusionPipeline(
+        vae_encoder=OnnxRuntimeModel.from_pretrained(tmp_dir / "vae_encoder"),
+        vae_decoder=OnnxRuntimeModel.from_pretrained(tmp_dir / "vae_decoder"),
+        text_encoder=OnnxRuntimeModel.from_pretrained(tmp_dir / "text_encoder"),
+        tokenizer=pipe.tokenizer,
+        unet=OnnxRuntimeModel.from_pretrained(tmp_dir / "unet"),
+        scheduler=pipe.scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    onnx_pipeline.save_pretrained(tmp_dir)
+    del onnx_pipeline
+
+    if is_exported(onnx_dir):
+        # Otro proceso terminó antes la misma exportación
+        shutil.rmtree(tmp_dir)
+        return
+    if onnx_dir.exists():
+        shutil.rmtree(onnx_dir)
+    tmp_dir.rename(onnx_dir)
+    logger.info(f"Modelo exportado a ONNX en: {onnx_dir}")
+
+
+def onnx_size_bytes(onnx_dir: Path) -> int:
+    """Tamaño en disco de los grafos y pesos ONNX (aprox. la RAM que ocuparán)"""
+    return sum(p.stat().st_size for p in onnx_dir.rglob("*") if p.is_file())
+
+
+def load_onnx_pipelines(onnx_dir: Path, threads: Optional[int] = None):
+    """
+    Carga los pipelines ONNX txt2img e img2img (comparten sesiones) con
+    optimizaciones de grafo completas en CPUExecutionProvider.
+
+    Returns:
+        Tupla (txt2img_pipe, img2img_pipe)
+    """
+    import onnxruntime as ort
+    from diffusers import OnnxStableDiffusionPipeline, OnnxStableDiffusionImg2ImgPipeline
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads:
+        sess_options.intra_op_num_threads = threads
+
+    pipe = OnnxStableDiffusionPipeline.from_pretrained(
+        str(onnx_dir),
+        provider="CPUExecutionProvider",
+        sess_options=sess_options,
+    )
+    img2img_pipe = OnnxStableDiffusionImg2ImgPipeline(**pipe.components)
+    return pipe, img2img_pipe
@@ -0,0 +1,229 @@
+"""
+Caché LRU de pipelines de Stable Diffusion
+Mantiene varios modelos cargados (txt2img + img2img + inpaint) dentro de un
+presupuesto de memoria configurable y expulsa el menos usado recientemente.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_module_bytes(module, seen: Optional[set] = None) -> int:
+    """
+    Memoria de un módulo de torch: parámetros y buffers, más los pesos
+    empaquetados de las capas cuantizadas (no aparecen en parameters()).
+    `seen` evita contar dos veces tensores compartidos entre módulos.
+    """
+    if module is None or not hasattr(module, "parameters"):
+        return 0
+    if seen is None:
+        seen = set()
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        if id(tensor) in seen:
+            continue
+        seen.add(id(tensor))
+        total += tensor.numel() * tensor.element_size()
+    for submodule in module.modules():
+        if getattr(submodule, "_packed_params", None) is not None:
+            weight = submodule.weight()
+            total += weight.numel() * weight.element_size()
+    return total
+
+
+def estimate_pipeline_bytes(pipe) -> int:
+    """Estima la memoria que ocupa un pipeline sumando todos sus componentes que sean módulos de torch"""
+    seen = set()
+    return sum(
+        estimate_module_bytes(component, seen)
+        for component in getattr(pipe, "components", {}).values()
+    )
+
+
+class PipelineEntry:
+    """Un modelo cargado junto con sus pipelines derivados"""
+
+    def __init__(self, model_key: str, pipe, img2img_pipe=None, inpaint_pipe=None, size_bytes: int = 0):
+        self.model_key = model_key
+        self.pipe = pipe
+        self.img2img_pipe = img2img_pipe
+        self.inpaint_pipe = inpaint_pipe
+        self.size_bytes = size_bytes
+        # VAE propio del modelo, para poder volver a él tras un intercambio
+        self.default_vae = getattr(pipe, "vae", None)
+        # Scheduler original del modelo y los derivados por sampler (ver samplers)
+        self.default_scheduler = getattr(pipe, "scheduler", None)
+        self.schedulers: Dict[str, object] = {}
+        self.vae_key = "default"
+        # Motor de inferencia: "torch" o "onnx"
+        self.engine = "torch"
+        # Precisión de los pesos: "fp16", "fp32" o "int8"
+        self.precision = None
+        # Hash de los pesos cargados (None si no se conocía al cargar): clave de la caché de resultados
+        self.model_hash: Optional[str] = None
+        # (tamaño, mtime) del archivo en el registro al cargar: permite adoptar después su hash
+        self.model_fingerprint: Optional[tuple] = None
+        # Un pipeline no admite inferencias concurrentes: se serializan por modelo
+        self.lock = threading.RLock()
+        # Trabajos que están usando la entrada; una entrada retirada (expulsada
+        # o reemplazada) solo se libera cuando este contador llega a 0
+        self.in_flight = 0
+        self.retired = False
+        # Adaptadores LoRA inyectados en el modelo: nombre -> bytes (ver lora_cache)
+        self.lora_adapters: "OrderedDict[str, int]" = OrderedDict()
+        # Pesos de combinaciones de LoRAs fusionadas (ver lora_cache.LoRAFusion)
+        self.lora_fusion = None
+        # Embeddings de textual inversion cargados: nombre -> token (ver textual_inversion)
+        self.embedding_tokens: Dict[str, str] = {}
+
+
+class PipelineCache:
+    """
+    Caché LRU de pipelines con presupuesto de memoria.
+
+    El presupuesto se lee de PIPELINE_CACHE_MAX_MB y el número máximo de
+    modelos residentes de PIPELINE_CACHE_MAX_MODELS. El modelo más reciente
+    nunca se expulsa aunque por sí solo supere el presupuesto.
+
+    Las entradas reservadas con acquire() que se expulsan o se reemplazan
+    salen de la caché al momento, pero on_evict no se llama hasta el último
+    release(): un trabajo en curso nunca pierde su pipeline.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        max_entries: Optional[int] = None,
+        on_evict: Optional[Callable[[PipelineEntry], None]] = None,
+    ):
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("PIPELINE_CACHE_MAX_MB", "12000")) * 1024 * 1024)
+        if max_entries is None:
+            max_entries = int(os.getenv("PIPELINE_CACHE_MAX_MODELS", "3"))
+        self.max_bytes = max_bytes
+        self.max_entries = max(1, max_entries)
+        self.on_evict = on_evict
+        self._entries: "OrderedDict[str, PipelineEntry]" = OrderedDict()
+        # Entradas retiradas que siguen en uso por algún trabajo
+        self._retired: List[PipelineEntry] = []
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.deferred_releases = 0
+
+    def __contains__(self, model_key: str) -> bool:
+        with self._lock:
+            return model_key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    def get(self, model_key: str, acquire: bool = False) -> Optional[PipelineEntry]:
+        """
+        Devuelve la entrada (marcándola como usada) o None si no está cargada.
+        Con acquire=True además la reserva hasta release().
+        """
+        with self._lock:
+            entry = self._entries.get(model_key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(model_key)
+            self.hits += 1
+            if acquire:
+                entry.in_flight += 1
+            return entry
+
+    def peek(self, model_key: str) -> Optional[PipelineEntry]:
+        """Como get, pero sin marcarla como usada ni contar hits/misses"""
+        with self._lock:
+            return self._entries.get(model_key)
+
+    def put(self, entry: PipelineEntry) -> PipelineEntry:
+        """Añade una entrada como la más reciente y expulsa lo que sobre"""
+        with self._lock:
+            if entry.model_key in self._entries:
+                self._entries.pop(entry.model_key)
+            self._entries[entry.model_key] = entry
+            self._evict_over_budget()
+            return entry
+
+    def remove(self, model_key: str) -> Optional[PipelineEntry]:
+        """Quita un modelo de la caché sin contarlo como expulsión ni liberarlo"""
+        with self._lock:
+            return self._entries.pop(model_key, None)
+
+    def release(self, entry: PipelineEntry):
+        """Fin de un uso reservado con acquire; libera la entrada si estaba retirada"""
+        with self._lock:
+            entry.in_flight = max(0, entry.in_flight - 1)
+            if not entry.retired or entry.in_flight > 0 or entry not in self._retired:
+                return
+            self._retired.remove(entry)
+        logger.info(f"Liberando modelo retirado tras su último trabajo: {entry.model_key}")
+        self._notify_evict(entry)
+
+    def retire(self, entry: PipelineEntry):
+        """
+        Libera una entrada que ya no está en la caché (p. ej. la versión
+        anterior de un modelo recargado) en cuanto deje de estar en uso.
+        """
+        with self._lock:
+            entry.retired = True
+            if entry.in_flight > 0:
+                self._retired.append(entry)
+                self.deferred_releases += 1
+                return
+        self._notify_evict(entry)
+
+    def clear(self):
+        with self._lock:
+            while self._entries:
+                _, entry = self._entries.popitem(last=False)
+                self.retire(entry)
+
+    def _evict_over_budget(self):
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+        ):
+            model_key, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.info(f"Expulsando modelo de la caché: {model_key}")
+            self.retire(entry)
+
+    def _notify_evict(self, entry: PipelineEntry):
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(entry)
+        except Exception as e:
+            logger.warning(f"Error liberando modelo {entry.model_key}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "models": list(self._entries.keys()),
+                "size_mb": round(self.total_bytes / (1024 * 1024), 1),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "max_models": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "in_flight": {key: entry.in_flight for key, entry in self._entries.items() if entry.in_flight},
+                "pending_release": [entry.model_key for entry in self._retired],
+                "deferred_releases": self.deferred_releases,
+            }
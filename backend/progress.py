@@ -0,0 +1,120 @@
+"""
+Progreso por step de las generaciones
+Un callback del bucle de denoising calcula step, tiempo transcurrido y ETA y,
+cada N steps, una vista previa de baja resolución obtenida de los latentes
+con una aproximación lineal latente -> RGB (sin pasar por el VAE).
+El mismo callback interrumpe la generación si se ha pedido cancelarla.
+"""
+
+import base64
+import io
+import os
+import time
+from typing import Callable, List, Optional
+import logging
+
+import torch
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Cada cuántos steps se envía una vista previa (0 = nunca)
+PREVIEW_EVERY_STEPS = int(os.getenv("PREVIEW_EVERY_STEPS", "5"))
+
+# Proyección lineal de los 4 canales latentes de SD 1.x/2.x a RGB
+LATENT_RGB_FACTORS = torch.tensor([
+    #   R       G       B
+    [0.3512, 0.2297, 0.3227],
+    [0.3250, 0.4974, 0.2350],
+    [-0.2829, 0.1762, 0.2721],
+    [-0.2120, -0.2616, -0.7177],
+])
+
+
+class GenerationCancelled(Exception):
+    """Se lanza desde el callback de steps para cortar el bucle de denoising"""
+
+
+def latents_to_previews(latents: torch.Tensor) -> List[str]:
+    """
+    Convierte latentes (batch, 4, h/8, w/8) en JPEG base64 de h/8 x w/8.
+    Es una multiplicación de matrices por píxel: coste despreciable frente a un step.
+    """
+    with torch.no_grad():
+        factors = LATENT_RGB_FACTORS.to(device=latents.device, dtype=torch.float32)
+        rgb = torch.einsum("bchw,cr->bhwr", latents.float(), factors)
+        rgb = ((rgb + 1) / 2).clamp(0, 1).mul(255).to(torch.uint8).cpu().numpy()
+
+    previews = []
+    for array in rgb:
+        buffer = io.BytesIO()
+        Image.fromarray(array).save(buffer, format="JPEG", quality=70)
+        previews.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+    return previews
+
+
+class StepProgress:
+    """
+    Callback de progreso para los pipelines de diffusers.
+
+    Args:
+        total_steps: Steps de denoising esperados (suma de todas las llamadas al pipeline)
+        on_progress: Recibe el evento de progreso y, si toca, una vista previa por imagen del lote
+        preview_every: Steps entre vistas previas (PREVIEW_EVERY_STEPS)
+        should_cancel: Si devuelve True, el siguiente step lanza GenerationCancelled
+    """
+
+    def __init__(
+        self,
+        total_steps: int,
+        on_progress: Optional[Callable[[dict, Optional[List[str]]], None]] = None,
+        preview_every: Optional[int] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+    ):
+        self.total_steps = max(1, total_steps)
+        self.on_progress = on_progress
+        self.preview_every = PREVIEW_EVERY_STEPS if preview_every is None else preview_every
+        self.should_cancel = should_cancel
+        self.done = 0
+        self.started_at = time.perf_counter()
+
+    def _step(self, latents: Optional[torch.Tensor]):
+        if self.should_cancel is not None and self.should_cancel():
+            raise GenerationCancelled(f"Cancelada en el step {self.done}/{self.total_steps}")
+
+        self.done += 1
+        if self.on_progress is None:
+            return
+        elapsed = time.perf_counter() - self.started_at
+        event = {
+            "step": self.done,
+            "total_steps": self.total_steps,
+            "elapsed": round(elapsed, 2),
+            "eta": round(elapsed / self.done * max(0, self.total_steps - self.done), 2),
+        }
+
+        previews = None
+        if (
+            latents is not None
+            and self.preview_every > 0
+            and self.done % self.preview_every == 0
+            and self.done < self.total_steps
+        ):
+            try:
+                previews = latents_to_previews(latents)
+            except Exception as e:
+                logger.warning(f"No se pudo generar la vista previa: {e}")
+
+        try:
+            self.on_progress(event, previews)
+        except Exception as e:
+            logger.warning(f"Error publicando el progreso: {e}")
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: dict) -> dict:
+        """Firma de callback_on_step_end (pipelines de PyTorch)"""
+        self._step(callback_kwargs.get("latents"))
+        return callback_kwargs
+
+    def legacy(self, step: int, timestep, latents):
+        """Firma de callback/callback_steps (pipelines ONNX); sin vista previa"""
+        self._step(None)
@@ -0,0 +1,129 @@
+"""
+Caché de embeddings de prompts
+Guarda la salida del text encoder (prompt_embeds) por modelo, estado del
+text encoder (LoRA activo, tokens de textual inversion) y texto exacto, y
+la pasa a los pipelines como embeddings precalculados. Sirve igual para
+txt2img, img2img e inpaint porque comparten text encoder.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Sequence, Tuple
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def text_encoder_state(entry, loras: Sequence[Tuple[str, float]] = ()) -> tuple:
+    """
+    Todo lo que cambia la salida del text encoder además del texto: versión
+    cargada del modelo, LoRAs activos con su escala y tokens de textual
+    inversion cargados en el tokenizer.
+    """
+    return (
+        entry.engine,
+        entry.precision,
+        tuple(loras),
+        tuple(sorted(entry.embedding_tokens.values())),
+    )
+
+
+class PromptEmbeddingCache:
+    """
+    Caché LRU de embeddings de texto.
+
+    Args:
+        max_entries: Textos cacheados como máximo (PROMPT_CACHE_SIZE, por defecto 256)
+    """
+
+    def __init__(self, max_entries: Optional[int] = None):
+        if max_entries is None:
+            max_entries = int(os.getenv("PROMPT_CACHE_SIZE", "256"))
+        self.max_entries = max_entries
+        # clave -> (embeds, segundos que costó calcularlo)
+        self._entries: "OrderedDict[Hashable, Tuple[torch.Tensor, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def encode(self, pipe, model_key: str, te_state: tuple, text: str, device) -> torch.Tensor:
+        """Embedding de un texto (1, tokens, dim), desde la caché o calculándolo con el pipeline"""
+        key = (model_key, te_state, text)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += cached[1]
+                return cached[0]
+            self.misses += 1
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            embeds, _ = pipe.encode_prompt(
+                text,
+                device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+            )
+        seconds = time.perf_counter() - start
+
+        if self.enabled:
+            with self._lock:
+                self._entries[key] = (embeds, seconds)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return embeds
+
+    def pipeline_kwargs(
+        self,
+        pipe,
+        model_key: str,
+        te_state: tuple,
+        prompts: List[str],
+        negative_prompts: List[str],
+        device,
+    ) -> dict:
+        """
+        Argumentos prompt_embeds / negative_prompt_embeds para una llamada a
+        un pipeline, con una fila por imagen. Sustituyen a prompt / negative_prompt.
+        """
+        encoded = {}
+
+        def embed(text: str) -> torch.Tensor:
+            if text not in encoded:
+                encoded[text] = self.encode(pipe, model_key, te_state, text, device)
+            return encoded[text]
+
+        return {
+            "prompt_embeds": torch.cat([embed(text) for text in prompts]),
+            "negative_prompt_embeds": torch.cat([embed(text) for text in negative_prompts]),
+        }
+
+    def drop_model(self, model_key: str):
+        """Olvida los embeddings de un modelo (p. ej. al expulsarlo de la caché de pipelines)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == model_key]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 2),
+            }
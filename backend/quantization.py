@@ -0,0 +1,111 @@
+"""
+Cuantización dinámica int8 para workers de CPU
+Cuantiza las capas Linear del text encoder y la UNet al cargar el modelo y
+guarda los módulos cuantizados en disco, indexados por el hash del modelo,
+para que las siguientes cargas no lean los pesos float32 de esos componentes.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict
+import logging
+
+import diffusers
+import torch
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).parent.parent
+QUANTIZED_DIR = Path(os.getenv("QUANTIZED_MODELS_DIR", str(BASE_DIR / "cache" / "quantized")))
+
+QUANTIZED_COMPONENTS = ("text_encoder", "unet")
+
+
+def module_bytes(module) -> int:
+    """
+    Memoria de un módulo, contando también los pesos empaquetados de las
+    capas cuantizadas, que no aparecen en parameters().
+    """
+    total = sum(t.numel() * t.element_size() for t in module.parameters())
+    total += sum(t.numel() * t.element_size() for t in module.buffers())
+    for submodule in module.modules():
+        if isinstance(submodule, torch.ao.nn.quantized.dynamic.Linear):
+            weight = submodule.weight()
+            total += weight.numel() * weight.element_size()
+            bias = submodule.bias()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
+
+
+def quantized_cache_dir(model_hash: str) -> Path:
+    """
+    Carpeta de la caché para un modelo. Incluye las versiones de torch y
+    diffusers porque los módulos se guardan serializados completos.
+    """
+    versions = f"torch{torch.__version__}-diffusers{diffusers.__version__}".replace("+", "_")
+    return QUANTIZED_DIR / model_hash / versions
+
+
+def load_quantized_components(model_hash: str) -> Dict[str, torch.nn.Module]:
+    """Módulos cuantizados guardados para un modelo, o {} si no están todos"""
+    cache_dir = quantized_cache_dir(model_hash)
+    paths = {name: cache_dir / f"{name}.pt" for name in QUANTIZED_COMPONENTS}
+    if not all(path.exists() for path in paths.values()):
+        return {}
+
+    components = {}
+    for name, path in paths.items():
+        try:
+            components[name] = torch.load(path, map_location="cpu", weights_only=False)
+        except Exception as e:
+            logger.warning(f"Caché de cuantización inválida en {path}: {e}")
+            return {}
+    logger.info(f"Componentes int8 cargados desde caché: {cache_dir}")
+    return components
+
+
+def load_quantization_report(model_hash: str) -> dict:
+    report_path = quantized_cache_dir(model_hash) / "report.json"
+    if not report_path.exists():
+        return {}
+    with open(report_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def quantize_pipeline(pipe, model_hash: str) -> dict:
+    """
+    Aplica cuantización dinámica int8 a las capas Linear del text encoder y
+    la UNet, guarda el resultado en caché y devuelve el ahorro de memoria.
+    """
+    cache_dir = quantized_cache_dir(model_hash)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    report = {"fp32_bytes": 0, "int8_bytes": 0, "components": {}}
+    for name in QUANTIZED_COMPONENTS:
+        module = getattr(pipe, name)
+        fp32_bytes = module_bytes(module)
+        # inplace para no duplicar temporalmente la memoria del módulo
+        quantized = torch.ao.quantization.quantize_dynamic(
+            module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        int8_bytes = module_bytes(quantized)
+        setattr(pipe, name, quantized)
+
+        try:
+            tmp_path = cache_dir / f"{name}.pt.tmp"
+            torch.save(quantized, tmp_path)
+            os.replace(tmp_path, cache_dir / f"{name}.pt")
+        except Exception as e:
+            logger.warning(f"No se pudo guardar {name} cuantizado en caché: {e}")
+
+        report["components"][name] = {"fp32_bytes": fp32_bytes, "int8_bytes": int8_bytes}
+        report["fp32_bytes"] += fp32_bytes
+        report["int8_bytes"] += int8_bytes
+
+    report["saved_mb"] = round((report["fp32_bytes"] - report["int8_bytes"]) / (1024 * 1024), 1)
+    with open(cache_dir / "report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Cuantización int8: {report['saved_mb']} MB ahorrados")
+    return report
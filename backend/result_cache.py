@@ -0,0 +1,155 @@
+"""
+Caché de resultados direccionada por contenido
+Una imagen txt2img con seed fija es determinista: se identifica por un hash
+canónico de todos los parámetros que afectan a la salida, su propia seed y la
+variante del modelo que la generó (motor, precisión, hash de los pesos y
+autocast bf16). Si ya se generó, se devuelve el archivo existente sin tocar
+el pipeline; una petición de varias imágenes se sirve si están todas sus
+seeds, vengan de la petición que vengan. Las claves se guardan en los
+metadatos de cada imagen (campo cache_key) y se buscan en el índice SQLite de
+la galería, compartido por todos los procesos.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+import logging
+
+from backend.gallery_index import GalleryIndex
+from backend.schemas import request_loras, request_sampler
+
+logger = logging.getLogger(__name__)
+
+# Parámetros de GenerateRequest que determinan cada imagen (además de su seed)
+CACHE_KEY_FIELDS = (
+    "prompt",
+    "negative_prompt",
+    "model",
+    "vae",
+    "negative_embedding",
+    "sampler",
+    "steps",
+    "guidance_scale",
+    "width",
+    "height",
+    "upscale_factor",
+)
+
+# (model_key) -> variante con la que se generaría ahora ese modelo, o None
+VariantProvider = Callable[[str], Optional[dict]]
+
+
+def generation_variant(engine: str, precision: Optional[str], model_hash: Optional[str], bf16: bool) -> Optional[dict]:
+    """
+    Lo que cambia los píxeles sin estar en la petición: motor, precisión,
+    pesos del modelo y autocast. None si aún no se conoce el hash del modelo
+    (no se cachea nada de él).
+    """
+    if not model_hash:
+        return None
+    variant = {"engine": engine, "precision": precision, "model_hash": model_hash}
+    if bf16 and engine == "torch":
+        # El autocast bfloat16 solo afecta al motor torch
+        variant["autocast"] = "bf16"
+    return variant
+
+
+def image_cache_key(
+    request,
+    seed: int,
+    variant: Optional[dict],
+    loras: Optional[Sequence[Tuple[str, float]]] = None,
+    vae: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Hash canónico de una imagen (parámetros + su seed + variante), o None si
+    no se puede cachear. `loras` y `vae` son los realmente aplicados al
+    guardarla (por defecto, los pedidos: así se buscan).
+    """
+    if not seed or variant is None:
+        return None
+    fields = {name: getattr(request, name, None) for name in CACHE_KEY_FIELDS}
+    # lora_path + lora_scale y la lista `loras` se normalizan a una sola lista
+    fields["loras"] = [list(lora) for lora in (request_loras(request) if loras is None else loras)]
+    # Sin sampler explícito cuenta el resuelto (DEFAULT_SAMPLER y use_karras) con el que se generó
+    fields["sampler"] = request_sampler(request)
+    if vae is not None:
+        fields["vae"] = vae
+    fields["seed"] = seed
+    fields["variant"] = variant
+    canonical = json.dumps(fields, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def request_cache_keys(request, variant: Optional[dict]) -> Optional[List[str]]:
+    """Claves de las imágenes de una petición (seed + i), o None si no es determinista (seed 0 = aleatoria)"""
+    if not getattr(request, "seed", 0) or variant is None:
+        return None
+    return [image_cache_key(request, request.seed + index, variant) for index in range(request.num_images)]
+
+
+class ResultCache:
+    """
+    Búsqueda cache_key -> imagen ya generada sobre el índice SQLite de la
+    galería. Las consultas bloquean (SQLite + stat de los archivos): desde
+    código async deben ir por asyncio.to_thread.
+
+    Args:
+        index: Índice de la galería, donde cada imagen guarda su cache_key
+        directory: Carpeta de generaciones (PNG + JSON)
+        enabled: RESULT_CACHE_ENABLED (por defecto 1)
+    """
+
+    def __init__(self, index: GalleryIndex, directory: Path, enabled: Optional[bool] = None):
+        if enabled is None:
+            enabled = os.getenv("RESULT_CACHE_ENABLED", "1") != "0"
+        self.index = index
+        self.directory = Path(directory)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, keys: Optional[List[str]]) -> Optional[List[dict]]:
+        """Imágenes ya generadas para unas claves (en su orden), o None si falta alguna"""
+        if not keys or not self.enabled:
+            return None
+
+        found = self.index.find_cache_keys(keys)
+        images = []
+        for key in keys:
+            image = found.get(key)
+            # Si alguien borró el archivo, la imagen ya no sirve
+            if image is None or not (self.directory / image["filename"]).exists():
+                self._count(False)
+                return None
+            images.append(image)
+        self._count(True)
+        return [
+            {
+                "image_url": f"http://localhost:8000/api/image/{image['filename']}",
+                "filename": image["filename"],
+                "seed": image["seed"],
+            }
+            for image in images
+        ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
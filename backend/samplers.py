@@ -0,0 +1,162 @@
+"""
+Samplers (schedulers) seleccionables por petición
+Cada sampler es una variante de la config del scheduler propio del modelo
+cargado: la instancia se crea una vez por modelo con from_config (sin
+recargar el pipeline) y se asigna al pipeline con el lock del modelo tomado,
+así que los trabajos concurrentes nunca comparten un scheduler a la vez.
+Sin dependencias de torch salvo al crear el scheduler: el gateway valida
+los nombres con este módulo.
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Nombre -> (clase de diffusers, parámetros sobre la config del modelo); None = scheduler del modelo
+SAMPLERS: Dict[str, Optional[Tuple[str, dict]]] = {
+    "Default": None,
+    "DPM++ 2M": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": False}),
+    "DPM++ 2M Karras": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+    "Euler": ("EulerDiscreteScheduler", {"use_karras_sigmas": False}),
+    "Euler A": ("EulerAncestralDiscreteScheduler", {}),
+    "Heun": ("HeunDiscreteScheduler", {"use_karras_sigmas": False}),
+    "LMS": ("LMSDiscreteScheduler", {"use_karras_sigmas": False}),
+    "LMS Karras": ("LMSDiscreteScheduler", {"use_karras_sigmas": True}),
+}
+
+# Steps a partir de los que cada sampler suele dar una imagen estable
+MIN_STEPS = {
+    "DPM++ 2M Karras": 15,
+    "DPM++ 2M": 20,
+    "Euler A": 20,
+    "Heun": 20,
+    "Euler": 25,
+    "LMS Karras": 25,
+    "LMS": 30,
+}
+
+# (sin Karras, con Karras) de cada sampler para `use_karras`; None = no existe esa variante.
+# El scheduler propio del modelo no usa sigmas Karras: su variante Karras es DPM++ 2M Karras
+KARRAS_VARIANTS: Dict[str, Tuple[str, Optional[str]]] = {
+    "Default": ("Default", "DPM++ 2M Karras"),
+    "DPM++ 2M": ("DPM++ 2M", "DPM++ 2M Karras"),
+    "DPM++ 2M Karras": ("DPM++ 2M", "DPM++ 2M Karras"),
+    "Euler": ("Euler", None),
+    "Euler A": ("Euler A", None),
+    "Heun": ("Heun", None),
+    "LMS": ("LMS", "LMS Karras"),
+    "LMS Karras": ("LMS", "LMS Karras"),
+}
+
+# Sampler de las peticiones que no indican ninguno ("Default" = scheduler propio del modelo)
+DEFAULT_SAMPLER = os.getenv("DEFAULT_SAMPLER", "Default")
+
+
+def _canonical_sampler(name: str) -> str:
+    for known in SAMPLERS:
+        if known.lower() == name.strip().lower():
+            return known
+    raise ValueError(f"Sampler no soportado: {name}. Disponibles: {', '.join(SAMPLERS)}")
+
+
+def resolve_sampler(name: Optional[str], use_karras: Optional[bool] = None) -> str:
+    """
+    Nombre canónico de un sampler (sin distinguir mayúsculas); None = DEFAULT_SAMPLER.
+    Sin sampler, `use_karras` elige la variante con o sin sigmas Karras de
+    DEFAULT_SAMPLER; con sampler, solo se acepta si coincide con su nombre.
+    """
+    sampler = _canonical_sampler(name or DEFAULT_SAMPLER)
+    if use_karras is None:
+        return sampler
+
+    variant = KARRAS_VARIANTS[sampler][1 if use_karras else 0]
+    if name and variant != sampler:
+        raise ValueError(
+            f"use_karras={str(use_karras).lower()} no coincide con el sampler {sampler}: "
+            "indica la variante en el nombre del sampler (p. ej. 'DPM++ 2M Karras') u omite use_karras"
+        )
+    if variant is None:
+        raise ValueError(f"{sampler} no tiene variante Karras: indica otro sampler u omite use_karras")
+    return variant
+
+
+def scheduler_for(entry, sampler: str):
+    """
+    Scheduler de un sampler para un modelo cargado, creado la primera vez
+    desde la config del scheduler original del modelo. Solo debe usarse con
+    `entry.lock` tomado: set_timesteps reinicia su estado en cada llamada.
+    """
+    scheduler = entry.schedulers.get(sampler)
+    if scheduler is not None:
+        return scheduler
+
+    spec = SAMPLERS[sampler]
+    if spec is None:
+        scheduler = entry.default_scheduler
+    else:
+        import diffusers
+
+        class_name, overrides = spec
+        scheduler = getattr(diffusers, class_name).from_config(entry.default_scheduler.config, **overrides)
+    entry.schedulers[sampler] = scheduler
+    return scheduler
+
+
+class SamplerTimings:
+    """Segundos por step e imagen de cada sampler, medidos en las generaciones reales"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # sampler -> {"runs", "steps", "seconds"}
+        self._timings: Dict[str, dict] = {}
+
+    def record(self, sampler: str, steps: int, images: int, seconds: float):
+        """Registra una llamada al pipeline (incluye text encoder y decodificación del VAE)"""
+        if steps <= 0 or images <= 0:
+            return
+        with self._lock:
+            timing = self._timings.setdefault(sampler, {"runs": 0, "steps": 0, "seconds": 0.0})
+            timing["runs"] += 1
+            timing["steps"] += steps * images
+            timing["seconds"] += seconds
+
+    def seconds_per_step(self, sampler: str) -> Optional[float]:
+        with self._lock:
+            timing = self._timings.get(sampler)
+            if not timing or not timing["steps"]:
+                return None
+            return timing["seconds"] / timing["steps"]
+
+    def recommend(self, steps: int) -> List[dict]:
+        """
+        Samplers que convergen con `steps` steps, del más rápido al más lento
+        según lo medido; los que aún no tienen medidas van al final.
+        """
+        candidates = []
+        for sampler, min_steps in MIN_STEPS.items():
+            if steps < min_steps:
+                continue
+            per_step = self.seconds_per_step(sampler)
+            candidates.append({
+                "sampler": sampler,
+                "min_steps": min_steps,
+                "estimated_seconds": round(per_step * steps, 2) if per_step is not None else None,
+            })
+        candidates.sort(key=lambda item: (item["estimated_seconds"] is None, item["estimated_seconds"] or 0))
+        return candidates
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                sampler: {
+                    "runs": timing["runs"],
+                    "seconds_per_step": round(timing["seconds"] / timing["steps"], 4) if timing["steps"] else None,
+                }
+                for sampler, timing in self._timings.items()
+            }
+
+
+sampler_timings = SamplerTimings()
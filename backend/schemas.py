@@ -0,0 +1,144 @@
+"""
+Modelos de petición de generación
+Sin dependencias de torch: los comparten el servidor completo (backend.main)
+y el gateway ligero (backend.gateway).
+"""
+
+import os
+from typing import List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from backend.samplers import resolve_sampler
+
+# Máximo de imágenes por petición de generación
+MAX_IMAGES_PER_REQUEST = int(os.getenv("MAX_IMAGES_PER_REQUEST", "8"))
+
+
+class LoRAWeight(BaseModel):
+    path: str
+    scale: float = 0.75
+
+
+class GenerateRequest(BaseModel):
+    prompt: str
+    negative_prompt: str = ""
+    steps: int = 20
+    guidance_scale: float = 7.5
+    seed: int = 0
+    width: int = 512
+    height: int = 512
+    model: str = "stable-diffusion-v1-5"
+    vae: str = "default"
+    # Nombre de /api/samplers; None = DEFAULT_SAMPLER (por defecto el scheduler del modelo)
+    sampler: Optional[str] = None
+    # Solo sin sampler: variante con (True) o sin (False) sigmas Karras; None = la de DEFAULT_SAMPLER
+    use_karras: Optional[bool] = None
+    lora_path: Optional[str] = None
+    lora_scale: float = 0.75
+    # Varios LoRAs con su peso; se suman al de lora_path si también se indica
+    loras: List[LoRAWeight] = []
+    upscale_factor: int = 0  # 0 = no upscale, 2 o 4
+    negative_embedding: Optional[str] = None
+    num_images: int = 1  # Imagen i usa seed + i
+
+
+class Image2ImageRequest(BaseModel):
+    prompt: str
+    negative_prompt: str = ""
+    steps: int = 20
+    guidance_scale: float = 7.5
+    seed: int = 0
+    strength: float = 0.8  # 0.0-1.0, qué tanto cambiar
+    model: str = "stable-diffusion-v1-5"
+    vae: str = "default"
+    sampler: Optional[str] = None
+    lora_path: Optional[str] = None
+    lora_scale: float = 0.75
+    loras: List[LoRAWeight] = []
+    # Hash de una imagen ya subida (POST /api/uploads) en lugar de enviar el archivo
+    image_hash: Optional[str] = None
+
+
+class ModelOptionsRequest(BaseModel):
+    engine: Optional[str] = None  # torch, onnx (None = por defecto)
+    precision: Optional[str] = None  # fp32, int8 (solo CPU, None = por defecto)
+
+
+def validate_generate_request(request: GenerateRequest) -> Optional[str]:
+    """Mensaje de error si la petición no es válida, None si lo es"""
+    if not request.prompt.strip():
+        return "El prompt no puede estar vacío."
+    if not 1 <= request.num_images <= MAX_IMAGES_PER_REQUEST:
+        return f"num_images debe estar entre 1 y {MAX_IMAGES_PER_REQUEST}."
+    try:
+        request_sampler(request)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def request_sampler(request) -> str:
+    """Sampler canónico de una petición (sampler + use_karras)"""
+    return resolve_sampler(request.sampler, getattr(request, "use_karras", None))
+
+
+def request_loras(request) -> List[Tuple[str, float]]:
+    """LoRAs de una petición como (ruta, escala): lora_path primero y después la lista `loras`"""
+    loras = [(request.lora_path, request.lora_scale)] if request.lora_path else []
+    loras.extend((lora.path, lora.scale) for lora in request.loras)
+    return loras
+
+
+def batch_key_fields(request: GenerateRequest) -> tuple:
+    """Parámetros que deben coincidir para generar varias peticiones en un solo lote"""
+    return (
+        request.model,
+        request.vae,
+        tuple(request_loras(request)),
+        request_sampler(request),
+        request.negative_embedding,
+        request.steps,
+        request.guidance_scale,
+        request.width,
+        request.height,
+    )
+
+
+def generation_response(
+    request: GenerateRequest,
+    images: List[dict],
+    cached: bool = False,
+    loras: Optional[List[Tuple[str, float]]] = None,
+    vae: Optional[str] = None,
+) -> dict:
+    """
+    Respuesta de una petición txt2img; image_url/filename/seed son los de la
+    primera imagen. `loras` y `vae` son los realmente aplicados (por defecto, los pedidos).
+    """
+    if loras is None:
+        loras = request_loras(request)
+    return {
+        "success": True,
+        "cached": cached,
+        "image_url": images[0].get("image_url"),
+        "filename": images[0].get("filename"),
+        "images": images,
+        "prompt": request.prompt,
+        "seed": images[0]["seed"],
+        "parameters": {
+            "steps": request.steps,
+            "guidance_scale": request.guidance_scale,
+            "model": request.model,
+            "vae": vae or request.vae,
+            "sampler": request_sampler(request),
+            "width": request.width,
+            "height": request.height,
+            "lora": request.lora_path if (request.lora_path, request.lora_scale) in loras else None,
+            "lora_scale": request.lora_scale,
+            "loras": [list(lora) for lora in loras],
+            "upscale_factor": request.upscale_factor,
+            "negative_embedding": request.negative_embedding,
+            "num_images": request.num_images,
+        },
+    }
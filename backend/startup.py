@@ -0,0 +1,165 @@
+"""
+Arranque no bloqueante del backend
+Carga los modelos de la lista de precarga y hace una inferencia corta de
+calentamiento en segundo plano, mientras la API ya acepta peticiones.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_preload_models(available_models: dict) -> List[str]:
+    """
+    Lista de modelos a precargar.
+
+    Se lee de PRELOAD_MODELS (separados por comas) o, si no existe, de
+    MODEL_NAME. Sin ninguna de las dos se usa el primer modelo local, para
+    no depender de la red al arrancar.
+    """
+    raw = os.getenv("PRELOAD_MODELS") or os.getenv("MODEL_NAME") or ""
+    models = [name.strip() for name in raw.split(",") if name.strip()]
+    if models:
+        return models
+
+    local_models = [
+        key for key, info in available_models.items()
+        if info.get("type") in ("local", "local_file")
+    ]
+    return local_models[:1]
+
+
+class StartupState:
+    """Estado de la precarga, expuesto por el endpoint de readiness"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.status = "pending"  # pending, loading, warming_up, ready, failed
+        self.models: List[str] = []
+        self.loaded: List[str] = []
+        self.errors: dict = {}
+        self.load_seconds: dict = {}
+        self.warmup_seconds: dict = {}
+        self.current: Optional[str] = None
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def set(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            return {
+                "status": self.status,
+                "ready": self.ready,
+                "progress": f"{len(self.loaded)}/{len(self.models)}",
+                "current": self.current,
+                "models": list(self.models),
+                "loaded": list(self.loaded),
+                "errors": dict(self.errors),
+                "load_seconds": dict(self.load_seconds),
+                "warmup_seconds": dict(self.warmup_seconds),
+                "elapsed_seconds": round(elapsed, 2),
+            }
+
+
+class SwitchState:
+    """Estado del último cambio de modelo en segundo plano, expuesto en /health"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.status = "idle"  # idle, loading, ready, failed
+        self.from_model: Optional[str] = None
+        self.to_model: Optional[str] = None
+        self.vae: Optional[str] = None
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def in_progress(self) -> bool:
+        return self.status == "loading"
+
+    def set(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = round((self.finished_at or time.time()) - self.started_at, 2)
+            return {
+                "status": self.status,
+                "from_model": self.from_model,
+                "to_model": self.to_model,
+                "vae": self.vae,
+                "error": self.error,
+                "elapsed_seconds": elapsed,
+            }
+
+
+def run_preload(
+    state: StartupState,
+    models: List[str],
+    load_fn: Callable[[str], None],
+    warmup_fn: Optional[Callable[[str], None]] = None,
+):
+    """Carga y calienta cada modelo de la lista, registrando tiempos y errores"""
+    state.set(models=list(models), status="loading")
+
+    for model_key in models:
+        state.set(current=model_key, status="loading")
+        try:
+            start = time.perf_counter()
+            load_fn(model_key)
+            state.load_seconds[model_key] = round(time.perf_counter() - start, 2)
+
+            if warmup_fn is not None:
+                state.set(status="warming_up")
+                start = time.perf_counter()
+                warmup_fn(model_key)
+                state.warmup_seconds[model_key] = round(time.perf_counter() - start, 2)
+
+            state.loaded.append(model_key)
+            logger.info(f"Modelo precargado: {model_key}")
+        except Exception as e:
+            logger.error(f"Error precargando {model_key}: {e}")
+            state.errors[model_key] = str(e)
+
+    # Listo si se cargó algún modelo o no había nada que precargar
+    failed = bool(models) and not state.loaded
+    state.set(
+        status="failed" if failed else "ready",
+        current=None,
+        finished_at=time.time(),
+    )
+
+
+def start_preload_thread(
+    state: StartupState,
+    models: List[str],
+    load_fn: Callable[[str], None],
+    warmup_fn: Optional[Callable[[str], None]] = None,
+) -> threading.Thread:
+    """Lanza la precarga en un hilo daemon para no bloquear el arranque"""
+    thread = threading.Thread(
+        target=run_preload,
+        args=(state, models, load_fn, warmup_fn),
+        name="model-preload",
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,72 @@
+"""
+Registro de embeddings de textual inversion por modelo
+Un embedding se carga en el tokenizer y el text encoder de un modelo la
+primera vez que se pide y queda registrado en `entry.embedding_tokens`
+(nombre -> token): las peticiones siguientes solo añaden el token al
+prompt. El registro desaparece con la entrada cuando el modelo se expulsa,
+y la caché de embeddings de prompts incluye los tokens cargados en su clave.
+"""
+
+import threading
+from typing import Callable, Optional
+import logging
+
+from backend.enhancement import NegativeEmbedding
+
+logger = logging.getLogger(__name__)
+
+
+class TextualInversionRegistry:
+    """
+    Carga única de embeddings por modelo.
+
+    Args:
+        resolve: Devuelve la ruta del archivo de un embedding por nombre, o None
+    """
+
+    def __init__(self, resolve: Callable[[str], Optional[str]]):
+        self.resolve = resolve
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.failures = 0
+
+    def ensure(self, entry, embedding_name: str) -> Optional[str]:
+        """
+        Token de un embedding para el modelo de `entry`, cargándolo si hace
+        falta; None si no existe o no se pudo cargar. Con `entry.lock` tomado.
+        """
+        token = entry.embedding_tokens.get(embedding_name)
+        if token is not None:
+            with self._lock:
+                self.hits += 1
+            return token
+
+        if entry.engine == "onnx":
+            logger.warning("El motor ONNX no admite textual inversion, se ignora el embedding")
+            return None
+
+        path = self.resolve(embedding_name)
+        if path is None:
+            logger.warning(f"Embedding no encontrado: {embedding_name}")
+            with self._lock:
+                self.failures += 1
+            return None
+
+        token = NegativeEmbedding.token_for(embedding_name)
+        if not NegativeEmbedding.load_embedding(entry.pipe, path, token):
+            with self._lock:
+                self.failures += 1
+            return None
+        entry.embedding_tokens[embedding_name] = token
+        with self._lock:
+            self.loads += 1
+        return token
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "loads": self.loads,
+                "failures": self.failures,
+            }
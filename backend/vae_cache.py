@@ -0,0 +1,120 @@
+"""
+Caché de VAEs intercambiables
+Los VAEs se cargan una sola vez y se reasignan sobre los componentes del
+pipeline activo sin recargar UNet ni text encoder.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class VAECache:
+    """
+    Caché LRU pequeña de VAEs ya cargados en el device.
+
+    El número máximo de VAEs residentes se lee de VAE_CACHE_SIZE y su memoria
+    total de VAE_CACHE_MAX_MB (medida con `size_fn`; sin ella solo cuenta el
+    número). El VAE más reciente nunca se expulsa aunque por sí solo supere
+    el presupuesto. Un VAE expulsado que siga asignado a un pipeline no se
+    libera hasta que ese pipeline vuelva a su VAE o se expulse.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], object],
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        size_fn: Optional[Callable[[object], int]] = None,
+    ):
+        if max_entries is None:
+            max_entries = int(os.getenv("VAE_CACHE_SIZE", "3"))
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("VAE_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+        self.loader = loader
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.size_fn = size_fn
+        self._entries: "OrderedDict[str, object]" = OrderedDict()
+        # vae_key -> bytes (0 sin size_fn)
+        self._sizes: Dict[str, int] = {}
+        # Cargas en curso por vae_key
+        self._loading: Dict[str, Future] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, vae_key: str):
+        """
+        Devuelve el VAE pedido, cargándolo desde disco solo la primera vez.
+        La carga va fuera del lock, así que mientras un VAE se carga en frío
+        los demás se siguen sirviendo; quien pide el mismo VAE espera a esa
+        carga en lugar de lanzar otra.
+        """
+        while True:
+            with self._lock:
+                vae = self._entries.get(vae_key)
+                if vae is not None:
+                    self._entries.move_to_end(vae_key)
+                    self.hits += 1
+                    return vae
+                future = self._loading.get(vae_key)
+                start = future is None
+                if start:
+                    self.misses += 1
+                    future = Future()
+                    self._loading[vae_key] = future
+
+            if not start:
+                # Propaga el error de carga; si no, vuelve a buscar el VAE recién publicado
+                future.result()
+                continue
+
+            try:
+                vae = self.loader(vae_key)
+                size = self.size_fn(vae) if self.size_fn is not None else 0
+            except Exception as e:
+                with self._lock:
+                    self._loading.pop(vae_key, None)
+                future.set_exception(e)
+                raise
+
+            with self._lock:
+                self._entries[vae_key] = vae
+                self._sizes[vae_key] = size
+                self._loading.pop(vae_key, None)
+                while len(self._entries) > 1 and (
+                    len(self._entries) > self.max_entries or sum(self._sizes.values()) > self.max_bytes
+                ):
+                    evicted_key, _ = self._entries.popitem(last=False)
+                    self._sizes.pop(evicted_key, None)
+                    self.evictions += 1
+                    logger.info(f"Expulsando VAE de la caché: {evicted_key}")
+            future.set_result(vae)
+            return vae
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "vaes": list(self._entries.keys()),
+                "loading": sorted(self._loading.keys()),
+                "max_vaes": self.max_entries,
+                "used_mb": round(sum(self._sizes.values()) / (1024 * 1024), 1),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def swap_vae(entry, vae) -> None:
+    """Asigna un VAE a los pipelines txt2img, img2img e inpaint de una entrada"""
+    for pipeline in (entry.pipe, entry.img2img_pipe, entry.inpaint_pipe):
+        if pipeline is not None:
+            pipeline.vae = vae
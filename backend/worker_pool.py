@@ -0,0 +1,342 @@
+"""
+Pool de procesos de inferencia
+El gateway reparte los trabajos entre INFERENCE_PROCESSES procesos worker
+(backend.inference_worker). Si un worker muere, su trabajo en curso falla
+con un error y el proceso se vuelve a lanzar; el gateway sigue sirviendo.
+Los relanzamientos seguidos sin llegar a estar listo esperan cada vez el
+doble (WORKER_RESTART_BACKOFF_SECONDS, hasta WORKER_RESTART_BACKOFF_MAX_SECONDS)
+y, pasados WORKER_MAX_RESTARTS, el worker queda marcado como fallido en
+/health en lugar de relanzarse en bucle.
+"""
+
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+
+from backend.inference_worker import worker_main
+from backend.ipc import materialize_result
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de comprobación de workers caídos
+MONITOR_INTERVAL_SECONDS = 1.0
+
+# (modelo, vae, ((ruta_lora, escala), ...)) de un trabajo
+WorkerKey = Tuple[str, str, Tuple[Tuple[str, float], ...]]
+
+
+def _key_score(key: WorkerKey, last: WorkerKey) -> int:
+    """Coincidencia de un trabajo con lo que tiene cargado un worker (ver WorkerPool.affinity)"""
+    if key[0] != last[0]:
+        return 0
+    return 1 + (key[1] == last[1]) + (key[2] == last[2])
+
+
+class WorkerSlot:
+    """Estado de un proceso worker visto desde el gateway"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.task_queue = None
+        self.pid: Optional[int] = None
+        self.ready = False
+        self.startup: Optional[dict] = None
+        # Dispositivo y autocast del proceso ({"device", "bf16"}), anunciados al arrancar
+        self.settings: Optional[dict] = None
+        self.task_id: Optional[int] = None
+        self.reserved = False
+        # Relanzamientos seguidos sin llegar a "ready" y cuándo toca el siguiente
+        self.restart_attempts = 0
+        self.next_restart_at: Optional[float] = None
+        self.failed = False
+        # (modelo, vae, loras) del último trabajo enviado: lo que probablemente tiene cargado
+        self.last_key: Optional[WorkerKey] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def idle(self) -> bool:
+        return not self.reserved and self.alive
+
+    def to_dict(self) -> dict:
+        return {
+            "index": self.index,
+            "pid": self.pid,
+            "alive": self.alive,
+            "ready": self.ready,
+            "busy": self.reserved,
+            "failed": self.failed,
+            "restart_attempts": self.restart_attempts,
+            "model": self.last_key[0] if self.last_key else None,
+            "vae": self.last_key[1] if self.last_key else None,
+            "loras": [list(lora) for lora in self.last_key[2]] if self.last_key else [],
+        }
+
+
+class _Task:
+    def __init__(self, task_id: int, slot: WorkerSlot, on_progress: Optional[Callable]):
+        self.id = task_id
+        self.slot = slot
+        self.on_progress = on_progress
+        self.future: Future = Future()
+
+
+class WorkerPool:
+    """
+    Procesos de inferencia comunicados por colas de multiprocessing.
+
+    Args:
+        num_workers: Número de procesos (INFERENCE_PROCESSES, por defecto 1)
+        max_restarts: Relanzamientos seguidos de un worker que no llega a estar
+            listo antes de darlo por fallido (WORKER_MAX_RESTARTS, por defecto 5)
+        backoff: Espera antes del primer relanzamiento, que se dobla en cada
+            intento (WORKER_RESTART_BACKOFF_SECONDS, por defecto 1)
+        max_backoff: Espera máxima entre relanzamientos (WORKER_RESTART_BACKOFF_MAX_SECONDS, por defecto 60)
+    """
+
+    def __init__(
+        self,
+        num_workers: Optional[int] = None,
+        max_restarts: Optional[int] = None,
+        backoff: Optional[float] = None,
+        max_backoff: Optional[float] = None,
+    ):
+        if max_restarts is None:
+            max_restarts = int(os.getenv("WORKER_MAX_RESTARTS", "5"))
+        if backoff is None:
+            backoff = float(os.getenv("WORKER_RESTART_BACKOFF_SECONDS", "1"))
+        if max_backoff is None:
+            max_backoff = float(os.getenv("WORKER_RESTART_BACKOFF_MAX_SECONDS", "60"))
+        self.num_workers = num_workers or int(os.getenv("INFERENCE_PROCESSES", "1"))
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # spawn: los workers no heredan el estado del gateway y CUDA funciona
+        self._ctx = multiprocessing.get_context("spawn")
+        self._result_queue = self._ctx.Queue()
+        self._cancel_flags = self._ctx.Array("q", self.num_workers)
+        self._slots = [WorkerSlot(index) for index in range(self.num_workers)]
+        self._tasks: Dict[int, _Task] = {}
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+        self._started = False
+        self._stopping = False
+        self.restarts = 0
+
+    # ---------- Ciclo de vida ----------
+
+    def start(self):
+        """Lanza los procesos y los hilos de escucha y vigilancia (idempotente)"""
+        if self._started:
+            return
+        self._started = True
+        for slot in self._slots:
+            self._spawn(slot)
+        threading.Thread(target=self._listen, name="worker-pool-results", daemon=True).start()
+        threading.Thread(target=self._monitor, name="worker-pool-monitor", daemon=True).start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping = True
+        for slot in self._slots:
+            if slot.alive:
+                slot.task_queue.put(None)
+        deadline = time.time() + timeout
+        for slot in self._slots:
+            if slot.process is None:
+                continue
+            slot.process.join(max(0.0, deadline - time.time()))
+            if slot.process.is_alive():
+                slot.process.terminate()
+
+    def _spawn(self, slot: WorkerSlot):
+        slot.task_queue = self._ctx.Queue()
+        slot.ready = False
+        slot.startup = None
+        slot.settings = None
+        slot.last_key = None
+        slot.process = self._ctx.Process(
+            target=worker_main,
+            args=(slot.index, self.num_workers, slot.task_queue, self._result_queue, self._cancel_flags),
+            name=f"inference-worker-{slot.index}",
+            daemon=True,
+        )
+        slot.process.start()
+        slot.pid = slot.process.pid
+        logger.info(f"Worker de inferencia {slot.index} lanzado (pid {slot.pid})")
+
+    # ---------- Ejecución ----------
+
+    def affinity(self, key: WorkerKey) -> int:
+        """
+        Mejor coincidencia entre los workers con la última combinación que
+        ejecutaron: 0 si ninguno tiene el modelo; si alguno lo tiene, 1 más un
+        punto por el mismo VAE y otro por los mismos LoRAs.
+        """
+        with self._cond:
+            keys = [slot.last_key for slot in self._slots if slot.last_key]
+        return max((_key_score(key, last) for last in keys), default=0)
+
+    def _acquire(self, key: Optional[WorkerKey]) -> WorkerSlot:
+        """Reserva un worker libre, prefiriendo el que ya tiene cargado el modelo"""
+        with self._cond:
+            while True:
+                if all(slot.failed for slot in self._slots):
+                    raise RuntimeError("Ningún worker de inferencia disponible: todos fallaron al arrancar")
+                idle = [slot for slot in self._slots if slot.idle]
+                if idle:
+                    break
+                self._cond.wait()
+
+            def preference(slot: WorkerSlot) -> tuple:
+                score = _key_score(key, slot.last_key) if key is not None and slot.last_key else 0
+                return (score, slot.ready)
+
+            slot = max(idle, key=preference)
+            slot.reserved = True
+            if key is not None:
+                slot.last_key = key
+            return slot
+
+    def _release(self, slot: WorkerSlot, task: _Task):
+        with self._cond:
+            self._tasks.pop(task.id, None)
+            if slot.task_id == task.id:
+                slot.task_id = None
+            slot.reserved = False
+            self._cond.notify_all()
+
+    def run(
+        self,
+        kind: str,
+        payload: Any,
+        key: Optional[WorkerKey] = None,
+        on_progress: Optional[Callable[[int, dict, Optional[List[str]]], None]] = None,
+        should_cancel: Optional[Callable[[], bool]] = None,
+    ) -> Any:
+        """
+        Ejecuta un trabajo en un worker y espera su resultado (bloqueante).
+        Las imágenes del resultado siguen en memoria compartida: ver ipc.materialize_result.
+        """
+        slot = self._acquire(key)
+        with self._cond:
+            task = _Task(next(self._ids), slot, on_progress)
+            self._tasks[task.id] = task
+            slot.task_id = task.id
+        try:
+            slot.task_queue.put((task.id, kind, payload))
+            cancel_sent = False
+            while True:
+                try:
+                    return task.future.result(timeout=0.1)
+                except FutureTimeout:
+                    if not cancel_sent and should_cancel is not None and should_cancel():
+                        self._cancel_flags[slot.index] = task.id
+                        cancel_sent = True
+        finally:
+            self._release(slot, task)
+
+    # ---------- Hilos de fondo ----------
+
+    def _listen(self):
+        while True:
+            try:
+                message = self._result_queue.get()
+            except (EOFError, OSError):
+                return
+            kind = message[0]
+            if kind == "ready":
+                _, index, pid, startup, settings = message
+                with self._cond:
+                    slot = self._slots[index]
+                    if slot.pid == pid:
+                        slot.ready = True
+                        slot.startup = startup
+                        slot.settings = settings
+                        slot.restart_attempts = 0
+            elif kind == "progress":
+                _, task_id, slot_index, event, previews = message
+                task = self._tasks.get(task_id)
+                if task is not None and task.on_progress is not None:
+                    try:
+                        task.on_progress(slot_index, event, previews)
+                    except Exception as e:
+                        logger.warning(f"Error publicando el progreso de la tarea {task_id}: {e}")
+            elif kind == "result":
+                _, task_id, result = message
+                task = self._tasks.get(task_id)
+                if task is None or task.future.done():
+                    # Nadie espera ya este resultado: liberar la memoria compartida
+                    for item in result if isinstance(result, list) else [result]:
+                        materialize_result(item, save=False)
+                    continue
+                task.future.set_result(result)
+
+    def _monitor(self):
+        while not self._stopping:
+            time.sleep(MONITOR_INTERVAL_SECONDS)
+            for slot in self._slots:
+                if self._stopping or slot.failed or slot.process is None or slot.process.is_alive():
+                    continue
+                if slot.next_restart_at is None:
+                    self._worker_died(slot)
+                if not slot.failed and time.monotonic() >= slot.next_restart_at:
+                    slot.next_restart_at = None
+                    with self._cond:
+                        self.restarts += 1
+                    self._spawn(slot)
+                with self._cond:
+                    self._cond.notify_all()
+
+    def _worker_died(self, slot: WorkerSlot):
+        """Falla el trabajo en curso y programa el relanzamiento con backoff, o marca el worker como fallido"""
+        exitcode = slot.process.exitcode
+        slot.ready = False
+        with self._cond:
+            task = self._tasks.get(slot.task_id) if slot.task_id is not None else None
+            slot.restart_attempts += 1
+            if slot.restart_attempts > self.max_restarts:
+                slot.failed = True
+        if task is not None and not task.future.done():
+            task.future.set_result({
+                "success": False,
+                "error": f"El worker de inferencia terminó inesperadamente (código {exitcode})",
+            })
+        if slot.failed:
+            logger.error(
+                f"Worker de inferencia {slot.index} terminó (código {exitcode}) tras "
+                f"{self.max_restarts} relanzamientos seguidos; se da por fallido"
+            )
+            return
+        delay = min(self.max_backoff, self.backoff * 2 ** (slot.restart_attempts - 1))
+        slot.next_restart_at = time.monotonic() + delay
+        logger.error(
+            f"Worker de inferencia {slot.index} terminó (código {exitcode}); relanzando en {delay:.0f}s "
+            f"(intento {slot.restart_attempts}/{self.max_restarts})"
+        )
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "processes": self.num_workers,
+                "ready": sum(1 for slot in self._slots if slot.ready),
+                "restarts": self.restarts,
+                "failed": sum(1 for slot in self._slots if slot.failed),
+                "workers": [slot.to_dict() for slot in self._slots],
+            }
+
+    def inference_settings(self) -> Optional[dict]:
+        """Dispositivo y autocast de los workers (todos comparten entorno), o None si ninguno está listo"""
+        with self._cond:
+            return next((slot.settings for slot in self._slots if slot.ready), None)
+
+    @property
+    def ready(self) -> bool:
+        return any(slot.ready for slot in self._slots)
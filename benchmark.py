@@ -0,0 +1,193 @@
+"""
+Script de benchmarks del backend
+Mide la latencia por step del bucle de denoising con distintas optimizaciones
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+import torch
+from diffusers import StableDiffusionPipeline
+
+# Configurar logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_pipeline(model: str, device: str, dtype: torch.dtype = None):
+    """Carga un pipeline desde carpeta diffusers, archivo único o Hugging Face"""
+    if dtype is None:
+        dtype = torch.float16 if device == "cuda" else torch.float32
+    if model.endswith((".safetensors", ".ckpt")):
+        pipe = StableDiffusionPipeline.from_single_file(model, torch_dtype=dtype, load_safety_checker=False)
+    else:
+        pipe = StableDiffusionPipeline.from_pretrained(model, torch_dtype=dtype, safety_checker=None)
+    return pipe.to(device)
+
+
+def measure_step_latency(pipe, device: str, steps: int, width: int, height: int, runs: int) -> dict:
+    """
+    Ejecuta el pipeline `runs` veces y devuelve la latencia por step.
+    Los tiempos salen del callback de cada step, así que excluyen el
+    text encoder y el decode del VAE.
+    """
+    step_times = []
+    totals = []
+    for run in range(runs):
+        marks = []
+
+        def on_step_end(pipeline, step, timestep, callback_kwargs):
+            if device == "cuda":
+                torch.cuda.synchronize()
+            marks.append(time.perf_counter())
+            return callback_kwargs
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            pipe(
+                prompt="a photo of an astronaut riding a horse",
+                num_inference_steps=steps,
+                width=width,
+                height=height,
+                generator=torch.Generator(device=device).manual_seed(run),
+                callback_on_step_end=on_step_end,
+            )
+        totals.append(time.perf_counter() - start)
+        step_times.extend(b - a for a, b in zip(marks, marks[1:]))
+
+    return {
+        "step_ms_mean": statistics.mean(step_times) * 1000,
+        "step_ms_median": statistics.median(step_times) * 1000,
+        "total_s_mean": statistics.mean(totals),
+    }
+
+
+def print_results(results: dict):
+    """Imprime una tabla con los resultados de cada variante"""
+    print(f"\n{'variante':<20} {'step medio (ms)':>16} {'step mediana (ms)':>18} {'total (s)':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<20} {result['step_ms_mean']:>16.1f} "
+            f"{result['step_ms_median']:>18.1f} {result['total_s_mean']:>10.2f}"
+        )
+    baseline = next(iter(results.values()))
+    for name, result in list(results.items())[1:]:
+        speedup = baseline["step_ms_mean"] / result["step_ms_mean"]
+        print(f"\n{name}: x{speedup:.2f} respecto a la primera variante")
+    print()
+
+
+def benchmark_compile(args):
+    """Latencia por step en eager frente a torch.compile"""
+    from backend.compile_mode import compile_pipeline, warmup_compiled
+
+    pipe = load_pipeline(args.model, args.device)
+    results = {}
+
+    # Un run descartado para calentar también el modo eager
+    measure_step_latency(pipe, args.device, 2, args.width, args.height, 1)
+    results["eager"] = measure_step_latency(pipe, args.device, args.steps, args.width, args.height, args.runs)
+
+    start = time.perf_counter()
+    compile_pipeline(pipe)
+    warmup_compiled(pipe, args.device, sizes=[(args.width, args.height)])
+    logger.info(f"Compilación + calentamiento: {time.perf_counter() - start:.1f}s")
+    results["torch.compile"] = measure_step_latency(pipe, args.device, args.steps, args.width, args.height, args.runs)
+
+    print_results(results)
+
+
+def benchmark_quantize(args):
+    """Latencia por step y memoria en float32 frente a int8 dinámico (CPU)"""
+    from backend.quantization import QUANTIZED_COMPONENTS, module_bytes
+
+    pipe = load_pipeline(args.model, "cpu", torch.float32)
+    results = {}
+
+    fp32_bytes = sum(module_bytes(getattr(pipe, name)) for name in QUANTIZED_COMPONENTS)
+    measure_step_latency(pipe, "cpu", 2, args.width, args.height, 1)
+    results["fp32"] = measure_step_latency(pipe, "cpu", args.steps, args.width, args.height, args.runs)
+
+    for name in QUANTIZED_COMPONENTS:
+        module = getattr(pipe, name)
+        setattr(pipe, name, torch.ao.quantization.quantize_dynamic(
+            module, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        ))
+    int8_bytes = sum(module_bytes(getattr(pipe, name)) for name in QUANTIZED_COMPONENTS)
+    measure_step_latency(pipe, "cpu", 2, args.width, args.height, 1)
+    results["int8"] = measure_step_latency(pipe, "cpu", args.steps, args.width, args.height, args.runs)
+
+    print_results(results)
+    print(
+        f"Memoria text encoder + UNet: {fp32_bytes / 2**20:.0f} MB (fp32) -> "
+        f"{int8_bytes / 2**20:.0f} MB (int8), ahorro {(fp32_bytes - int8_bytes) / 2**20:.0f} MB\n"
+    )
+
+
+def benchmark_batching(args):
+    """Imágenes por segundo generando N peticiones una a una frente a un solo lote"""
+    pipe = load_pipeline(args.model, args.device)
+    prompts = [f"a photo of an astronaut riding a horse, variation {i}" for i in range(args.batch_size)]
+
+    def run(batch_prompts, seeds):
+        generators = [torch.Generator(device=args.device).manual_seed(seed) for seed in seeds]
+        with torch.no_grad():
+            pipe(
+                prompt=batch_prompts,
+                num_inference_steps=args.steps,
+                width=args.width,
+                height=args.height,
+                generator=generators,
+            )
+
+    # Calentamiento
+    run(prompts[:1], [0])
+
+    start = time.perf_counter()
+    for run_index in range(args.runs):
+        for i, prompt in enumerate(prompts):
+            run([prompt], [run_index * args.batch_size + i])
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for run_index in range(args.runs):
+        run(prompts, [run_index * args.batch_size + i for i in range(args.batch_size)])
+    batched = time.perf_counter() - start
+
+    images = args.runs * args.batch_size
+    print(f"\n{'variante':<20} {'imágenes/s':>12} {'s/imagen':>10}")
+    print(f"{'secuencial':<20} {images / sequential:>12.3f} {sequential / images:>10.2f}")
+    print(f"{f'lote de {args.batch_size}':<20} {images / batched:>12.3f} {batched / images:>10.2f}")
+    print(f"\nLote: x{sequential / batched:.2f} de throughput respecto a secuencial\n")
+
+
+def main():
+    """Función principal"""
+    parser = argparse.ArgumentParser(description="Benchmarks del backend de generación")
+    parser.add_argument(
+        "command",
+        choices=["compile", "quantize", "batching"],
+        help="Benchmark a ejecutar"
+    )
+    parser.add_argument("--model", default="runwayml/stable-diffusion-v1-5", help="Ruta o id del modelo")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--width", type=int, default=512)
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=4, help="Tamaño de lote (benchmark batching)")
+
+    args = parser.parse_args()
+
+    if args.command == "compile":
+        benchmark_compile(args)
+    elif args.command == "quantize":
+        benchmark_quantize(args)
+    elif args.command == "batching":
+        benchmark_batching(args)
+
+
+if __name__ == "__main__":
+    main()
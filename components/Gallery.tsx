@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import Image from "next/image";
 
 interface ImageMetadata {
@@ -25,9 +25,23 @@ interface GalleryImage {
   metadata?: ImageMetadata;
 }
 
+interface GalleryPage {
+  success: boolean;
+  total: number;
+  images: GalleryImage[];
+  next_cursor: string | null;
+}
+
+const GALLERY_URL = "http://localhost:8000/api/gallery";
+
 export default function Gallery() {
   const [images, setImages] = useState<GalleryImage[]>([]);
+  const [total, setTotal] = useState(0);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  // Con páginas extra cargadas, el refresco solo añade las imágenes nuevas arriba
+  const loadedMore = useRef(false);
   const [selectedImage, setSelectedImage] = useState<GalleryImage | null>(null);
   const [copiedPrompt, setCopiedPrompt] = useState(false);
 
@@ -37,12 +51,28 @@ export default function Gallery() {
     return () => clearInterval(interval);
   }, []);
 
+  const fetchPage = async (cursor: string | null): Promise<GalleryPage | null> => {
+    const url = cursor ? `${GALLERY_URL}?cursor=${encodeURIComponent(cursor)}` : GALLERY_URL;
+    const response = await fetch(url);
+    const data = await response.json();
+    return data.success && data.images ? data : null;
+  };
+
+  // Primera página: al abrir, al pulsar Actualizar y cada pocos segundos
   const fetchGallery = async () => {
     try {
-      const response = await fetch("http://localhost:8000/api/gallery");
-      const data = await response.json();
-      if (data.success && data.images) {
-        setImages(data.images);
+      const data = await fetchPage(null);
+      if (data) {
+        setTotal(data.total);
+        if (loadedMore.current) {
+          setImages((prev) => {
+            const known = new Set(prev.map((image) => image.filename));
+            return [...data.images.filter((image) => !known.has(image.filename)), ...prev];
+          });
+        } else {
+          setImages(data.images);
+          setNextCursor(data.next_cursor);
+        }
       }
     } catch (error) {
       console.error("Error cargando galería:", error);
@@ -51,6 +81,28 @@ export default function Gallery() {
     }
   };
 
+  // Página siguiente a partir del next_cursor de la última cargada
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    setLoadingMore(true);
+    try {
+      const data = await fetchPage(nextCursor);
+      if (data) {
+        loadedMore.current = true;
+        setTotal(data.total);
+        setImages((prev) => {
+          const known = new Set(prev.map((image) => image.filename));
+          return [...prev, ...data.images.filter((image) => !known.has(image.filename))];
+        });
+        setNextCursor(data.next_cursor);
+      }
+    } catch (error) {
+      console.error("Error cargando más imágenes:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const copyToClipboard = (text: string) => {
     navigator.clipboard.writeText(text);
     setCopiedPrompt(true);
@@ -68,7 +120,7 @@ export default function Gallery() {
     <div className="space-y-6">
       <div className="glass-effect rounded-2xl p-6">
         <div className="flex justify-between items-center mb-6">
-          <h2 className="text-2xl font-bold text-white">📸 Galería ({images.length})</h2>
+          <h2 className="text-2xl font-bold text-white">📸 Galería ({total})</h2>
           <button
             onClick={fetchGallery}
             disabled={loading}
@@ -127,6 +179,22 @@ export default function Gallery() {
               ))}
             </div>
 
+            {/* Paginación */}
+            {nextCursor && (
+              <div className="flex flex-col items-center gap-2 mb-6">
+                <p className="text-gray-400 text-sm">
+                  Mostrando {images.length} de {total}
+                </p>
+                <button
+                  onClick={loadMore}
+                  disabled={loadingMore}
+                  className="px-4 py-2 bg-white/10 hover:bg-white/20 rounded-lg font-semibold text-white disabled:opacity-50 transition"
+                >
+                  {loadingMore ? "🔄..." : "⬇️ Cargar más"}
+                </button>
+              </div>
+            )}
+
             {/* Panel de detalles */}
             {selectedImage && selectedImage.metadata && (
               <div className="glass-effect rounded-2xl p-6 space-y-4">
@@ -0,0 +1,85 @@
+"""
+Endpoints img2img de backend.job_api: la petición llega como JSON en el
+campo de formulario `request`, con la imagen en image_file o por image_hash.
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import generation_store
+from backend.job_api import create_jobs_router
+from backend.jobs import JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(generation_store, "UPLOADS_DIR", tmp_path)
+    # Sin start(): los trabajos se quedan en cola y el test inspecciona su payload
+    return JobQueue(runner=lambda job: {"success": True})
+
+
+@pytest.fixture
+def client(queue):
+    app = FastAPI()
+    app.include_router(create_jobs_router(queue))
+    return TestClient(app)
+
+
+def _pending_payload(queue: JobQueue, job_id: str):
+    return queue.get(job_id).payload
+
+
+def test_image2image_job_with_image_hash_only(client, queue):
+    image_hash = generation_store.store_upload(b"fake png bytes")
+
+    response = client.post(
+        "/api/jobs/image2image",
+        data={"request": json.dumps({"prompt": "a castle", "image_hash": image_hash, "strength": 0.5})},
+    )
+
+    assert response.status_code == 202
+    body = response.json()
+    assert body["success"] is True
+    request, image_data = _pending_payload(queue, body["job_id"])
+    assert request.image_hash == image_hash
+    assert request.strength == 0.5
+    # Los bytes no viajan con el trabajo: el worker los lee si no los tiene en caché
+    assert image_data is None
+
+
+def test_image2image_job_with_file_stores_upload(client, queue):
+    response = client.post(
+        "/api/jobs/image2image",
+        data={"request": json.dumps({"prompt": "a castle"})},
+        files={"image_file": ("source.png", b"other png bytes", "image/png")},
+    )
+
+    assert response.status_code == 202
+    request, image_data = _pending_payload(queue, response.json()["job_id"])
+    assert image_data == b"other png bytes"
+    assert request.image_hash == generation_store.upload_hash(b"other png bytes")
+    assert generation_store.load_upload(request.image_hash) == b"other png bytes"
+
+
+def test_image2image_job_with_unknown_hash(client):
+    response = client.post(
+        "/api/jobs/image2image",
+        data={"request": json.dumps({"prompt": "a castle", "image_hash": "0" * 64})},
+    )
+
+    assert response.json() == {"success": False, "error": f"Imagen de origen no encontrada: {'0' * 64}"}
+
+
+def test_image2image_job_with_invalid_request(client):
+    response = client.post("/api/jobs/image2image", data={"request": json.dumps({"strength": 0.5})})
+
+    body = response.json()
+    assert body["success"] is False
+    assert body["error"].startswith("Petición inválida")
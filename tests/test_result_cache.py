@@ -0,0 +1,43 @@
+"""
+Claves de backend.result_cache: una imagen se guarda con los LoRAs y el
+VAE que se aplicaron de verdad y se busca con los pedidos.
+"""
+
+import pytest
+
+pytest.importorskip("pydantic")
+
+from backend.result_cache import generation_variant, image_cache_key, request_cache_keys
+from backend.schemas import GenerateRequest
+
+VARIANT = generation_variant("torch", "fp32", "model-hash", bf16=False)
+
+
+def test_image_stored_without_failed_lora_is_not_served_for_lora_request():
+    request = GenerateRequest(prompt="a castle", seed=7, lora_path="loras/style.safetensors")
+
+    # El LoRA no pudo cargarse: la imagen se guarda sin él
+    stored_key = image_cache_key(request, 7, VARIANT, loras=[])
+
+    assert request_cache_keys(request, VARIANT) != [stored_key]
+    plain = GenerateRequest(prompt="a castle", seed=7)
+    assert request_cache_keys(plain, VARIANT) == [stored_key]
+
+
+def test_image_stored_with_applied_loras_matches_request():
+    request = GenerateRequest(prompt="a castle", seed=7, lora_path="loras/style.safetensors", lora_scale=0.5)
+
+    stored_key = image_cache_key(request, 7, VARIANT, loras=[("loras/style.safetensors", 0.5)])
+
+    assert request_cache_keys(request, VARIANT) == [stored_key]
+
+
+def test_image_stored_with_model_vae_is_not_served_for_other_vae():
+    request = GenerateRequest(prompt="a castle", seed=7, vae="vae-ft-mse")
+
+    # Motor ONNX: la imagen se genera con el VAE del modelo aunque se pida otro
+    stored_key = image_cache_key(request, 7, VARIANT, vae="default")
+
+    assert request_cache_keys(request, VARIANT) != [stored_key]
+    plain = GenerateRequest(prompt="a castle", seed=7)
+    assert request_cache_keys(plain, VARIANT) == [stored_key]
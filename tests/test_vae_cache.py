@@ -0,0 +1,89 @@
+"""
+backend.vae_cache.VAECache: la carga de un VAE en frío no bloquea a los
+demás y dos peticiones del mismo VAE comparten una sola carga.
+"""
+
+import threading
+
+import pytest
+
+from backend.vae_cache import VAECache
+
+
+class SlowLoader:
+    """Loader que se queda cargando `slow_key` hasta que se libera `release`"""
+
+    def __init__(self, slow_key: str):
+        self.slow_key = slow_key
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def __call__(self, vae_key: str):
+        self.calls.append(vae_key)
+        if vae_key == self.slow_key:
+            self.started.set()
+            assert self.release.wait(5)
+        if vae_key == "broken":
+            raise OSError("archivo corrupto")
+        return f"vae:{vae_key}"
+
+
+def _get_in_thread(cache: VAECache, vae_key: str, results: dict):
+    def run():
+        try:
+            results[vae_key] = cache.get(vae_key)
+        except Exception as e:
+            results[vae_key] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_cold_load_does_not_block_other_vaes():
+    loader = SlowLoader("slow")
+    cache = VAECache(loader=loader, max_entries=3)
+    cache.get("fast")
+
+    results = {}
+    thread = _get_in_thread(cache, "slow", results)
+    assert loader.started.wait(5)
+
+    # Mientras "slow" carga, los VAEs ya residentes y otras cargas siguen sirviendo
+    assert cache.get("fast") == "vae:fast"
+    assert cache.get("other") == "vae:other"
+    assert cache.stats()["loading"] == ["slow"]
+
+    loader.release.set()
+    thread.join(5)
+    assert results["slow"] == "vae:slow"
+    assert cache.stats()["loading"] == []
+
+
+def test_concurrent_requests_share_one_load():
+    loader = SlowLoader("slow")
+    cache = VAECache(loader=loader, max_entries=3)
+
+    results_a, results_b = {}, {}
+    first = _get_in_thread(cache, "slow", results_a)
+    assert loader.started.wait(5)
+    second = _get_in_thread(cache, "slow", results_b)
+
+    loader.release.set()
+    first.join(5)
+    second.join(5)
+    assert results_a["slow"] == results_b["slow"] == "vae:slow"
+    assert loader.calls == ["slow"]
+
+
+def test_failed_load_is_not_cached():
+    loader = SlowLoader("none")
+    cache = VAECache(loader=loader, max_entries=3)
+
+    with pytest.raises(OSError):
+        cache.get("broken")
+    with pytest.raises(OSError):
+        cache.get("broken")
+    assert loader.calls == ["broken", "broken"]
+    assert cache.stats()["loading"] == []
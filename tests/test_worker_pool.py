@@ -0,0 +1,91 @@
+"""
+backend.worker_pool.WorkerPool sin lanzar procesos: afinidad de los
+trabajos con lo que cada worker dejó cargado y relanzamiento con backoff
+de los workers que mueren.
+"""
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from backend.worker_pool import WorkerPool, _Task
+
+STYLE = (("loras/style.safetensors", 0.75),)
+
+
+class FakeProcess:
+    """Proceso worker simulado (vivo o terminado con `exitcode`)"""
+
+    def __init__(self, alive: bool = True, exitcode=None):
+        self._alive = alive
+        self.exitcode = exitcode
+
+    def is_alive(self) -> bool:
+        return self._alive
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(num_workers=2)
+    pool._slots[0].last_key = ("sd15", "default", STYLE)
+    pool._slots[1].last_key = ("sdxl", "vae-ft-mse", ())
+    return pool
+
+
+def test_affinity_prefers_same_loras(pool):
+    assert pool.affinity(("sd15", "default", STYLE)) == 3
+    assert pool.affinity(("sd15", "default", ())) == 2
+    assert pool.affinity(("sd15", "vae-ft-mse", STYLE)) == 2
+    assert pool.affinity(("sd15", "vae-ft-mse", ())) == 1
+    assert pool.affinity(("other", "default", STYLE)) == 0
+
+
+def test_acquire_picks_worker_with_same_loras(pool):
+    pool._slots[1].last_key = ("sd15", "default", ())
+    for slot in pool._slots:
+        slot.process = FakeProcess()
+
+    slot = pool._acquire(("sd15", "default", STYLE))
+
+    assert slot.index == 0
+    assert slot.reserved
+
+
+def test_crashing_worker_backs_off_then_fails(monkeypatch):
+    pool = WorkerPool(num_workers=1, max_restarts=2, backoff=1.0, max_backoff=60.0)
+    slot = pool._slots[0]
+    monkeypatch.setattr("backend.worker_pool.time.monotonic", lambda: 100.0)
+
+    delays = []
+    for _ in range(2):
+        slot.process = FakeProcess(alive=False, exitcode=1)
+        pool._worker_died(slot)
+        delays.append(slot.next_restart_at - 100.0)
+        slot.next_restart_at = None
+    assert delays == [1.0, 2.0]
+    assert not slot.failed
+
+    slot.process = FakeProcess(alive=False, exitcode=1)
+    pool._worker_died(slot)
+    assert slot.failed
+    assert pool.stats()["failed"] == 1
+    assert pool.stats()["workers"][0]["failed"] is True
+    # Sin workers utilizables el trabajo falla en lugar de esperar para siempre
+    with pytest.raises(RuntimeError):
+        pool._acquire(None)
+
+
+def test_worker_died_fails_running_task(pool):
+    slot = pool._slots[0]
+    slot.process = FakeProcess(alive=False, exitcode=-9)
+    task = _Task(7, slot, on_progress=None)
+    pool._tasks[7] = task
+    slot.task_id = 7
+
+    pool._worker_died(slot)
+
+    assert task.future.result(0) == {
+        "success": False,
+        "error": "El worker de inferencia terminó inesperadamente (código -9)",
+    }